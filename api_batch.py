@@ -0,0 +1,147 @@
+"""
+Batching of small Google API calls.
+
+Calls such as permission creation, file deletion or document creation
+carry almost no payload, so their cost is the HTTP round trip.
+BatchQueue collects them and sends up to 100 at a time as one multipart
+batch request (googleapiclient's ``new_batch_http_request``), then hands
+each result back to the callback it was queued with.
+"""
+
+import threading
+from typing import Callable, Optional
+
+from googleapiclient.errors import HttpError
+
+
+# Most Google APIs reject batches with more than 100 calls
+MAX_BATCH_SIZE = 100
+# Statuses worth retrying: rate limits and transient server errors
+RETRYABLE_STATUSES = {403, 429, 500, 502, 503, 504}
+
+
+class BatchQueue:
+    """
+    Queue small API calls and send them as batch requests.
+
+    Calls are queued as functions that build the request from a service,
+    so requests are always built from (and sent over) the queue's own
+    service, even when they are queued from other threads. flush() must
+    be called from the thread that owns the service. Sub-requests that
+    fail with a retryable status are retried one at a time, and so are
+    all calls of a batch request that fails as a whole. A callback
+    that raises does not keep the others from running; flush() raises
+    its exception once every callback has run.
+    """
+
+    def __init__(self, service, max_batch_size: int = MAX_BATCH_SIZE,
+                 retries: int = 3, stats=None):
+        """
+        Initialize the queue.
+
+        Args:
+            service: googleapiclient service the calls belong to
+            max_batch_size: Maximum calls per batch request
+            retries: Retries for a sub-request sent again on its own
+            stats: Optional UploadStats that counts the requests made
+        """
+        self.service = service
+        self.max_batch_size = max(1, min(max_batch_size, MAX_BATCH_SIZE))
+        self.retries = retries
+        self.stats = stats
+        self.batches = 0
+        self.retried = 0
+        self._pending = []  # (method name, request builder, callback)
+        self._lock = threading.Lock()
+
+    def add(self, method: str, build_request: Callable, callback: Optional[Callable] = None):
+        """
+        Queue a call.
+
+        Args:
+            method: API method name used in statistics, e.g. 'permissions.create'
+            build_request: Function taking the service and returning the HttpRequest
+            callback: Optional function called as callback(response, exception)
+                once the call has been sent; exception is None on success
+        """
+        with self._lock:
+            self._pending.append((method, build_request, callback))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self) -> int:
+        """
+        Send all queued calls.
+
+        Returns:
+            Number of calls that still failed after retrying
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+
+        failed = 0
+        for start in range(0, len(pending), self.max_batch_size):
+            failed += self._send(pending[start:start + self.max_batch_size])
+        return failed
+
+    def _send(self, calls) -> int:
+        """Send one batch, retry its failed sub-requests, and run the callbacks."""
+        requests = [build_request(self.service) for _, build_request, _ in calls]
+        outcomes = {}
+        resent = set()  # Calls already sent on their own, with retries
+
+        def collect(request_id, response, exception):
+            outcomes[int(request_id)] = (response, exception)
+
+        if len(requests) == 1:
+            # A batch of one would only add multipart overhead
+            outcomes[0] = self._execute_single(calls[0][0], requests[0], retries=0)
+        else:
+            batch = self.service.new_batch_http_request(callback=collect)
+            for i, request in enumerate(requests):
+                batch.add(request, request_id=str(i))
+            try:
+                batch.execute()
+            except Exception as e:
+                # The batch request itself failed, e.g. on a transport error;
+                # send the calls it did not answer one at a time
+                print(f"Warning: batch request failed ({e}); sending its calls one at a time")
+                for i, (method, _, _) in enumerate(calls):
+                    if i not in outcomes:
+                        self.retried += 1
+                        outcomes[i] = self._execute_single(method, requests[i], self.retries)
+                        resent.add(i)
+            self.batches += 1
+            if self.stats is not None:
+                self.stats.record_call('batch')
+
+        failed = 0
+        callback_error = None
+        for i, (method, _, callback) in enumerate(calls):
+            response, exception = outcomes.get(i, (None, None))
+            if (i not in resent and isinstance(exception, HttpError)
+                    and exception.resp.status in RETRYABLE_STATUSES):
+                self.retried += 1
+                response, exception = self._execute_single(method, requests[i], self.retries)
+            if exception is not None:
+                failed += 1
+            if callback is not None:
+                try:
+                    callback(response, exception)
+                except Exception as e:
+                    callback_error = callback_error or e
+        if callback_error is not None:
+            raise callback_error
+        return failed
+
+    def _execute_single(self, method: str, request, retries: int):
+        """Execute one request on its own; returns (response, exception)."""
+        if self.stats is not None:
+            self.stats.record_call(method)
+        try:
+            return request.execute(num_retries=retries), None
+        except Exception as e:
+            # An HttpError, or a transport error once the retries are used up
+            return None, e
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Performance benchmarks for the converters.
+
+Usage:
+    python benchmark.py session [--diagrams 30] [--handshake-ms 30] [--url URL]
+    python benchmark.py encoding [PATH ...]
+    python benchmark.py inline [--spans 300]
+    python benchmark.py blocks [PATH ...] [--mb 8]
+    python benchmark.py stream [--mb 0.5 1 4] [--modes whole stream]
+"""
+
+import re
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+from pathlib import Path
+
+from inline_markdown import parse_inline
+from markdown_blocks import scan_blocks
+from mermaid_renderer import MermaidRenderer, encode_plain, encode_pako
+from mermaid_ink_stub import MermaidInkStub
+
+# Requests per second far above what one render worker can send
+UNTHROTTLED_API_RATE = 1000.0
+
+
+def _sample_diagrams(count: int):
+    """Distinct small flowcharts, so no request can be served from a cache."""
+    return [
+        f"graph TD\n    A{i}[Start] --> B{i}{{Check}}\n    B{i} -->|yes| C{i}[Done]\n"
+        for i in range(count)
+    ]
+
+
+def _time_renders(renderer: MermaidRenderer, diagrams):
+    """Render diagrams one at a time and return per-diagram latencies in ms."""
+    latencies = []
+    for diagram in diagrams:
+        start = time.perf_counter()
+        renderer.render_to_bytes(diagram)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def bench_session(args):
+    """Per-diagram API latency with and without a pooled keep-alive session."""
+    diagrams = _sample_diagrams(args.diagrams)
+
+    def run(url):
+        results = {}
+        for keep_alive in (False, True):
+            # An unthrottled rate, so the times are those of the requests, not of the rate limiter
+            renderer = MermaidRenderer(api_url=url, jobs=1, keep_alive=keep_alive,
+                                       api_rate=UNTHROTTLED_API_RATE)
+            try:
+                results[keep_alive] = _time_renders(renderer, diagrams)
+            finally:
+                renderer.close()
+        return results
+
+    if args.url:
+        target = args.url
+        results = run(args.url)
+    else:
+        with MermaidInkStub(handshake_delay=args.handshake_ms / 1000) as server:
+            target = f"local stub ({args.handshake_ms:g} ms simulated handshake)"
+            results = run(server.url)
+
+    print(f"Per-diagram API latency, {len(diagrams)} diagrams against {target}")
+    print(f"{'mode':<12}{'mean ms':>10}{'median ms':>12}{'p95 ms':>10}")
+    for keep_alive, label in ((False, 'no pooling'), (True, 'pooled')):
+        latencies = sorted(results[keep_alive])
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        print(f"{label:<12}{statistics.mean(latencies):>10.1f}"
+              f"{statistics.median(latencies):>12.1f}{p95:>10.1f}")
+
+
+def _markdown_files(paths):
+    """Expand files and directories (recursively) into markdown file paths."""
+    for path in map(Path, paths):
+        if path.is_dir():
+            yield from sorted(path.rglob('*.md'))
+        else:
+            yield path
+
+
+def bench_encoding(args):
+    """API URL size with plain vs automatic (pako above threshold) encoding."""
+    renderer = MermaidRenderer()
+    diagrams = []
+    for md_file in _markdown_files(args.paths):
+        text = md_file.read_text(encoding='utf-8')
+        diagrams.extend(re.findall(r'```mermaid\n(.*?)```', text, flags=re.DOTALL))
+
+    if not diagrams:
+        print("No mermaid diagrams found")
+        return
+
+    prefix = len(f"{renderer.api_url}/img/")
+    plain = [prefix + len(encode_plain(d)) for d in diagrams]
+    pako = [prefix + len(encode_pako(d)) for d in diagrams]
+    auto = [len(renderer.api_url_for(d)) for d in diagrams]
+    compressed = sum(1 for d in diagrams if 'pako:' in renderer.api_url_for(d))
+    too_long = sum(1 for size in auto if size > renderer.max_url_length)
+
+    print(f"{len(diagrams)} diagrams, {compressed} sent compressed "
+          f"(threshold {renderer.pako_threshold} encoded chars)")
+    print(f"{'encoding':<12}{'total KB':>10}{'mean':>8}{'max':>8}")
+    for label, sizes in (('plain', plain), ('pako', pako), ('automatic', auto)):
+        print(f"{label:<12}{sum(sizes) / 1024:>10.1f}{statistics.mean(sizes):>8.0f}{max(sizes):>8}")
+    print(f"URL size reduction: {100 * (1 - sum(auto) / sum(plain)):.1f}% overall, "
+          f"{too_long} URL(s) still over the {renderer.max_url_length}-character limit")
+
+
+def bench_inline(args):
+    """Inline tokenizer time on lines of growing length with many emphasis spans."""
+    print(f"{'chars':>8}{'spans':>8}{'ms/line':>10}{'ns/char':>10}")
+    for chars in (1000, 2500, 5000, 10000, 20000, 40000):
+        # args.spans spans per 10k characters (three per group), padded with plain words
+        groups = max(1, args.spans * chars // 30000)
+        width = chars // groups
+        line = ''.join(
+            (f"**bold {i}** and *italic {i}* with `code {i}` " + 'plain ' * width)[:width]
+            for i in range(groups)
+        )
+
+        runs = max(3, 200000 // chars)
+        start = time.perf_counter()
+        for _ in range(runs):
+            parse_inline(line)
+        seconds = (time.perf_counter() - start) / runs
+        found = len(parse_inline(line)[1])
+        print(f"{chars:>8}{found:>8}{seconds * 1000:>10.2f}{seconds * 1e9 / chars:>10.0f}")
+
+
+def bench_blocks(args):
+    """Block scanner throughput on markdown files repeated to a given size."""
+    corpus = '\n'.join(md_file.read_text(encoding='utf-8') for md_file in _markdown_files(args.paths))
+    if not corpus.strip():
+        print("No markdown found")
+        return
+    text = corpus * max(1, int(args.mb * 1024 * 1024 / len(corpus)))
+    size_mb = len(text.encode('utf-8')) / (1024 * 1024)
+
+    timings = []
+    for _ in range(3):
+        start = time.perf_counter()
+        blocks, codes = scan_blocks(text)
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    print(f"{size_mb:.1f} MB, {len(blocks)} blocks, {len(codes)} diagrams: "
+          f"{best * 1000:.0f} ms, {size_mb / best:.1f} MB/s")
+
+
+# Runs a converter's main() and reports the process's peak RSS (KB on Linux)
+_RSS_PROBE = '''
+import resource, runpy, sys
+sys.argv = sys.argv[1:]
+try:
+    runpy.run_path(sys.argv[0], run_name='__main__')
+except SystemExit:
+    pass
+print('peak_rss_kb', resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+'''
+
+
+def _write_report(path: Path, mb: float):
+    """Write a generated API-reference style document of about mb megabytes."""
+    target = int(mb * 1024 * 1024)
+    written = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        i = 0
+        while written < target:
+            section = (
+                f"## Endpoint {i}\n\n"
+                f"Returns the **resource {i}** for the caller. See *notes* and `GET /v1/items/{i}`.\n\n"
+                f"- Rate limited to {i % 50 + 1} calls per second\n"
+                f"- Requires the [items scope](https://example.com/scopes#{i})\n\n"
+                "| Field | Type | Description |\n|---|---|---|\n"
+                + ''.join(f"| field_{j} | `string` | Value {j} of item {i} |\n" for j in range(5))
+                + f"\n```json\n{{\"id\": {i}, \"name\": \"item {i}\"}}\n```\n\n"
+            )
+            f.write(section)
+            written += len(section)
+            i += 1
+
+
+def bench_stream(args):
+    """Peak memory of md2docx on generated files of growing size, with and without --stream."""
+    here = Path(__file__).parent
+    print(f"{'MB':>6}{'mode':>10}{'peak RSS MB':>14}{'seconds':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for mb in args.mb:
+            source = Path(tmp) / f'report_{mb:g}mb.md'
+            _write_report(source, mb)
+            for mode in args.modes:
+                command = [sys.executable, '-c', _RSS_PROBE, str(here / 'md2docx.py'), str(source),
+                           '-o', str(Path(tmp) / 'out.docx'), '--no-cache', '--no-parse-cache']
+                if mode == 'stream':
+                    command.append('--stream')
+                start = time.perf_counter()
+                result = subprocess.run(command, capture_output=True, text=True)
+                seconds = time.perf_counter() - start
+                match = re.search(r'peak_rss_kb (\d+)', result.stdout)
+                if result.returncode or match is None or 'Error' in result.stdout:
+                    print(f"{mb:>6g}{mode:>10}  failed: {(result.stdout + result.stderr).strip()[-200:]}")
+                    continue
+                print(f"{mb:>6g}{mode:>10}{int(match.group(1)) / 1024:>14.0f}{seconds:>10.1f}")
+            source.unlink()
+
+
+def main():
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description='Converter performance benchmarks')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    session = subparsers.add_parser('session', help=bench_session.__doc__)
+    session.add_argument('--diagrams', type=int, default=30)
+    session.add_argument('--handshake-ms', type=float, default=30.0,
+                         help='Simulated connection setup cost of the local stub')
+    session.add_argument('--url', help='Benchmark a real server instead of the local stub')
+    session.set_defaults(func=bench_session)
+
+    encoding = subparsers.add_parser('encoding', help=bench_encoding.__doc__)
+    encoding.add_argument('paths', nargs='*', default=['example.md'],
+                          help='Markdown files or directories to scan (default: example.md)')
+    encoding.set_defaults(func=bench_encoding)
+
+    inline = subparsers.add_parser('inline', help=bench_inline.__doc__)
+    inline.add_argument('--spans', type=int, default=300,
+                        help='Emphasis spans per 10,000 characters')
+    inline.set_defaults(func=bench_inline)
+
+    blocks = subparsers.add_parser('blocks', help=bench_blocks.__doc__)
+    blocks.add_argument('paths', nargs='*', default=['example.md'],
+                        help='Markdown files or directories to repeat (default: example.md)')
+    blocks.add_argument('--mb', type=float, default=8.0, help='Size of the scanned text')
+    blocks.set_defaults(func=bench_blocks)
+
+    stream = subparsers.add_parser('stream', help=bench_stream.__doc__)
+    stream.add_argument('--mb', type=float, nargs='+', default=[0.5, 1.0, 4.0],
+                        help='Sizes of the generated documents')
+    stream.add_argument('--modes', nargs='+', choices=['whole', 'stream'], default=['whole', 'stream'],
+                        help='Convert the whole file at once, streamed, or both')
+    stream.set_defaults(func=bench_stream)
+
+    args = parser.parse_args()
+    args.func(args)
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,179 @@
+"""
+Drive upload bookkeeping for md2gdocs.py.
+
+Uploaded diagram images are recorded in a small JSON manifest that maps
+the SHA-256 of the image bytes to the Drive file holding it, so
+re-publishing a document reuses the images already in Drive instead of
+uploading a fresh copy of every diagram on every run. UploadStats counts
+the Drive calls a run makes and how long uploads take.
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+import threading
+import time
+import statistics
+from collections import Counter
+from pathlib import Path
+from typing import Optional
+
+from mermaid_renderer import DEFAULT_CACHE_DIR
+
+
+DEFAULT_MANIFEST_PATH = os.path.join(os.path.dirname(DEFAULT_CACHE_DIR), 'drive_uploads.json')
+# Images up to this size are sent in one multipart request; larger ones use
+# a resumable session (one request to open it, then one per chunk)
+DEFAULT_RESUMABLE_THRESHOLD_MB = 5
+DEFAULT_UPLOAD_JOBS = 4
+
+
+class UploadManifest:
+    """
+    Persistent map from image content hash to Drive file ID.
+
+    Entries are only a hint: callers check that the file still exists
+    before reusing it, and invalidate entries for files Drive no longer
+    has (deleted, trashed, or owned by another account).
+    """
+
+    def __init__(self, path: str = DEFAULT_MANIFEST_PATH):
+        """
+        Initialize the manifest.
+
+        Args:
+            path: JSON file the manifest is kept in
+        """
+        self.path = Path(path)
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        self._entries = None  # content hash -> {'id': ..., 'uploaded': ...}, loaded lazily
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(image: bytes) -> str:
+        """Build the manifest key for image bytes."""
+        return hashlib.sha256(image).hexdigest()
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def _save(self):
+        """Write the manifest atomically; callers hold the lock."""
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=self.path.parent, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"Warning: could not write Drive upload manifest: {e}")
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Look up the Drive file recorded for an image.
+
+        Args:
+            key: Content hash from make_key()
+
+        Returns:
+            The Drive file ID, or None if the image was not uploaded before
+        """
+        with self._lock:
+            self._load()
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry['id']
+
+    def put(self, key: str, file_id: str):
+        """
+        Record the Drive file an image was uploaded to.
+
+        Args:
+            key: Content hash from make_key()
+            file_id: Drive file ID of the uploaded image
+        """
+        with self._lock:
+            self._load()
+            self._entries[key] = {'id': file_id, 'uploaded': time.time()}
+            self._save()
+
+    def invalidate(self, key: str):
+        """
+        Forget an entry whose Drive file is gone.
+
+        Args:
+            key: Content hash from make_key()
+        """
+        with self._lock:
+            self._load()
+            if self._entries.pop(key, None) is not None:
+                self.invalidated += 1
+                self._save()
+
+    def stats(self) -> str:
+        """Return a one-line summary of reused and uploaded images."""
+        # A hit whose file turned out to be gone was uploaded again
+        reused = self.hits - self.invalidated
+        summary = f"Drive uploads: {reused} image(s) reused, {self.misses + self.invalidated} uploaded"
+        if self.invalidated:
+            summary += f", {self.invalidated} stale entr{'y' if self.invalidated == 1 else 'ies'} dropped"
+        return summary
+
+
+class UploadStats:
+    """Drive API call counts and upload latencies for the end-of-run report."""
+
+    def __init__(self):
+        self.calls = Counter()  # API method -> HTTP requests made
+        self.latencies = {'multipart': [], 'resumable': []}  # seconds per upload
+        self._lock = threading.Lock()
+
+    def record_call(self, method: str, requests: int = 1):
+        """
+        Count HTTP requests made for an API method.
+
+        Args:
+            method: API method name, e.g. 'files.create'
+            requests: Number of HTTP requests the call took
+        """
+        with self._lock:
+            self.calls[method] += requests
+
+    def record_upload(self, kind: str, seconds: float, requests: int):
+        """
+        Record one image upload.
+
+        Args:
+            kind: 'multipart' or 'resumable'
+            seconds: Wall time of the upload
+            requests: Number of HTTP requests the upload took
+        """
+        with self._lock:
+            self.latencies[kind].append(seconds)
+            self.calls['files.create'] += requests
+
+    def stats(self) -> str:
+        """Return a summary of Drive calls and upload latency."""
+        total = sum(self.calls.values())
+        lines = [f"Drive API: {total} request(s)" + (
+            " (" + ", ".join(f"{method} {count}" for method, count in sorted(self.calls.items())) + ")"
+            if total else ""
+        )]
+        for kind, latencies in self.latencies.items():
+            if latencies:
+                lines.append(f"  {len(latencies)} {kind} upload(s), mean "
+                             f"{statistics.mean(latencies) * 1000:.0f} ms, "
+                             f"max {max(latencies) * 1000:.0f} ms")
+        return '\n'.join(lines)
@@ -0,0 +1,390 @@
+"""
+In-memory stand-ins for the Google Drive v3 and Docs v1 services used
+by md2gdocs.py.
+
+Mimics the ``service.resource().method(...).execute()`` call chain of
+googleapiclient for the handful of methods the converter uses, including
+``new_batch_http_request``, records every executed call, and raises real
+``HttpError`` objects so error handling can be tested without network
+access or credentials.
+"""
+
+import re
+import itertools
+import threading
+import time
+from collections import deque
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+
+def http_error(status: int, reason: str = 'error') -> HttpError:
+    """Build an HttpError as googleapiclient raises it."""
+    response = httplib2.Response({'status': status})
+    response.reason = reason
+    return HttpError(response, reason.encode('utf-8'))
+
+
+class StubRequest:
+    """A prepared call; runs against the stub when executed."""
+
+    def __init__(self, service, method: str, handler, kwargs: dict):
+        self.service = service
+        self.method = method
+        self.handler = handler
+        self.kwargs = kwargs
+
+    def execute(self, http=None, num_retries: int = 0):
+        self.service.record(self.method, self.kwargs)
+        return self.handler(**self.kwargs)
+
+
+class StubBatch:
+    """Batch of requests sent as one round trip, like BatchHttpRequest."""
+
+    def __init__(self, service, callback=None):
+        self.service = service
+        self.callback = callback
+        self._requests = []  # (request ID, request, callback)
+
+    def add(self, request, callback=None, request_id=None):
+        if len(self._requests) >= 1000:
+            raise ValueError('too many requests in one batch')
+        if request_id is None:
+            request_id = str(len(self._requests) + 1)
+        self._requests.append((request_id, request, callback))
+
+    def execute(self, http=None):
+        self.service.record('batch', {'size': len(self._requests)})
+        if self.service.next_batch_broken():
+            raise ConnectionResetError('connection reset by peer')
+        for request_id, request, callback in self._requests:
+            callback = callback or self.callback
+            status = self.service.next_batch_failure()
+            if status is not None:
+                response, exception = None, http_error(status, 'batch sub-request failed')
+            else:
+                self.service.record(request.method, request.kwargs, batched=True)
+                try:
+                    response, exception = request.handler(**request.kwargs), None
+                except HttpError as e:
+                    response, exception = None, e
+            if callback is not None:
+                callback(request_id, response, exception)
+
+
+class ServiceStub:
+    """Call recording shared by the service stubs."""
+
+    def __init__(self, latency: float = 0.0):
+        """
+        Initialize the stub.
+
+        Args:
+            latency: Seconds every HTTP round trip takes, to simulate network delay
+        """
+        self.latency = latency
+        self.calls = []  # (method, kwargs) of every executed call, batched or not
+        self.round_trips = 0  # HTTP requests: single calls plus whole batches
+        self.batch_failures = deque()  # Statuses returned to the next batched sub-requests
+        self.broken_batches = 0  # Next batch requests that fail as a whole, like a dropped connection
+        self._lock = threading.Lock()
+
+    def record(self, method: str, kwargs: dict, batched: bool = False):
+        with self._lock:
+            self.calls.append((method, kwargs))
+            if not batched:
+                self.round_trips += 1
+        if self.latency and not batched:
+            time.sleep(self.latency)
+
+    def count(self, method: str) -> int:
+        """Number of executed calls of a method, e.g. 'files.create'."""
+        return sum(1 for name, _ in self.calls if name == method)
+
+    def next_batch_failure(self):
+        with self._lock:
+            return self.batch_failures.popleft() if self.batch_failures else None
+
+    def next_batch_broken(self) -> bool:
+        with self._lock:
+            if self.broken_batches:
+                self.broken_batches -= 1
+                return True
+            return False
+
+    def new_batch_http_request(self, callback=None):
+        return StubBatch(self, callback)
+
+
+class _Resource:
+    def __init__(self, service, name: str):
+        self._service = service
+        self._name = name
+
+    def __getattr__(self, method):
+        handler = getattr(self._service, f"_{self._name}_{method}")
+
+        def prepare(**kwargs):
+            return StubRequest(self._service, f"{self._name}.{method}", handler, kwargs)
+        return prepare
+
+
+class DriveStub(ServiceStub):
+    """Drive service holding files in memory."""
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__(latency)
+        self.files_by_id = {}  # file ID -> metadata dict, including 'content'
+        self.permissions_by_file = {}  # file ID -> list of permission bodies
+        self._ids = itertools.count(1)
+
+    def files(self):
+        return _Resource(self, 'files')
+
+    def permissions(self):
+        return _Resource(self, 'permissions')
+
+    def _files_create(self, body, media_body=None, fields=None):
+        with self._lock:
+            file_id = f"file{next(self._ids)}"
+            content = media_body.getbytes(0, media_body.size()) if media_body else b''
+            self.files_by_id[file_id] = dict(body, id=file_id, trashed=False, content=content)
+        return {'id': file_id}
+
+    def _files_get(self, fileId, fields=None):
+        file = self.files_by_id.get(fileId)
+        if file is None:
+            raise http_error(404, 'File not found')
+        return {'id': fileId, 'trashed': file['trashed']}
+
+    def _files_list(self, q='', fields=None, spaces=None, pageSize=None):
+        # Only the "name = '...'" and "mimeType = '...'" terms of q are honored
+        terms = {
+            field: re.sub(r"\\(.)", r"\1", value)
+            for field, value in re.findall(r"(name|mimeType)\s*=\s*'((?:[^'\\]|\\.)*)'", q)
+        }
+        matches = [
+            {'id': file['id'], 'name': file.get('name')}
+            for file in self.files_by_id.values()
+            if not file['trashed'] and all(file.get(field) == value for field, value in terms.items())
+        ]
+        return {'files': matches}
+
+    def _permissions_list(self, fileId, fields=None):
+        if fileId not in self.files_by_id:
+            raise http_error(404, 'File not found')
+        return {'permissions': list(self.permissions_by_file.get(fileId, []))}
+
+    def _permissions_create(self, fileId, body, fields=None):
+        if fileId not in self.files_by_id:
+            raise http_error(404, 'File not found')
+        with self._lock:
+            self.permissions_by_file.setdefault(fileId, []).append(body)
+        return {'id': f"perm-{fileId}"}
+
+    def _files_delete(self, fileId):
+        with self._lock:
+            if self.files_by_id.pop(fileId, None) is None:
+                raise http_error(404, 'File not found')
+        return ''
+
+
+# Structural index units of a stub document; every other unit is one character
+TABLE_START = '<table>'
+ROW_START = '<row>'
+CELL_START = '<cell>'
+INLINE_IMAGE = '<image>'
+MARKERS = (TABLE_START, ROW_START, CELL_START)
+
+
+class StubDocument:
+    """
+    Index model of a Docs document body.
+
+    The body is a list of units, one per document index starting at 1:
+    characters, inline images, and the table/row/cell start markers that
+    occupy an index in real documents. A table of R rows and C columns
+    takes 1 + R * (1 + 2 * C) indices when empty: its start, and per row
+    a row start plus a cell start and an empty paragraph per cell.
+    """
+
+    def __init__(self, title: str):
+        self.title = title
+        self.units = ['\n']
+        self.styles = [{}]  # text style per unit
+        self.paragraph_styles = []  # (start, end, style) in request order
+        self.cell_styles = []  # (table start, row, column, style)
+
+    @property
+    def end_index(self) -> int:
+        return len(self.units) + 1
+
+    def _check_insert(self, index: int):
+        """Text and tables can only go inside a paragraph, before the final newline."""
+        if not 1 <= index < self.end_index:
+            raise http_error(400, f'Index {index} must be less than the end index {self.end_index}')
+        if self.units[index - 1] in MARKERS or (index > 1 and self.units[index - 2] in (TABLE_START, ROW_START)):
+            raise http_error(400, f'Invalid requests: index {index} is not inside a paragraph')
+
+    def _check_range(self, start: int, end: int):
+        if not 1 <= start < end <= self.end_index:
+            raise http_error(400, f'Invalid range {start}-{end} (end index {self.end_index})')
+
+    def insert(self, index: int, units: list):
+        self._check_insert(index)
+        self.units[index - 1:index - 1] = units
+        self.styles[index - 1:index - 1] = [{} for _ in units]
+
+    def apply(self, request: dict):
+        """Apply one batchUpdate request."""
+        (kind, body), = request.items()
+        if kind == 'insertText':
+            self.insert(body['location']['index'], list(body['text']))
+        elif kind == 'insertInlineImage':
+            self.insert(body['location']['index'], [INLINE_IMAGE])
+        elif kind == 'insertTable':
+            units = ['\n', TABLE_START]
+            for _ in range(body['rows']):
+                units.append(ROW_START)
+                for _ in range(body['columns']):
+                    units.extend([CELL_START, '\n'])
+            self.insert(body['location']['index'], units)
+        elif kind == 'updateTextStyle':
+            start, end = body['range']['startIndex'], body['range']['endIndex']
+            self._check_range(start, end)
+            fields = body['fields'].split(',')
+            for i in range(start - 1, end - 1):
+                if self.units[i] not in MARKERS:
+                    style = dict(self.styles[i])
+                    for field in fields:
+                        if field in body['textStyle']:
+                            style[field] = body['textStyle'][field]
+                        else:
+                            style.pop(field, None)
+                    self.styles[i] = style
+        elif kind == 'updateParagraphStyle':
+            start, end = body['range']['startIndex'], body['range']['endIndex']
+            self._check_range(start, end)
+            self.paragraph_styles.append((start, end, body['paragraphStyle']))
+        elif kind == 'updateTableCellStyle':
+            location = body['tableCellLocation']
+            table_start = location['tableStartLocation']['index']
+            if not 1 <= table_start < self.end_index or self.units[table_start - 1] != TABLE_START:
+                raise http_error(400, f'No table starts at index {table_start}')
+            self.cell_styles.append((table_start, location['rowIndex'],
+                                     location['columnIndex'], body['tableCellStyle']))
+        else:
+            raise http_error(400, f'Unsupported request {kind}')
+
+    def body(self) -> dict:
+        """The document body in documents().get form (indices and text only)."""
+        content = []
+        paragraph_start = 1
+        i = 0
+        while i < len(self.units):
+            unit = self.units[i]
+            if unit == TABLE_START:
+                table, i = self._table_element(i)
+                content.append(table)
+                paragraph_start = i + 1
+                continue
+            if unit == '\n':
+                content.append(self._paragraph(paragraph_start, i + 2))
+                paragraph_start = i + 2
+            i += 1
+        return {'content': content}
+
+    def _paragraph(self, start: int, end: int) -> dict:
+        text = ''.join(u if u not in (INLINE_IMAGE,) else '' for u in self.units[start - 1:end - 1])
+        return {'startIndex': start, 'endIndex': end,
+                'paragraph': {'elements': [{'textRun': {'content': text}}]}}
+
+    def _table_element(self, i: int):
+        """Describe the table starting at unit i; returns (element, next unit)."""
+        table_start = i + 1
+        rows = []
+        i += 1
+        while i < len(self.units) and self.units[i] == ROW_START:
+            row = {'startIndex': i + 1, 'tableCells': []}
+            i += 1
+            while i < len(self.units) and self.units[i] == CELL_START:
+                cell = {'startIndex': i + 1, 'content': []}
+                i += 1
+                paragraph_start = i + 1
+                # A cell's content runs until the next marker
+                while i < len(self.units) and self.units[i] not in MARKERS:
+                    if self.units[i] == '\n':
+                        cell['content'].append(self._paragraph(paragraph_start, i + 2))
+                        paragraph_start = i + 2
+                    i += 1
+                cell['endIndex'] = i + 1
+                row['tableCells'].append(cell)
+            row['endIndex'] = i + 1
+            rows.append(row)
+        element = {'startIndex': table_start, 'endIndex': i + 1,
+                   'table': {'rows': len(rows), 'tableRows': rows}}
+        return element, i
+
+    def text(self) -> str:
+        """Body text with tables and images shown as markers."""
+        return ''.join(self.units)
+
+    def runs(self) -> list:
+        """Body as (text, style) runs, merging neighbours with equal style."""
+        runs = []
+        for unit, style in zip(self.units, self.styles):
+            if runs and runs[-1][1] == style:
+                runs[-1] = (runs[-1][0] + unit, style)
+            else:
+                runs.append((unit, style))
+        return runs
+
+
+class DocsStub(ServiceStub):
+    """Docs service holding documents in memory."""
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__(latency)
+        self.documents_by_id = {}  # document ID -> StubDocument
+        self.max_update_requests = None  # batchUpdates with more requests fail with 413
+        self.update_failures = deque()  # Statuses returned to the next batchUpdates
+        self._ids = itertools.count(1)
+
+    def documents(self):
+        return _Resource(self, 'documents')
+
+    def _documents_create(self, body):
+        with self._lock:
+            doc_id = f"doc{next(self._ids)}"
+            self.documents_by_id[doc_id] = StubDocument(body.get('title', ''))
+        return {'documentId': doc_id, 'title': body.get('title', '')}
+
+    def _documents_batchUpdate(self, documentId, body):
+        document = self.documents_by_id.get(documentId)
+        if document is None:
+            raise http_error(404, 'Document not found')
+        with self._lock:
+            status = self.update_failures.popleft() if self.update_failures else None
+        if status is not None:
+            raise http_error(status, 'batchUpdate failed')
+        if self.max_update_requests is not None and len(body['requests']) > self.max_update_requests:
+            raise http_error(413, 'Request payload size exceeds the limit')
+        # Requests apply in order; a failing request leaves the document unchanged
+        snapshot = (list(document.units), list(document.styles),
+                    list(document.paragraph_styles), list(document.cell_styles))
+        try:
+            for request in body['requests']:
+                document.apply(request)
+        except HttpError:
+            (document.units, document.styles,
+             document.paragraph_styles, document.cell_styles) = snapshot
+            raise
+        return {'documentId': documentId, 'replies': [{} for _ in body['requests']]}
+
+    def _documents_get(self, documentId, fields=None):
+        document = self.documents_by_id.get(documentId)
+        if document is None:
+            raise http_error(404, 'Document not found')
+        return {'documentId': documentId, 'title': document.title, 'body': document.body()}
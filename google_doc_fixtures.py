@@ -0,0 +1,83 @@
+"""
+Markdown samples and a conversion helper shared by the Google Docs tests.
+
+build_google_doc() runs MarkdownToGoogleDocs against the in-memory
+stubs of google_api_stub.py, with a fake image for every diagram.
+"""
+
+from typing import Optional, Tuple
+
+from google_api_stub import DocsStub, DriveStub, StubDocument
+from md2gdocs import MarkdownToGoogleDocs
+
+PNG = b'\x89PNG\r\n\x1a\n'
+
+MARKDOWN = """# Report
+
+Some **bold** intro text.
+
+| Name | Value |
+|------|-------|
+| alpha | 1 |
+| beta | 2 |
+
+Between the tables.
+
+```mermaid
+graph TD
+    A --> B
+```
+
+| Key | Description | Note |
+|-----|-------------|------|
+| x | first | |
+| y | second | last |
+
+Closing paragraph.
+"""
+
+STYLED_MARKDOWN = """# The **bold** header
+
+## _Italic_ header with **two** **spans**
+
+Text with **bold**, *italic* and __more bold__ and _more italic_.
+
+```python
+print('code')
+```
+
+```python
+print('more code')
+```
+"""
+
+
+def build_google_doc(markdown_text: str, blocks=None, source_hash: Optional[str] = None,
+                     **options) -> Tuple[DocsStub, StubDocument]:
+    """
+    Build a Google Doc from markdown against the stubs.
+
+    Args:
+        markdown_text: The markdown content; each diagram gets a distinct fake PNG
+        blocks: Blocks to build the document from instead of parsing
+            markdown_text, e.g. from iter_blocks() or ParseCache.parse()
+        source_hash: Passed on to create_google_doc()
+        options: Converter attributes to set, e.g. stream=True
+
+    Returns:
+        Tuple of (docs stub, document)
+    """
+    docs, drive = DocsStub(), DriveStub()
+    converter = MarkdownToGoogleDocs()
+    converter._build_docs_service = lambda: docs
+    converter._build_drive_service = lambda: drive
+    for name, value in options.items():
+        setattr(converter, name, value)
+    parsed, mermaid_codes = converter.parse_markdown(markdown_text)
+    images = [PNG + bytes([i]) for i in range(len(mermaid_codes))]
+    try:
+        doc_id = converter.create_google_doc('Report', parsed if blocks is None else blocks, images,
+                                             source_hash=source_hash)
+    finally:
+        converter.close()
+    return docs, docs.documents_by_id[doc_id]
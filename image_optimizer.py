@@ -0,0 +1,163 @@
+"""
+Post-render image optimization.
+
+Rendered diagrams are usually much larger than the size they are shown
+at: Google Docs places them in a 400x300 pt box and DOCX at 6 inches
+wide. ImageOptimizer downsamples each image to that display size at a
+chosen DPI, re-encodes it as an optimized (and, for flat diagram
+artwork, palette-quantized) PNG, and switches to JPEG when that is
+smaller for photographic content. Results can be cached next to the
+render cache so each image is optimized once.
+"""
+
+import io
+import json
+import hashlib
+import threading
+from typing import Optional, Tuple
+
+from PIL import Image
+
+
+DEFAULT_IMAGE_DPI = 150
+DEFAULT_JPEG_QUALITY = 85
+# Images with more distinct colors than this are treated as photographic
+PHOTO_COLOR_THRESHOLD = 4096
+JPEG_SIGNATURE = b'\xff\xd8\xff'
+
+
+def image_mimetype(image: bytes) -> str:
+    """Return the MIME type of PNG or JPEG image bytes."""
+    if image.startswith(JPEG_SIGNATURE):
+        return 'image/jpeg'
+    return 'image/png'
+
+
+def image_extension(image: bytes) -> str:
+    """Return the file extension (with dot) matching image bytes."""
+    return '.jpg' if image_mimetype(image) == 'image/jpeg' else '.png'
+
+
+class ImageOptimizer:
+    """Shrink rendered images to what their display size actually needs."""
+
+    def __init__(self, display_size: Tuple[Optional[float], Optional[float]],
+                 dpi: int = DEFAULT_IMAGE_DPI, allow_jpeg: bool = True,
+                 jpeg_quality: int = DEFAULT_JPEG_QUALITY, cache=None):
+        """
+        Initialize the optimizer.
+
+        Args:
+            display_size: (width, height) in points the image is shown at;
+                either may be None when that dimension is unconstrained
+            dpi: Pixels per inch to keep at the display size
+            allow_jpeg: If True, use JPEG where it beats PNG on photographic images
+            jpeg_quality: JPEG quality setting (1-95)
+            cache: Optional RenderCache for optimized images
+        """
+        self.dpi = dpi
+        self.max_pixels = tuple(
+            None if points is None else max(1, round(points / 72 * dpi))
+            for points in display_size
+        )
+        self.allow_jpeg = allow_jpeg
+        self.jpeg_quality = jpeg_quality
+        self.cache = cache
+        self.images = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._lock = threading.Lock()
+
+    def _cache_key(self, image: bytes) -> str:
+        payload = json.dumps([
+            hashlib.sha256(image).hexdigest(), self.max_pixels,
+            self.allow_jpeg, self.jpeg_quality
+        ])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def optimize(self, image: bytes) -> bytes:
+        """
+        Optimize one image.
+
+        Args:
+            image: PNG bytes as produced by the renderer
+
+        Returns:
+            The smallest acceptable encoding; the input itself if nothing
+            smaller was found or the image could not be decoded
+        """
+        key = None
+        optimized = None
+        if self.cache is not None:
+            key = self._cache_key(image)
+            optimized = self.cache.get(key)
+
+        if optimized is None:
+            try:
+                optimized = self._optimize_uncached(image)
+            except (OSError, ValueError) as e:
+                print(f"Warning: could not optimize diagram image: {e}")
+                optimized = image
+            if key is not None:
+                self.cache.put(key, optimized)
+
+        with self._lock:
+            self.images += 1
+            self.bytes_in += len(image)
+            self.bytes_out += len(optimized)
+        return optimized
+
+    def _optimize_uncached(self, image: bytes) -> bytes:
+        """Downsample and re-encode an image, keeping the smallest candidate."""
+        with Image.open(io.BytesIO(image)) as source:
+            source.load()
+            picture = self._downsample(source)
+
+        has_alpha = picture.mode in ('RGBA', 'LA') or 'transparency' in picture.info
+        picture = picture.convert('RGBA' if has_alpha else 'RGB')
+        photographic = picture.getcolors(maxcolors=PHOTO_COLOR_THRESHOLD) is None
+
+        candidates = [image, self._encode_png(picture)]
+        if photographic:
+            if self.allow_jpeg and not has_alpha:
+                candidates.append(self._encode_jpeg(picture))
+        else:
+            # Flat diagram artwork survives a 256-color palette unchanged to the eye
+            candidates.append(self._encode_png(picture.quantize(
+                colors=256,
+                method=Image.Quantize.FASTOCTREE if has_alpha else Image.Quantize.MEDIANCUT
+            )))
+        return min(candidates, key=len)
+
+    def _downsample(self, picture: Image.Image) -> Image.Image:
+        """Scale the picture down to fit max_pixels, keeping its aspect ratio."""
+        scale = 1.0
+        for limit, size in zip(self.max_pixels, picture.size):
+            if limit is not None and size > limit:
+                scale = min(scale, limit / size)
+        if scale >= 1.0:
+            return picture
+        width, height = picture.size
+        return picture.resize(
+            (max(1, round(width * scale)), max(1, round(height * scale))),
+            Image.Resampling.LANCZOS
+        )
+
+    def _encode_png(self, picture: Image.Image) -> bytes:
+        buffer = io.BytesIO()
+        picture.save(buffer, 'PNG', optimize=True, dpi=(self.dpi, self.dpi))
+        return buffer.getvalue()
+
+    def _encode_jpeg(self, picture: Image.Image) -> bytes:
+        buffer = io.BytesIO()
+        picture.save(buffer, 'JPEG', quality=self.jpeg_quality, optimize=True,
+                      dpi=(self.dpi, self.dpi))
+        return buffer.getvalue()
+
+    def stats(self) -> str:
+        """Return a one-line summary of the bytes saved."""
+        saved = self.bytes_in - self.bytes_out
+        percent = 100 * saved / self.bytes_in if self.bytes_in else 0.0
+        return (f"Image optimization: {self.images} image(s), "
+                f"{self.bytes_in / 1024:.1f} KB -> {self.bytes_out / 1024:.1f} KB "
+                f"({saved / 1024:.1f} KB, {percent:.0f}% saved)")
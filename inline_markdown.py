@@ -0,0 +1,174 @@
+"""
+Inline markdown tokenizer.
+
+parse_inline() walks a line once and returns its text with the markdown
+syntax removed, together with the spans of bold, italic, inline code and
+link text in that cleaned text. Emphasis is matched with a delimiter
+stack in the way CommonMark does it (simplified), so the cost grows
+linearly with the length of the line, however many spans it has.
+"""
+
+import re
+from collections import deque
+from typing import List, NamedTuple, Optional, Tuple
+
+
+BOLD = 'bold'
+ITALIC = 'italic'
+CODE = 'code'
+LINK = 'link'
+
+_SPECIAL = re.compile(r'[*_`\[\]]')
+_BACKTICKS = re.compile(r'`+')
+
+
+class InlineSpan(NamedTuple):
+    """A styled range [start, end) of cleaned text."""
+    start: int
+    end: int
+    style: str  # BOLD, ITALIC, CODE or LINK
+    url: Optional[str] = None  # Target of a LINK span
+
+
+def parse_inline(text: str) -> Tuple[str, List[InlineSpan]]:
+    """
+    Remove inline markdown from a line and collect its styled spans.
+
+    Handles **bold**, __bold__, *italic*, _italic_ (not inside words),
+    `code` (contents kept as is) and [text](url). Markers without a
+    matching partner stay in the text.
+
+    Args:
+        text: One line of markdown
+
+    Returns:
+        Tuple of (cleaned text, spans sorted by start)
+    """
+    n = len(text)
+    # Tokens are [kind, value, count]: 'text' and 'code' carry their text;
+    # 'delim' a run of '*' or '_' with the number of characters still
+    # unmatched; 'link' an opening '[' (count 1 until matched); 'close'
+    # the '](url)' ending a link
+    tokens = []
+    pairs = []  # (opening token, closing token, style, url)
+    stack = []  # Tokens that can still open a span, innermost last
+    open_counts = {'*': 0, '_': 0, '[': 0}  # Openers on the stack per kind
+
+    # Positions of backtick runs by length, consumed front to back
+    code_runs = {}
+    for match in _BACKTICKS.finditer(text):
+        code_runs.setdefault(len(match.group()), deque()).append(match.start())
+    no_paren = False  # Set once no ')' is left in the line
+
+    i = 0
+    while i < n:
+        match = _SPECIAL.search(text, i)
+        if match is None:
+            tokens.append(['text', text[i:], 0])
+            break
+        j = match.start()
+        if j > i:
+            tokens.append(['text', text[i:j], 0])
+        char = text[j]
+        end = j + 1
+
+        if char == '`':
+            while end < n and text[end] == '`':
+                end += 1
+            runs = code_runs[end - j]
+            while runs and runs[0] <= j:
+                runs.popleft()
+            if not runs:
+                tokens.append(['text', text[j:end], 0])
+                i = end
+                continue
+            closing = runs.popleft()
+            tokens.append(['code', text[end:closing], 0])
+            pairs.append((len(tokens) - 1, len(tokens) - 1, CODE, None))
+            i = closing + (end - j)
+
+        elif char in '*_':
+            while end < n and text[end] == char:
+                end += 1
+            before = text[j - 1] if j > 0 else ' '
+            after = text[end] if end < n else ' '
+            can_open = not after.isspace()
+            can_close = not before.isspace()
+            if char == '_':
+                # No emphasis inside words such as snake_case_names
+                can_open = can_open and not before.isalnum()
+                can_close = can_close and not after.isalnum()
+
+            token = ['delim', char, end - j]
+            tokens.append(token)
+            index = len(tokens) - 1
+            if can_close:
+                while token[2] and open_counts[char]:
+                    # Openers above the nearest one of this kind cannot be closed any more
+                    while tokens[stack[-1]][1] != char:
+                        open_counts[tokens[stack.pop()][1]] -= 1
+                    opener = tokens[stack[-1]]
+                    used = 2 if opener[2] >= 2 and token[2] >= 2 else 1
+                    opener[2] -= used
+                    token[2] -= used
+                    pairs.append((stack[-1], index, BOLD if used == 2 else ITALIC, None))
+                    if not opener[2]:
+                        stack.pop()
+                        open_counts[char] -= 1
+            if can_open and token[2]:
+                stack.append(index)
+                open_counts[char] += 1
+            i = end
+
+        elif char == '[':
+            tokens.append(['link', '[', 1])
+            stack.append(len(tokens) - 1)
+            open_counts['['] += 1
+            i = end
+
+        else:  # ']'
+            i = end
+            if open_counts['['] and end < n and text[end] == '(' and not no_paren:
+                closing = text.find(')', end + 1)
+                if closing == -1:
+                    no_paren = True
+                elif closing > end + 1 and text[j - 1] != '[':
+                    while tokens[stack[-1]][1] != '[':
+                        open_counts[tokens[stack.pop()][1]] -= 1
+                    opener_index = stack.pop()
+                    open_counts['['] -= 1
+                    tokens[opener_index][2] = 0
+                    tokens.append(['close', '', 0])
+                    pairs.append((opener_index, len(tokens) - 1, LINK, text[end + 1:closing]))
+                    i = closing + 1
+                    continue
+            tokens.append(['text', ']', 0])
+
+    # Lay out the cleaned text; matched markers take no space
+    pieces = []
+    starts = []
+    ends = []
+    offset = 0
+    for kind, value, count in tokens:
+        if kind == 'delim':
+            piece = value * count
+        elif kind == 'link':
+            piece = value if count else ''
+        else:
+            piece = value
+        starts.append(offset)
+        pieces.append(piece)
+        offset += len(piece)
+        ends.append(offset)
+
+    spans = []
+    for opening, closing, style, url in pairs:
+        if style == CODE:
+            start, stop = starts[opening], ends[opening]
+        else:
+            # Unmatched opening markers stay left of the span, closing ones right of it
+            start, stop = ends[opening], starts[closing]
+        if stop > start:
+            spans.append(InlineSpan(start, stop, style, url))
+    spans.sort(key=lambda span: span.start)
+    return ''.join(pieces), spans
@@ -0,0 +1,367 @@
+"""
+Markdown document tree shared by md2gdocs.py and md2docx.py.
+
+scan_blocks() walks the text line by line, once, and splits it into the
+blocks both converters consume:
+
+    TextBlock       headings, list items, paragraphs and blank lines, with
+                    their inline spans (see inline_markdown.py)
+    TableBlock      two or more consecutive |...| lines
+    CodeBlock       fenced code
+    MermaidBlock    a mermaid diagram, by index into the mermaid codes
+
+A fence opens on a line of three or more backticks (optionally
+indented) followed by an optional language word, and closes on the next
+line of only backticks, at least as many. Everything in between is
+code, so pipes in a code block never start a table. A fence left open
+runs to the end of the text. The state kept between lines is a handful
+of offsets.
+
+iter_blocks() applies the same rules to an iterator of lines, such as an
+open file, and yields each block as soon as it is complete. Long runs of
+text are yielded as several TextBlocks, so memory stays bounded by the
+largest table or code block rather than by the size of the document.
+
+Blocks and lines are dataclasses with __slots__, so a long document
+costs no per-object __dict__. This module imports no output library;
+each converter brings its own.
+"""
+
+import re
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Tuple, Union
+
+from inline_markdown import parse_inline, InlineSpan
+
+
+HEADING = 'heading'
+BULLET = 'bullet'
+NUMBERED = 'numbered'
+PARAGRAPH = 'paragraph'
+BLANK = 'blank'
+
+_FENCE_OPEN = re.compile(r'[ \t]*(```+)(\w*)[ \t]*$')
+_FENCE_CLOSE = re.compile(r'[ \t]*(```+)[ \t]*$')
+_HEADING = re.compile(r'(#{1,6})\s+(.+)$')
+_BULLET = re.compile(r'(\s*)[\*\-]\s+(.+)$')
+_NUMBERED = re.compile(r'(\s*)(\d+)\.\s+(.+)$')
+
+# Most lines iter_blocks() holds in a TextBlock before yielding it
+STREAM_TEXT_LINES = 1000
+
+
+@dataclass
+class TextLine:
+    """One line of a text block, with markdown syntax removed."""
+    __slots__ = ('kind', 'level', 'number', 'text', 'spans')
+    kind: str  # HEADING, BULLET, NUMBERED, PARAGRAPH or BLANK
+    level: int  # Heading level, or leading spaces of a list item
+    number: str  # Number of a NUMBERED item, '' otherwise
+    text: str
+    spans: List[InlineSpan]  # Inline styles, relative to text
+
+
+@dataclass
+class TextBlock:
+    """Lines between code blocks and tables, including the blank ones."""
+    __slots__ = ('lines',)
+    lines: List[TextLine]
+
+
+@dataclass
+class TableBlock:
+    """A table; rows hold the markdown of each non-empty cell, header first."""
+    __slots__ = ('rows',)
+    rows: List[List[str]]
+
+
+@dataclass
+class CodeBlock:
+    """Fenced code other than mermaid."""
+    __slots__ = ('language', 'content')
+    language: str
+    content: str
+
+
+@dataclass
+class MermaidBlock:
+    """A mermaid diagram; index points into the mermaid codes."""
+    __slots__ = ('index',)
+    index: int
+
+
+Block = Union[TextBlock, TableBlock, CodeBlock, MermaidBlock]
+
+
+def parse_line(line: str) -> TextLine:
+    """Classify one line of text and tokenize its inline markdown."""
+    match = _HEADING.match(line)
+    if match:
+        return TextLine(HEADING, len(match.group(1)), '', *parse_inline(match.group(2)))
+    match = _BULLET.match(line)
+    if match:
+        return TextLine(BULLET, len(match.group(1)), '', *parse_inline(match.group(2)))
+    match = _NUMBERED.match(line)
+    if match:
+        return TextLine(NUMBERED, len(match.group(1)), match.group(2), *parse_inline(match.group(3)))
+    if line.strip():
+        return TextLine(PARAGRAPH, 0, '', *parse_inline(line))
+    return TextLine(BLANK, 0, '', '', [])
+
+
+def parse_text(content: str) -> TextBlock:
+    """Build a text block; every line of content, blank or not, becomes a TextLine."""
+    return TextBlock([parse_line(line) for line in content.split('\n')])
+
+
+def _table_cells(line: str) -> List[str]:
+    return [cell.strip() for cell in line.split('|') if cell.strip()]
+
+
+def parse_table(lines: List[str]) -> TableBlock:
+    """Build a table from its |...| lines; the second line is the separator."""
+    rows = [_table_cells(lines[0])]
+    rows.extend(cells for cells in map(_table_cells, lines[2:]) if cells)
+    return TableBlock(rows)
+
+
+def clean_cell(cell: str) -> str:
+    """Remove bold and code markers from the markdown of a table cell."""
+    cell = re.sub(r'\*\*(.+?)\*\*', r'\1', cell)
+    return re.sub(r'`(.+?)`', r'\1', cell)
+
+
+def scan_blocks(markdown_text: str) -> Tuple[List[Block], List[str]]:
+    """
+    Split markdown into content blocks and collect its mermaid diagrams.
+
+    Text blocks keep the newlines around the code blocks and tables that
+    split them, as blank lines the converters turn into paragraph spacing.
+
+    Args:
+        markdown_text: The markdown content
+
+    Returns:
+        Tuple of (content blocks, mermaid codes)
+    """
+    blocks = []
+    mermaid_diagrams = []
+
+    def add_markdown(start: int, end: int):
+        content = markdown_text[start:end]
+        if content.strip():
+            blocks.append(parse_text(content))
+
+    def add_code(language: str, code: str):
+        if language.lower() == 'mermaid':
+            mermaid_diagrams.append(code)
+            blocks.append(MermaidBlock(len(mermaid_diagrams) - 1))
+        else:
+            blocks.append(CodeBlock(language, code))
+
+    text_start = 0  # Start of the markdown not yet emitted
+    fence = None  # (language, start of code, backticks) inside a fence
+    table_start = None  # Offset of the first line of a run of table lines
+    table_lines = []
+
+    def end_table(line_start: int):
+        # A single |...| line is ordinary text
+        nonlocal text_start
+        if len(table_lines) > 1:
+            add_markdown(text_start, table_start)
+            blocks.append(parse_table(table_lines))
+            # The newline ending the table stays with the text after it
+            text_start = line_start - 1 if markdown_text[line_start - 1:line_start] == '\n' else line_start
+        table_lines.clear()
+
+    # Only lines with a pipe or a backtick fence can start or end a block,
+    # so the scan jumps from one such line to the next
+    length = len(markdown_text)
+    table_next = None  # Offset of the line after the last table line
+    pos = 0  # Start of the line the search continues from
+    next_pipe = next_fence = -2  # Next '|' and '```' at or after pos, -1 if none
+    while True:
+        if -1 != next_fence < pos:
+            next_fence = markdown_text.find('```', pos)
+        if fence is not None:
+            # Pipes do not matter inside code
+            marker = next_fence
+        else:
+            if -1 != next_pipe < pos:
+                next_pipe = markdown_text.find('|', pos)
+            marker = next_pipe if next_fence == -1 or -1 != next_pipe < next_fence else next_fence
+        if marker == -1:
+            break
+        line_start = markdown_text.rfind('\n', pos, marker) + 1 or pos
+        newline = markdown_text.find('\n', marker)
+        line_end = length if newline == -1 else newline
+        line = markdown_text[line_start:line_end]
+        pos = line_end + 1
+
+        if fence is not None:
+            match = _FENCE_CLOSE.match(line)
+            if match and len(match.group(1)) >= fence[2]:
+                language, code_start, _ = fence
+                add_code(language, markdown_text[code_start:line_start])
+                fence = None
+                # The newline ending the fence stays with the text after it
+                text_start = line_end
+            continue
+
+        if table_lines and line_start != table_next:
+            end_table(table_next)
+        stripped = line.strip()
+        if len(stripped) >= 3 and stripped[0] == '|' and stripped[-1] == '|':
+            if not table_lines:
+                table_start = line_start
+            table_lines.append(stripped)
+            table_next = pos
+            continue
+        if table_lines:
+            end_table(line_start)
+
+        match = _FENCE_OPEN.match(line)
+        if match:
+            add_markdown(text_start, line_start)
+            fence = (match.group(2), pos, len(match.group(1)))
+
+    if fence is not None:
+        language, code_start, _ = fence
+        add_code(language, markdown_text[code_start:])
+        text_start = length
+    if table_lines:
+        end_table(min(table_next, length))
+    add_markdown(text_start, length)
+
+    return blocks, mermaid_diagrams
+
+
+
+def _logical_lines(lines: Iterable[str]) -> Iterator[str]:
+    """Lines without their newlines, as str.split('\n') would give them."""
+    ended = True
+    for line in lines:
+        ended = line.endswith('\n')
+        yield line[:-1] if ended else line
+    if ended:
+        # Text ending with a newline (or empty text) has an empty last line
+        yield ''
+
+
+def iter_blocks(lines: Iterable[str], mermaid_codes: List[str],
+                text_lines: int = STREAM_TEXT_LINES, text: bool = True) -> Iterator[Block]:
+    """
+    Parse markdown from an iterator of lines, yielding blocks as they complete.
+
+    Yields the blocks scan_blocks() returns for the same text, except that
+    a text block longer than text_lines lines comes as several consecutive
+    TextBlocks. Both converters lay out text line by line, so the split
+    does not change their output.
+
+    Args:
+        lines: Lines of markdown, each ending with its newline (an open
+            text file), or the pieces of str.split('\n')
+        mermaid_codes: List the mermaid diagrams are appended to;
+            MermaidBlock.index points into it
+        text_lines: Most lines per TextBlock
+        text: False to skip text and tables and yield only code and
+            mermaid blocks, for a quick pass that collects the diagrams
+
+    Yields:
+        Content blocks in document order
+    """
+    pending = []  # Lines of the current text run not yet yielded
+    has_text = False  # Whether the current text run is more than whitespace
+    table = []  # Stripped lines of a run of table lines
+    first_table_line = ''  # The first of them as written
+    fence = None  # (language, backticks) inside a fence
+    code = []  # Lines of the fenced code so far
+
+    def code_block(code_text: str) -> Block:
+        if fence[0].lower() == 'mermaid':
+            mermaid_codes.append(code_text)
+            return MermaidBlock(len(mermaid_codes) - 1)
+        return CodeBlock(fence[0], code_text)
+
+    def end_text() -> Iterator[Block]:
+        # Text that is only whitespace is dropped, as in scan_blocks()
+        nonlocal has_text
+        if has_text and pending:
+            yield TextBlock([parse_line(line) for line in pending])
+        pending.clear()
+        has_text = False
+
+    for line in _logical_lines(lines):
+        if fence is not None:
+            match = _FENCE_CLOSE.match(line)
+            if match and len(match.group(1)) >= fence[1]:
+                yield code_block(''.join(code_line + '\n' for code_line in code))
+                fence = None
+                code.clear()
+                # The newline ending the fence stays with the text after it
+                pending.append('')
+            else:
+                code.append(line)
+            continue
+
+        if text:
+            stripped = line.strip()
+            if len(stripped) >= 3 and stripped[0] == '|' and stripped[-1] == '|':
+                if not table:
+                    first_table_line = line
+                table.append(stripped)
+                continue
+            if len(table) > 1:
+                # The newlines around the table stay with the text before and after it
+                pending.append('')
+                yield from end_text()
+                yield parse_table(table)
+                pending.append('')
+            elif table:
+                # A single |...| line is ordinary text
+                pending.append(first_table_line)
+                has_text = True
+            table.clear()
+
+        match = _FENCE_OPEN.match(line)
+        if match:
+            pending.append('')
+            yield from end_text()
+            fence = (match.group(2), len(match.group(1)))
+            continue
+
+        if text:
+            pending.append(line)
+            has_text = has_text or bool(stripped)
+            if has_text and len(pending) >= text_lines:
+                yield TextBlock([parse_line(pending_line) for pending_line in pending])
+                pending.clear()
+
+    if fence is not None:
+        # An open fence runs to the end of the text
+        yield code_block('\n'.join(code))
+    elif len(table) > 1:
+        pending.append('')
+        yield from end_text()
+        yield parse_table(table)
+    elif table:
+        pending.append(first_table_line)
+        has_text = True
+    yield from end_text()
+
+
+def read_mermaid_codes(path: str) -> List[str]:
+    """
+    Collect the mermaid diagrams of a markdown file, reading it line by line.
+
+    Args:
+        path: Path to the markdown file
+
+    Returns:
+        Mermaid codes, in the order scan_blocks() numbers them
+    """
+    mermaid_codes = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for _ in iter_blocks(f, mermaid_codes, text=False):
+            pass
+    return mermaid_codes
@@ -16,123 +16,41 @@ Requirements:
     - Or uses the mermaid.ink API for rendering
 """
 
+import io
 import os
-import re
-import base64
-import tempfile
-import subprocess
+import sys
+import shutil
+import hashlib
+import zipfile
 import argparse
+import tempfile
+import itertools
 from pathlib import Path
-from typing import List, Dict, Tuple, Optional
-import time
+from typing import Iterable, Iterator, List, Tuple, Optional
 
 # DOCX imports
+import docx
 from docx import Document
 from docx.shared import Pt, RGBColor, Inches
 from docx.enum.text import WD_ALIGN_PARAGRAPH
-
-# Image handling
-from PIL import Image
-import requests
-
-
-class MermaidRenderer:
-    """Handle rendering of Mermaid diagrams to images."""
-
-    def __init__(self, use_api: bool = True):
-        """
-        Initialize the renderer.
-
-        Args:
-            use_api: If True, use mermaid.ink API. If False, use local mermaid CLI.
-        """
-        self.use_api = use_api
-        if not use_api:
-            # Check if mermaid CLI is installed
-            try:
-                subprocess.run(['mmdc', '--version'], check=True, capture_output=True)
-            except (subprocess.CalledProcessError, FileNotFoundError):
-                print("Warning: mermaid CLI not found. Falling back to API.")
-                self.use_api = True
-
-    def render_to_image(self, mermaid_code: str, output_path: str) -> bool:
-        """
-        Render mermaid code to an image file.
-
-        Args:
-            mermaid_code: The mermaid diagram code
-            output_path: Path where the image should be saved
-
-        Returns:
-            True if successful, False otherwise
-        """
-        if self.use_api:
-            return self._render_with_api(mermaid_code, output_path)
-        else:
-            return self._render_with_cli(mermaid_code, output_path)
-
-    def _render_with_api(self, mermaid_code: str, output_path: str) -> bool:
-        """Render using mermaid.ink API with retry logic."""
-        max_retries = 3
-        retry_delay = 2  # seconds
-
-        for attempt in range(max_retries):
-            try:
-                # Encode the mermaid code for the API
-                encoded = base64.urlsafe_b64encode(
-                    mermaid_code.encode('utf-8')
-                ).decode('ascii')
-
-                # Request the image from mermaid.ink
-                url = f"https://mermaid.ink/img/{encoded}"
-                response = requests.get(url, timeout=30)
-                response.raise_for_status()
-
-                # Save the image
-                with open(output_path, 'wb') as f:
-                    f.write(response.content)
-
-                return True
-            except requests.exceptions.HTTPError as e:
-                if attempt < max_retries - 1 and e.response.status_code in [503, 429, 500]:
-                    # Retry on server errors or rate limiting
-                    print(f"Mermaid API error (attempt {attempt + 1}/{max_retries}): {e.response.status_code}. Retrying in {retry_delay}s...")
-                    time.sleep(retry_delay)
-                    retry_delay *= 2  # Exponential backoff
-                else:
-                    print(f"Error rendering mermaid diagram with API: {e}")
-                    return False
-            except Exception as e:
-                print(f"Error rendering mermaid diagram with API: {e}")
-                return False
-
-        return False
-
-    def _render_with_cli(self, mermaid_code: str, output_path: str) -> bool:
-        """Render using local mermaid CLI."""
-        try:
-            # Create temporary file with mermaid code
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.mmd', delete=False) as f:
-                f.write(mermaid_code)
-                temp_mmd = f.name
-
-            # Run mermaid CLI
-            subprocess.run([
-                'mmdc',
-                '-i', temp_mmd,
-                '-o', output_path,
-                '-t', 'default',
-                '-b', 'white'
-            ], check=True, capture_output=True)
-
-            # Clean up
-            os.unlink(temp_mmd)
-            return True
-        except Exception as e:
-            print(f"Error rendering mermaid diagram with CLI: {e}")
-            if 'temp_mmd' in locals() and os.path.exists(temp_mmd):
-                os.unlink(temp_mmd)
-            return False
+from docx.oxml.ns import qn
+from lxml import etree
+
+from inline_markdown import InlineSpan, BOLD, ITALIC, CODE, LINK
+from markdown_blocks import (
+    scan_blocks, iter_blocks, read_mermaid_codes, clean_cell,
+    Block, TextBlock, TableBlock, CodeBlock, MermaidBlock,
+    HEADING, BULLET, NUMBERED, PARAGRAPH
+)
+from parse_cache import ParseCache, code_version, add_parse_cache_arguments, parse_cache_from_args
+from mermaid_renderer import (
+    MermaidRenderer, add_renderer_arguments, renderer_from_args, print_renderer_stats
+)
+
+# Width diagrams are placed at, in inches
+IMAGE_WIDTH_INCHES = 6
+# Paragraphs and tables held in memory before they are written out when streaming
+STREAM_FLUSH_ELEMENTS = 500
 
 
 class MarkdownToDocx:
@@ -141,69 +59,32 @@ class MarkdownToDocx:
     def __init__(self):
         """Initialize the converter."""
         self.mermaid_renderer = MermaidRenderer(use_api=True)
+        self.stream = False  # Parse and write large files a chunk at a time
+        self.parse_cache = None  # Optional ParseCache for unchanged files
 
-    def parse_markdown(self, markdown_text: str) -> Tuple[List[Dict], List[str]]:
+    def parse_markdown(self, markdown_text: str) -> Tuple[List[Block], List[str]]:
         """
         Parse markdown and extract mermaid diagrams and tables.
 
+        Fenced code is recognised first, so pipes inside code blocks never
+        form a table (see markdown_blocks.scan_blocks()).
+
         Args:
             markdown_text: The markdown content
 
         Returns:
             Tuple of (content blocks, mermaid codes)
         """
-        blocks = []
-        mermaid_diagrams = []
-
-        # First, extract tables before splitting by code blocks
-        # Tables are identified by pipes - match all consecutive lines with pipes
-        table_pattern = r'(\|.+\|(?:\n\|.+\|)+)'
-
-        # Replace tables with placeholders
-        table_matches = []
-        def replace_table(match):
-            table_matches.append(match.group(0))
-            return f'<<<TABLE_{len(table_matches) - 1}>>>'
-
-        markdown_with_placeholders = re.sub(table_pattern, replace_table, markdown_text)
-
-        # Split by code blocks
-        parts = re.split(r'```(\w+)?\n(.*?)```', markdown_with_placeholders, flags=re.DOTALL)
-
-        for i, part in enumerate(parts):
-            if i % 3 == 0:  # Regular markdown content
-                if part.strip():
-                    # Check for table placeholders
-                    table_placeholder_pattern = r'<<<TABLE_(\d+)>>>'
-                    sub_parts = re.split(table_placeholder_pattern, part)
-
-                    for j, sub_part in enumerate(sub_parts):
-                        if j % 2 == 0:  # Regular markdown
-                            if sub_part.strip():
-                                blocks.append({'type': 'markdown', 'content': sub_part})
-                        else:  # Table index
-                            table_idx = int(sub_part)
-                            blocks.append({'type': 'table', 'content': table_matches[table_idx]})
-            elif i % 3 == 1:  # Code block language
-                lang = part
-            else:  # Code block content
-                if lang and lang.lower() == 'mermaid':
-                    mermaid_diagrams.append(part)
-                    blocks.append({'type': 'mermaid', 'index': len(mermaid_diagrams) - 1})
-                else:
-                    # Other code blocks
-                    blocks.append({'type': 'code', 'language': lang or '', 'content': part})
-
-        return blocks, mermaid_diagrams
-
-    def create_docx(self, title: str, blocks: List[Dict], mermaid_images: List[str]) -> Document:
+        return scan_blocks(markdown_text)
+
+    def create_docx(self, title: str, blocks: List[Block], mermaid_images: List[Optional[bytes]]) -> Document:
         """
         Create a DOCX document with the parsed content.
 
         Args:
             title: Document title
             blocks: Content blocks from parsing
-            mermaid_images: Paths to rendered mermaid images
+            mermaid_images: Rendered mermaid images as PNG or JPEG bytes
 
         Returns:
             The Document object
@@ -215,107 +96,214 @@ class MarkdownToDocx:
         title_para.alignment = WD_ALIGN_PARAGRAPH.LEFT
 
         for block in blocks:
-            if block['type'] == 'markdown':
-                self._add_markdown_to_doc(doc, block['content'])
-            elif block['type'] == 'code':
-                self._add_code_block(doc, block['content'], block['language'])
-            elif block['type'] == 'table':
-                self._add_table_to_doc(doc, block['content'])
-            elif block['type'] == 'mermaid':
-                image_path = mermaid_images[block['index']]
-                if os.path.exists(image_path):
-                    doc.add_picture(image_path, width=Inches(6))
-                    doc.add_paragraph()  # Add spacing after image
+            self._add_block(doc, block, mermaid_images)
 
         return doc
 
-    def _add_markdown_to_doc(self, doc: Document, markdown_text: str):
+    def _add_block(self, doc: Document, block: Block, mermaid_images: List[Optional[bytes]]):
         """
-        Add markdown content to the document with proper formatting.
+        Add one content block to the document.
 
         Args:
             doc: The Document object
-            markdown_text: Markdown content to add
+            block: Content block from parsing
+            mermaid_images: Rendered mermaid images as PNG or JPEG bytes
         """
-        lines = markdown_text.split('\n')
-
-        for line in lines:
-            # Handle headers
-            header_match = re.match(r'^(#{1,6})\s+(.+)$', line)
-            if header_match:
-                level = len(header_match.group(1))
-                text = header_match.group(2)
-                para = doc.add_heading(level=level)
-                self._add_formatted_text(para, text)
-                continue
+        if isinstance(block, TextBlock):
+            self._add_text_to_doc(doc, block)
+        elif isinstance(block, CodeBlock):
+            self._add_code_block(doc, block.content, block.language)
+        elif isinstance(block, TableBlock):
+            self._add_table_to_doc(doc, block)
+        elif isinstance(block, MermaidBlock):
+            image = mermaid_images[block.index]
+            if image:
+                doc.add_picture(io.BytesIO(image), width=Inches(IMAGE_WIDTH_INCHES))
+                doc.add_paragraph()  # Add spacing after image
+
+    def write_docx_streaming(self, title: str, blocks: Iterable[Block],
+                             mermaid_images: List[Optional[bytes]], output_file: str):
+        """
+        Write a DOCX file while the blocks are still being parsed.
+
+        python-docx keeps the whole document in memory until it is saved.
+        Here the body is written out to a temporary file every
+        STREAM_FLUSH_ELEMENTS paragraphs and tables and then dropped from
+        the document; at the end the saved document, which still holds the
+        styles, images and section settings, gets the written body spliced
+        back in. Memory use then depends on the images, not on the length
+        of the text.
+
+        Args:
+            title: Document title
+            blocks: Content blocks, typically from markdown_blocks.iter_blocks()
+            mermaid_images: Rendered mermaid images as PNG or JPEG bytes
+            output_file: Path of the DOCX file to write
+        """
+        doc = Document()
+        title_para = doc.add_heading(title, level=0)
+        title_para.alignment = WD_ALIGN_PARAGRAPH.LEFT
+
+        body = doc.element.body
+        shape_ids = itertools.count(1)
+        with tempfile.TemporaryFile() as spool:
+            for block in blocks:
+                self._add_block(doc, block, mermaid_images)
+                if len(body) > STREAM_FLUSH_ELEMENTS:
+                    self._spool_body(body, spool, shape_ids)
+            self._spool_body(body, spool, shape_ids)
+            spool.seek(0)
+            self._save_with_body(doc, spool, output_file)
+
+    @staticmethod
+    def _save_with_body(doc: Document, body_xml, output_file: str):
+        """
+        Save a document whose body content was written out separately.
+
+        Args:
+            doc: The Document, its body holding only the section properties
+            body_xml: Binary file with the XML of the body content, read
+                from its current position
+            output_file: Path of the DOCX file to write
+        """
+        skeleton = io.BytesIO()
+        doc.save(skeleton)
+        with zipfile.ZipFile(skeleton) as source, \
+                zipfile.ZipFile(output_file, 'w', zipfile.ZIP_DEFLATED) as target:
+            for item in source.infolist():
+                if item.filename != 'word/document.xml':
+                    target.writestr(item, source.read(item))
+                    continue
+                xml = source.read(item)
+                body_start = xml.index(b'<w:body>') + len(b'<w:body>')
+                with target.open(item.filename, 'w') as out:
+                    out.write(xml[:body_start])
+                    shutil.copyfileobj(body_xml, out)
+                    out.write(xml[body_start:])
+
+    def _save_cached(self, title: str, blocks: List[Block], mermaid_images: List[Optional[bytes]],
+                     source_hash: str, output_file: str):
+        """
+        Write a DOCX file, reusing the body XML cached for the same input.
+
+        The cache holds the XML of the document body. On a hit, a new
+        document gets the diagram images added in the same order as when
+        the body was built, which gives them the same relationship IDs
+        the cached XML refers to, and the body is spliced in unchanged.
+
+        Args:
+            title: Document title
+            blocks: Content blocks from parsing
+            mermaid_images: Rendered mermaid images as PNG or JPEG bytes
+            source_hash: ParseCache.source_hash() of the markdown
+            output_file: Path of the DOCX file to write
+        """
+        image_hashes = [hashlib.sha256(image).hexdigest() if image else None for image in mermaid_images]
+        key = ParseCache.make_output_key(
+            'docx', code_version(sys.modules[__name__], docx), source_hash, title, image_hashes
+        )
+        body_xml = self.parse_cache.get_value(key)
+        if body_xml is None:
+            doc = self.create_docx(title, blocks, mermaid_images)
+            spool = io.BytesIO()
+            self._spool_body(doc.element.body, spool, itertools.count(1))
+            body_xml = spool.getvalue()
+            self.parse_cache.put_value(key, body_xml)
+        else:
+            doc = Document()
+            for image in mermaid_images:
+                if image:
+                    doc.part.get_or_add_image(io.BytesIO(image))
+        self._save_with_body(doc, io.BytesIO(body_xml), output_file)
+
+    @staticmethod
+    def _spool_body(body, spool, shape_ids: Iterator[int]):
+        """
+        Write the body's paragraphs and tables to spool and remove them.
+
+        The section properties, which must stay last in the body, are
+        kept. Drawing IDs must be unique in the document, but python-docx
+        numbers new ones from what is still in memory, so they are
+        renumbered from shape_ids first.
+
+        Args:
+            body: The document's w:body element
+            spool: Binary file the XML is appended to
+            shape_ids: Source of drawing IDs for the whole document
+        """
+        sect_pr = body.find(qn('w:sectPr'))
+        if sect_pr is not None:
+            body.remove(sect_pr)
+        if len(body):
+            for doc_pr in body.iter(qn('wp:docPr')):
+                shape_id = next(shape_ids)
+                doc_pr.set('id', str(shape_id))
+                doc_pr.set('name', f'Picture {shape_id}')
+            # Serialize the body as a whole so the namespaces are declared
+            # once, on w:body, then keep only what is inside it
+            xml = etree.tostring(body, encoding='utf-8', xml_declaration=False)
+            spool.write(xml[xml.index(b'>') + 1:xml.rindex(b'</')])
+            body.clear()
+        if sect_pr is not None:
+            body.append(sect_pr)
+
+    def _add_text_to_doc(self, doc: Document, block: TextBlock):
+        """
+        Add the headings, lists and paragraphs of a text block to the document.
 
-            # Handle list items
-            list_match = re.match(r'^(\s*)[\*\-]\s+(.+)$', line)
-            if list_match:
-                indent = list_match.group(1)
-                text = list_match.group(2)
+        Args:
+            doc: The Document object
+            block: Parsed text block
+        """
+        for line in block.lines:
+            if line.kind == HEADING:
+                para = doc.add_heading(level=line.level)
+            elif line.kind == BULLET:
                 para = doc.add_paragraph(style='List Bullet')
-                self._add_formatted_text(para, text)
                 # Set indentation level
-                para.paragraph_format.left_indent = Inches(len(indent) * 0.25)
-                continue
-
-            # Handle numbered lists
-            num_list_match = re.match(r'^(\s*)(\d+)\.\s+(.+)$', line)
-            if num_list_match:
-                indent = num_list_match.group(1)
-                text = num_list_match.group(3)
+                para.paragraph_format.left_indent = Inches(line.level * 0.25)
+            elif line.kind == NUMBERED:
                 para = doc.add_paragraph(style='List Number')
-                self._add_formatted_text(para, text)
-                para.paragraph_format.left_indent = Inches(len(indent) * 0.25)
-                continue
-
-            # Regular paragraph
-            if line.strip():
+                para.paragraph_format.left_indent = Inches(line.level * 0.25)
+            elif line.kind == PARAGRAPH:
                 para = doc.add_paragraph()
-                self._add_formatted_text(para, line)
             else:
                 # Empty line
                 doc.add_paragraph()
+                continue
+            self._add_formatted_text(para, line.text, line.spans)
 
-    def _add_formatted_text(self, paragraph, text: str):
+    def _add_formatted_text(self, paragraph, text: str, spans: List[InlineSpan]):
         """
-        Add text to a paragraph with inline formatting (bold, italic).
+        Add text to a paragraph as runs carrying its inline formatting.
 
         Args:
             paragraph: The paragraph object
-            text: Text with markdown formatting
+            text: Text with markdown syntax removed
+            spans: Inline spans of text, sorted by start
         """
-        # Find all formatting markers
-        # This regex finds bold (**text**), italic (*text*), and regular text
-        pattern = r'(\*\*.*?\*\*|\*.*?\*|__.*?__|_.*?_|\[.*?\]\(.*?\)|[^*_\[]+)'
-
-        parts = re.findall(pattern, text)
-
-        for part in parts:
-            if not part:
-                continue
-
-            # Bold: **text** or __text__
-            if (part.startswith('**') and part.endswith('**')) or \
-               (part.startswith('__') and part.endswith('__')):
-                run = paragraph.add_run(part[2:-2])
-                run.bold = True
-            # Italic: *text* or _text_ (but not part of bold)
-            elif (part.startswith('*') and part.endswith('*') and not part.startswith('**')) or \
-                 (part.startswith('_') and part.endswith('_') and not part.startswith('__')):
-                run = paragraph.add_run(part[1:-1])
-                run.italic = True
-            # Links: [text](url)
-            elif part.startswith('[') and '](' in part:
-                link_match = re.match(r'\[(.+?)\]\((.+?)\)', part)
-                if link_match:
-                    run = paragraph.add_run(link_match.group(1))
+        # Cut the text wherever a span starts or ends; each piece is one run
+        # with the styles of the spans covering it
+        cuts = sorted({0, len(text)} | {span.start for span in spans} | {span.end for span in spans})
+        active = []
+        next_span = 0
+        for start, end in zip(cuts, cuts[1:]):
+            active = [span for span in active if span.end > start]
+            while next_span < len(spans) and spans[next_span].start <= start:
+                active.append(spans[next_span])
+                next_span += 1
+
+            run = paragraph.add_run(text[start:end])
+            for span in active:
+                if span.style == BOLD:
+                    run.bold = True
+                elif span.style == ITALIC:
+                    run.italic = True
+                elif span.style == CODE:
+                    run.font.name = 'Courier New'
+                elif span.style == LINK:
                     run.font.color.rgb = RGBColor(0, 0, 255)
                     run.underline = True
-            else:
-                # Regular text
-                paragraph.add_run(part)
 
     def _add_code_block(self, doc: Document, code: str, language: str):
         """
@@ -357,31 +345,16 @@ class MarkdownToDocx:
 
         pPr.append(pBdr)
 
-    def _add_table_to_doc(self, doc: Document, table_text: str):
+    def _add_table_to_doc(self, doc: Document, block: TableBlock):
         """
         Add a markdown table to the document.
 
         Args:
             doc: The Document object
-            table_text: Markdown table text
+            block: Parsed table
         """
-        # Parse table rows
-        lines = [line.strip() for line in table_text.strip().split('\n') if line.strip()]
-
-        if len(lines) < 2:
-            return  # Invalid table
-
-        # Parse header
-        header_cells = [cell.strip() for cell in lines[0].split('|') if cell.strip()]
-
-        # Skip separator line (line 1)
-
-        # Parse data rows
-        data_rows = []
-        for line in lines[2:]:
-            cells = [cell.strip() for cell in line.split('|') if cell.strip()]
-            if cells:
-                data_rows.append(cells)
+        header_cells = block.rows[0]
+        data_rows = block.rows[1:]
 
         # Create table
         table = doc.add_table(rows=1 + len(data_rows), cols=len(header_cells))
@@ -392,9 +365,7 @@ class MarkdownToDocx:
         for i, header_text in enumerate(header_cells):
             cell = header_row.cells[i]
             # Remove markdown formatting from header
-            clean_text = re.sub(r'\*\*(.+?)\*\*', r'\1', header_text)
-            clean_text = re.sub(r'`(.+?)`', r'\1', clean_text)
-            cell.text = clean_text
+            cell.text = clean_cell(header_text)
 
             # Format header
             for paragraph in cell.paragraphs:
@@ -404,7 +375,6 @@ class MarkdownToDocx:
 
             # Set background color for header
             from docx.oxml.shared import OxmlElement
-            from docx.oxml.ns import qn
             shd = OxmlElement('w:shd')
             shd.set(qn('w:fill'), 'D9E2F3')  # Light blue
             cell._element.get_or_add_tcPr().append(shd)
@@ -416,9 +386,7 @@ class MarkdownToDocx:
                 if col_idx < len(header_cells):  # Ensure we don't exceed columns
                     cell = row.cells[col_idx]
                     # Remove markdown formatting and handle code blocks
-                    clean_text = re.sub(r'`(.+?)`', r'\1', cell_text)
-                    clean_text = re.sub(r'\*\*(.+?)\*\*', r'\1', clean_text)
-                    cell.text = clean_text
+                    cell.text = clean_cell(cell_text)
 
                     # Format code-like content (backticks)
                     if '`' in cell_text:
@@ -441,44 +409,66 @@ class MarkdownToDocx:
         Returns:
             The output file path
         """
-        # Read markdown file
-        with open(markdown_file, 'r', encoding='utf-8') as f:
-            markdown_content = f.read()
-
-        # Parse markdown and extract mermaid diagrams
-        blocks, mermaid_codes = self.parse_markdown(markdown_content)
-
-        # Render mermaid diagrams
-        mermaid_images = []
-        with tempfile.TemporaryDirectory() as temp_dir:
-            for i, mermaid_code in enumerate(mermaid_codes):
-                image_path = os.path.join(temp_dir, f'mermaid_{i}.png')
-                if self.mermaid_renderer.render_to_image(mermaid_code, image_path):
-                    mermaid_images.append(image_path)
-                else:
-                    mermaid_images.append('')
-
-            # Create DOCX
-            title = Path(markdown_file).stem
-            doc = self.create_docx(title, blocks, mermaid_images)
-
-            # Determine output file path
-            if not output_file:
-                # Create docx directory in the same location as the markdown file
-                md_path = Path(markdown_file)
-                docx_dir = md_path.parent / 'docx'
-                docx_dir.mkdir(exist_ok=True)
-                output_file = str(docx_dir / f"{md_path.stem}.docx")
+        # Determine output file path
+        if not output_file:
+            # Create docx directory in the same location as the markdown file
+            md_path = Path(markdown_file)
+            docx_dir = md_path.parent / 'docx'
+            docx_dir.mkdir(exist_ok=True)
+            output_file = str(docx_dir / f"{md_path.stem}.docx")
+
+        # Ensure parent directory exists
+        Path(output_file).parent.mkdir(parents=True, exist_ok=True)
+
+        title = Path(markdown_file).stem
+        if self.stream:
+            # Collect the diagrams in a quick first pass, then parse the file
+            # again as the document is written, never holding all of it in memory
+            mermaid_codes = read_mermaid_codes(markdown_file)
+            mermaid_images = self.mermaid_renderer.render_all(mermaid_codes, source=markdown_file)
+            with open(markdown_file, 'r', encoding='utf-8') as f:
+                self.write_docx_streaming(title, iter_blocks(f, []), mermaid_images, output_file)
+        else:
+            # Read markdown file
+            with open(markdown_file, 'r', encoding='utf-8') as f:
+                markdown_content = f.read()
+
+            # Parse markdown and extract mermaid diagrams, unless the
+            # parse cache has the blocks of the same text
+            if self.parse_cache is not None:
+                blocks, mermaid_codes, source_hash = self.parse_cache.parse(markdown_content)
+            else:
+                blocks, mermaid_codes = self.parse_markdown(markdown_content)
 
-            # Ensure parent directory exists
-            Path(output_file).parent.mkdir(parents=True, exist_ok=True)
+            # Render mermaid diagrams
+            mermaid_images = self.mermaid_renderer.render_all(mermaid_codes, source=markdown_file)
 
-            # Save the document
-            doc.save(output_file)
+            # Create DOCX and save the document
+            if self.parse_cache is not None:
+                self._save_cached(title, blocks, mermaid_images, source_hash, output_file)
+            else:
+                doc = self.create_docx(title, blocks, mermaid_images)
+                doc.save(output_file)
 
         print(f"\nDocument created successfully: {output_file}")
         return output_file
 
+    def _prerender_diagrams(self, md_files: List[Path]):
+        """
+        Render the mermaid diagrams of several markdown files in one pass.
+
+        Args:
+            md_files: Markdown files whose diagrams should be rendered
+        """
+        mermaid_codes = []
+        for md_file in md_files:
+            try:
+                file_codes = read_mermaid_codes(str(md_file))
+            except (OSError, UnicodeDecodeError):
+                continue  # Reported when the file itself is converted
+            mermaid_codes.extend(file_codes)
+        self.mermaid_renderer.prerender(mermaid_codes)
+
     def convert_directory(self, directory: str, output_dir: Optional[str] = None) -> List[str]:
         """
         Convert all markdown files in a directory to DOCX.
@@ -504,6 +494,10 @@ class MarkdownToDocx:
 
         print(f"Found {len(md_files)} markdown file(s) in '{directory}'")
 
+        # Render every diagram of the run up front so the CLI backend can
+        # batch across files; each convert() below then hits the cache
+        self._prerender_diagrams(md_files)
+
         # Set output directory - default to 'docx' subdirectory
         if output_dir:
             output_path = Path(output_dir)
@@ -544,10 +538,12 @@ def main():
         help='Output file or directory (default: same location as input with .docx extension)'
     )
     parser.add_argument(
-        '--use-cli',
+        '--stream',
         action='store_true',
-        help='Use local mermaid CLI instead of API for rendering'
+        help='Parse and write each file a chunk at a time, keeping memory use bounded for very large files'
     )
+    add_renderer_arguments(parser)
+    add_parse_cache_arguments(parser)
 
     args = parser.parse_args()
 
@@ -559,9 +555,10 @@ def main():
     # Create converter
     converter = MarkdownToDocx()
 
-    # Set rendering method
-    if args.use_cli:
-        converter.mermaid_renderer = MermaidRenderer(use_api=False)
+    # Set rendering method and diagram cache
+    converter.mermaid_renderer = renderer_from_args(args, display_size=(IMAGE_WIDTH_INCHES * 72, None))
+    converter.stream = args.stream
+    converter.parse_cache = parse_cache_from_args(args)
 
     try:
         # Check if path is a directory or file
@@ -575,6 +572,11 @@ def main():
     except Exception as e:
         print(f"Error: {e}")
         return 1
+    finally:
+        converter.mermaid_renderer.close()
+        print_renderer_stats(converter.mermaid_renderer)
+        if converter.parse_cache is not None:
+            print(converter.parse_cache.stats())
 
 
 if __name__ == '__main__':
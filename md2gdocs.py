@@ -18,14 +18,13 @@ Requirements:
 """
 
 import os
-import re
-import json
-import base64
-import tempfile
-import subprocess
+import sys
+import time
 import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Tuple, Optional
+from typing import Iterable, Iterator, List, Dict, Tuple, Optional
 import io
 
 # Google API imports
@@ -36,13 +35,23 @@ from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaIoBaseUpload
 
-# Markdown parsing
-import markdown
-from markdown.extensions import fenced_code
-
-# Image handling
-from PIL import Image
-import requests
+from api_batch import BatchQueue
+from drive_uploads import (
+    UploadManifest, UploadStats, DEFAULT_MANIFEST_PATH, DEFAULT_RESUMABLE_THRESHOLD_MB,
+    DEFAULT_UPLOAD_JOBS
+)
+from image_optimizer import image_mimetype, image_extension
+from inline_markdown import InlineSpan, BOLD, ITALIC, CODE, LINK
+from request_scheduler import RequestScheduler, DEFAULT_CHUNK_REQUESTS, DEFAULT_CHUNK_MB
+from markdown_blocks import (
+    scan_blocks, iter_blocks, read_mermaid_codes, clean_cell,
+    Block, TextBlock, TableBlock, CodeBlock, MermaidBlock,
+    HEADING, BULLET, NUMBERED
+)
+from parse_cache import ParseCache, code_version, add_parse_cache_arguments, parse_cache_from_args
+from mermaid_renderer import (
+    MermaidRenderer, add_renderer_arguments, renderer_from_args, print_renderer_stats
+)
 
 # If modifying these scopes, delete the file token.json.
 SCOPES = [
@@ -50,106 +59,108 @@ SCOPES = [
     'https://www.googleapis.com/auth/drive.file'
 ]
 
-
-class MermaidRenderer:
-    """Handle rendering of Mermaid diagrams to images."""
-    
-    def __init__(self, use_api: bool = True):
-        """
-        Initialize the renderer.
-        
-        Args:
-            use_api: If True, use mermaid.ink API. If False, use local mermaid CLI.
-        """
-        self.use_api = use_api
-        if not use_api:
-            # Check if mermaid CLI is installed
-            try:
-                subprocess.run(['mmdc', '--version'], check=True, capture_output=True)
-            except (subprocess.CalledProcessError, FileNotFoundError):
-                print("Warning: mermaid CLI not found. Falling back to API.")
-                self.use_api = True
-    
-    def render_to_image(self, mermaid_code: str, output_path: str) -> bool:
-        """
-        Render mermaid code to an image file.
-        
-        Args:
-            mermaid_code: The mermaid diagram code
-            output_path: Path where the image should be saved
-            
-        Returns:
-            True if successful, False otherwise
-        """
-        if self.use_api:
-            return self._render_with_api(mermaid_code, output_path)
-        else:
-            return self._render_with_cli(mermaid_code, output_path)
-    
-    def _render_with_api(self, mermaid_code: str, output_path: str) -> bool:
-        """Render using mermaid.ink API with retry logic."""
-        import time
-
-        max_retries = 3
-        retry_delay = 2  # seconds
-
-        for attempt in range(max_retries):
-            try:
-                # Encode the mermaid code for the API
-                encoded = base64.urlsafe_b64encode(
-                    mermaid_code.encode('utf-8')
-                ).decode('ascii')
-
-                # Request the image from mermaid.ink
-                url = f"https://mermaid.ink/img/{encoded}"
-                response = requests.get(url, timeout=30)
-                response.raise_for_status()
-
-                # Save the image
-                with open(output_path, 'wb') as f:
-                    f.write(response.content)
-
-                return True
-            except requests.exceptions.HTTPError as e:
-                if attempt < max_retries - 1 and e.response.status_code in [503, 429, 500]:
-                    # Retry on server errors or rate limiting
-                    print(f"Mermaid API error (attempt {attempt + 1}/{max_retries}): {e.response.status_code}. Retrying in {retry_delay}s...")
-                    time.sleep(retry_delay)
-                    retry_delay *= 2  # Exponential backoff
-                else:
-                    print(f"Error rendering mermaid diagram with API: {e}")
-                    return False
-            except Exception as e:
-                print(f"Error rendering mermaid diagram with API: {e}")
-                return False
-
-        return False
-    
-    def _render_with_cli(self, mermaid_code: str, output_path: str) -> bool:
-        """Render using local mermaid CLI."""
-        try:
-            # Create temporary file with mermaid code
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.mmd', delete=False) as f:
-                f.write(mermaid_code)
-                temp_mmd = f.name
-            
-            # Run mermaid CLI
-            subprocess.run([
-                'mmdc',
-                '-i', temp_mmd,
-                '-o', output_path,
-                '-t', 'default',
-                '-b', 'white'
-            ], check=True, capture_output=True)
-            
-            # Clean up
-            os.unlink(temp_mmd)
-            return True
-        except Exception as e:
-            print(f"Error rendering mermaid diagram with CLI: {e}")
-            if os.path.exists(temp_mmd):
-                os.unlink(temp_mmd)
-            return False
+# Size of the box diagrams are placed in, in points (width, height)
+IMAGE_SIZE_PT = (400, 300)
+FOLDER_MIMETYPE = 'application/vnd.google-apps.folder'
+PUBLIC_READER = {'type': 'anyone', 'role': 'reader'}
+# Text style and fields per inline span style; links get their URL added
+INLINE_TEXT_STYLES = {
+    BOLD: ({'bold': True}, 'bold'),
+    ITALIC: ({'italic': True}, 'italic'),
+    CODE: ({'weightedFontFamily': {'fontFamily': 'Courier New'}}, 'weightedFontFamily'),
+    LINK: (None, 'link'),
+}
+# Every text style field the converter sets
+PLAIN_TEXT_FIELDS = 'bold,italic,fontSize,weightedFontFamily,backgroundColor,link'
+# Lines of markdown per chunk of requests when streaming
+STREAM_CHUNK_LINES = 2000
+
+
+def table_length(rows: int, columns: int) -> int:
+    """Number of indices an empty table takes: its start, then per row a
+    row start plus a cell start and an empty paragraph for every cell."""
+    return 1 + rows * (1 + 2 * columns)
+
+
+def table_cell_index(table_start: int, columns: int, row: int, column: int) -> int:
+    """Index of the paragraph in a cell of an empty table starting at table_start."""
+    return table_start + 1 + row * (1 + 2 * columns) + 1 + 2 * column + 1
+
+
+def shift_indices(request, delta: int):
+    """Copy of a Docs request with every document index in it moved by delta."""
+    if isinstance(request, dict):
+        return {
+            key: value + delta if key in ('index', 'startIndex', 'endIndex') and isinstance(value, int)
+            else shift_indices(value, delta)
+            for key, value in request.items()
+        }
+    if isinstance(request, list):
+        return [shift_indices(value, delta) for value in request]
+    return request
+
+
+_UNSET = object()
+
+
+def coalesce_text_styles(requests: List[Dict]) -> List[Dict]:
+    """
+    Merge the updateTextStyle requests in a list of formatting requests.
+
+    Text style fields are independent of each other, so the final value of
+    every field can be worked out range by range, with later requests
+    winning where ranges overlap as they would in the document. Each field
+    then needs one request per run of equal values; fields whose runs
+    cover the same range share a request. Adjacent or overlapping spans
+    with the same style collapse into one, and requests that only repeat
+    a style (e.g. bold inside a header, which is bold already) disappear.
+
+    Args:
+        requests: Formatting requests; fields of updateTextStyle requests
+            must be top-level TextStyle field names
+
+    Returns:
+        The other requests in their original order, followed by the merged
+        updateTextStyle requests sorted by range
+    """
+    styles = [request['updateTextStyle'] for request in requests if 'updateTextStyle' in request]
+    if len(styles) < 2:
+        return requests
+
+    bounds = sorted({index for style in styles
+                     for index in (style['range']['startIndex'], style['range']['endIndex'])})
+    position = {index: i for i, index in enumerate(bounds)}
+    values = {}  # field -> value per segment between consecutive bounds, in order of first use
+    for style in styles:
+        first = position[style['range']['startIndex']]
+        last = position[style['range']['endIndex']]
+        for field in style['fields'].split(','):
+            segments = values.setdefault(field, [_UNSET] * (len(bounds) - 1))
+            # A field listed without a value is reset to its default (None)
+            segments[first:last] = [style['textStyle'].get(field)] * (last - first)
+
+    runs = {}  # (start, end) -> {field: value}
+    for field, segments in values.items():
+        i = 0
+        while i < len(segments):
+            value = segments[i]
+            j = i + 1
+            if value is not _UNSET:
+                while j < len(segments) and segments[j] is not _UNSET and segments[j] == value:
+                    j += 1
+                runs.setdefault((bounds[i], bounds[j]), {})[field] = value
+            i = j
+
+    return [request for request in requests if 'updateTextStyle' not in request] + [
+        {
+            'updateTextStyle': {
+                'range': {'startIndex': start, 'endIndex': end},
+                'textStyle': {field: value for field, value in fields.items() if value is not None},
+                'fields': ','.join(fields)
+            }
+        }
+        for (start, end), fields in sorted(runs.items())
+    ]
 
 
 class MarkdownToGoogleDocs:
@@ -165,6 +176,20 @@ class MarkdownToGoogleDocs:
         self.creds = None
         self.credentials_file = credentials_file
         self.mermaid_renderer = MermaidRenderer(use_api=True)
+        self.upload_manifest = None  # Optional UploadManifest for reusing uploaded images
+        self.resumable_threshold = DEFAULT_RESUMABLE_THRESHOLD_MB * 1024 * 1024
+        self.upload_stats = UploadStats()
+        self.image_folder = None  # Name of a shared Drive folder for diagram images
+        self._image_folder_id = None  # Resolved once per process
+        self._image_folder_lock = threading.Lock()
+        self.upload_jobs = DEFAULT_UPLOAD_JOBS
+        self.verify_table_indices = False  # Check computed table indices against the document
+        self.request_scheduler = RequestScheduler()  # Sends Docs requests in bounded chunks
+        self.stream = False  # Parse and send large files a chunk at a time
+        self.parse_cache = None  # Optional ParseCache for unchanged files
+        self._upload_pool = None  # Worker threads for image uploads, created on first use
+        self._thread_local = threading.local()  # Per-thread Drive service
+        self._live_file_ids = set()  # Drive files confirmed to exist during this run
         self.temp_images = []
         
     def authenticate(self):
@@ -193,159 +218,402 @@ class MarkdownToGoogleDocs:
             with open(token_file, 'w') as token:
                 token.write(self.creds.to_json())
     
-    def parse_markdown(self, markdown_text: str) -> Tuple[List[Dict], List[str]]:
+    def parse_markdown(self, markdown_text: str) -> Tuple[List[Block], List[str]]:
         """
         Parse markdown and extract mermaid diagrams and tables.
 
+        Fenced code is recognised first, so pipes inside code blocks never
+        form a table (see markdown_blocks.scan_blocks()).
+
         Args:
             markdown_text: The markdown content
 
         Returns:
             Tuple of (content blocks, mermaid codes)
         """
-        blocks = []
-        mermaid_diagrams = []
-
-        # First, extract tables before splitting by code blocks
-        # Tables are identified by pipes - match all consecutive lines with pipes
-        table_pattern = r'(\|.+\|(?:\n\|.+\|)+)'
-
-        # Replace tables with placeholders
-        table_matches = []
-        def replace_table(match):
-            table_matches.append(match.group(0))
-            return f'<<<TABLE_{len(table_matches) - 1}>>>'
-
-        markdown_with_placeholders = re.sub(table_pattern, replace_table, markdown_text)
-
-        # Split by code blocks
-        parts = re.split(r'```(\w+)?\n(.*?)```', markdown_with_placeholders, flags=re.DOTALL)
-
-        for i, part in enumerate(parts):
-            if i % 3 == 0:  # Regular markdown content
-                if part.strip():
-                    # Check for table placeholders
-                    table_placeholder_pattern = r'<<<TABLE_(\d+)>>>'
-                    sub_parts = re.split(table_placeholder_pattern, part)
-
-                    for j, sub_part in enumerate(sub_parts):
-                        if j % 2 == 0:  # Regular markdown
-                            if sub_part.strip():
-                                blocks.append({'type': 'markdown', 'content': sub_part})
-                        else:  # Table index
-                            table_idx = int(sub_part)
-                            blocks.append({'type': 'table', 'content': table_matches[table_idx]})
-            elif i % 3 == 1:  # Code block language
-                lang = part
-            else:  # Code block content
-                if lang and lang.lower() == 'mermaid':
-                    mermaid_diagrams.append(part)
-                    blocks.append({'type': 'mermaid', 'index': len(mermaid_diagrams) - 1})
-                else:
-                    # Other code blocks
-                    blocks.append({'type': 'code', 'language': lang or '', 'content': part})
-
-        return blocks, mermaid_diagrams
+        return scan_blocks(markdown_text)
     
-    def upload_image_to_drive(self, image_path: str, drive_service) -> str:
+    def upload_image_to_drive(self, image_data: bytes, drive_service,
+                              name: str = 'mermaid.png',
+                              batch: Optional[BatchQueue] = None) -> str:
         """
         Upload an image to Google Drive and get its ID.
+
+        With an upload manifest, an image that was uploaded before is not
+        uploaded again: its recorded file is reused once Drive confirms it
+        still exists. Images up to resumable_threshold bytes are sent as
+        a single multipart request; larger ones use a resumable upload.
+
+        With image_folder set, the image is placed in that shared folder
+        and inherits its link sharing, so it needs no permission of its own.
         
         Args:
-            image_path: Path to the image file
+            image_data: PNG or JPEG bytes of the image
             drive_service: Google Drive API service instance
+            name: File name for the image in Drive
+            batch: Optional Drive BatchQueue; the image's permission is
+                queued there instead of being created right away
             
         Returns:
             The Drive file ID
         """
+        key = None
+        if self.upload_manifest is not None:
+            key = UploadManifest.make_key(image_data)
+            file_id = self.upload_manifest.get(key)
+            if file_id is not None:
+                if self._drive_file_exists(file_id, drive_service):
+                    return file_id
+                print(f"Uploaded image {file_id} is no longer in Drive; uploading it again")
+                self.upload_manifest.invalidate(key)
+
         file_metadata = {
-            'name': os.path.basename(image_path),
-            'mimeType': 'image/png'
+            'name': name,
+            'mimeType': image_mimetype(image_data)
         }
+        folder_id = self._get_image_folder(drive_service) if self.image_folder else None
+        if folder_id:
+            file_metadata['parents'] = [folder_id]
         
-        with open(image_path, 'rb') as f:
-            media = MediaIoBaseUpload(
-                io.BytesIO(f.read()),
-                mimetype='image/png',
-                resumable=True
-            )
+        resumable = len(image_data) > self.resumable_threshold
+        media = MediaIoBaseUpload(
+            io.BytesIO(image_data),
+            mimetype=image_mimetype(image_data),
+            resumable=resumable
+        )
         
+        start = time.perf_counter()
         file = drive_service.files().create(
             body=file_metadata,
             media_body=media,
             fields='id'
         ).execute()
+        if resumable:
+            # One request opens the session, then one request per chunk
+            request_count = 1 + -(-len(image_data) // media.chunksize())
+            self.upload_stats.record_upload('resumable', time.perf_counter() - start, request_count)
+        else:
+            self.upload_stats.record_upload('multipart', time.perf_counter() - start, 1)
         
-        # Make the file publicly accessible (optional)
-        drive_service.permissions().create(
-            fileId=file.get('id'),
-            body={'type': 'anyone', 'role': 'reader'}
-        ).execute()
-        
-        return file.get('id')
+        file_id = file.get('id')
+        if folder_id:
+            self._remember_upload(key, file_id)
+        elif batch is not None:
+            # Make the file publicly accessible once the batch is sent
+            def shared(response, error):
+                if error is not None:
+                    # A private image would make the document's batchUpdate fail,
+                    # so share it directly and let a second failure propagate
+                    print(f"Warning: could not share uploaded image {file_id} in a batch ({error}); retrying")
+                    batch.service.permissions().create(
+                        fileId=file_id,
+                        body=PUBLIC_READER
+                    ).execute(num_retries=batch.retries)
+                    self.upload_stats.record_call('permissions.create')
+                self._remember_upload(key, file_id)
+
+            batch.add(
+                'permissions.create',
+                lambda drive: drive.permissions().create(fileId=file_id, body=PUBLIC_READER),
+                shared
+            )
+        else:
+            # Make the file publicly accessible (optional)
+            drive_service.permissions().create(
+                fileId=file_id,
+                body=PUBLIC_READER
+            ).execute()
+            self.upload_stats.record_call('permissions.create')
+            self._remember_upload(key, file_id)
+        return file_id
+
+    def _remember_upload(self, key: Optional[str], file_id: str):
+        """Record a shared, uploaded image in the manifest."""
+        if key is not None:
+            self.upload_manifest.put(key, file_id)
+            self._live_file_ids.add(file_id)
+
+    def _build_docs_service(self):
+        """Build a Docs service."""
+        return build('docs', 'v1', credentials=self.creds)
+
+    def _build_drive_service(self):
+        """Build a Drive service with its own authorized HTTP client."""
+        return build('drive', 'v3', credentials=self.creds)
+
+    def _thread_drive_service(self):
+        """
+        Return the calling thread's Drive service.
+
+        googleapiclient's httplib2 transport is not thread-safe, so each
+        upload worker gets its own service and HTTP connection.
+        """
+        service = getattr(self._thread_local, 'drive_service', None)
+        if service is None:
+            service = self._build_drive_service()
+            self._thread_local.drive_service = service
+        return service
+
+    def upload_images(self, mermaid_images: List[Optional[bytes]]) -> List[Optional[str]]:
+        """
+        Upload rendered diagrams to Drive concurrently.
+
+        Runs up to upload_jobs uploads at a time, each worker with its own
+        Drive client. Identical images are uploaded once, and the images'
+        permissions are created together in batch requests afterwards.
+
+        Args:
+            mermaid_images: Rendered mermaid images, in block index order
+
+        Returns:
+            Drive file IDs in the same order; None where there was no image
+        """
+        file_ids = [None] * len(mermaid_images)
+        indices_by_image = {}  # image bytes -> block indices showing it
+        for index, image in enumerate(mermaid_images):
+            if image:
+                indices_by_image.setdefault(image, []).append(index)
+        if not indices_by_image:
+            return file_ids
+
+        if self._upload_pool is None:
+            self._upload_pool = ThreadPoolExecutor(max_workers=max(1, self.upload_jobs),
+                                                   thread_name_prefix='drive-upload')
+
+        batch = BatchQueue(self._thread_drive_service(), stats=self.upload_stats)
+
+        def upload(image, index):
+            return self.upload_image_to_drive(
+                image, self._thread_drive_service(), f"mermaid_{index}{image_extension(image)}",
+                batch=batch
+            )
+
+        futures = {
+            self._upload_pool.submit(upload, image, indices[0]): indices
+            for image, indices in indices_by_image.items()
+        }
+        try:
+            for future, indices in futures.items():
+                file_id = future.result()
+                for index in indices:
+                    file_ids[index] = file_id
+        except BaseException:
+            # Share whatever was uploaded, even if another upload failed,
+            # without letting a sharing error hide the upload error
+            for future in futures:
+                future.exception()
+            try:
+                batch.flush()
+            except Exception as e:
+                print(f"Warning: could not share uploaded images: {e}")
+            raise
+        batch.flush()
+        return file_ids
+
+    def close(self):
+        """Stop the upload worker threads."""
+        if self._upload_pool is not None:
+            self._upload_pool.shutdown()
+            self._upload_pool = None
+
+    def _get_image_folder(self, drive_service) -> str:
+        """
+        Find or create the shared folder for diagram images.
+
+        The folder carries a single anyone-with-link reader permission
+        that every image inside it inherits. The lookup runs once per
+        process; later calls return the cached folder ID.
+
+        Args:
+            drive_service: Google Drive API service instance
+
+        Returns:
+            The Drive folder ID
+        """
+        with self._image_folder_lock:
+            if self._image_folder_id is not None:
+                return self._image_folder_id
+
+            name = self.image_folder.replace('\\', '\\\\').replace("'", "\\'")
+            found = drive_service.files().list(
+                q=f"name = '{name}' and mimeType = '{FOLDER_MIMETYPE}' and trashed = false",
+                spaces='drive',
+                fields='files(id, name)'
+            ).execute().get('files', [])
+            self.upload_stats.record_call('files.list')
+
+            if found:
+                folder_id = found[0]['id']
+                permissions = drive_service.permissions().list(
+                    fileId=folder_id,
+                    fields='permissions(type, role)'
+                ).execute().get('permissions', [])
+                self.upload_stats.record_call('permissions.list')
+                shared = any(p.get('type') == 'anyone' for p in permissions)
+            else:
+                folder = drive_service.files().create(
+                    body={'name': self.image_folder, 'mimeType': FOLDER_MIMETYPE},
+                    fields='id'
+                ).execute()
+                self.upload_stats.record_call('files.create')
+                folder_id = folder.get('id')
+                shared = False
+                print(f"Created Drive folder '{self.image_folder}' for diagram images")
+
+            if not shared:
+                drive_service.permissions().create(
+                    fileId=folder_id,
+                    body=PUBLIC_READER
+                ).execute()
+                self.upload_stats.record_call('permissions.create')
+
+            self._image_folder_id = folder_id
+            return folder_id
+
+    def _drive_file_exists(self, file_id: str, drive_service) -> bool:
+        """
+        Check that a previously uploaded file is still usable.
+
+        Args:
+            file_id: Drive file ID from the upload manifest
+            drive_service: Google Drive API service instance
+
+        Returns:
+            False if the file was deleted, trashed or cannot be accessed
+        """
+        if file_id in self._live_file_ids:
+            return True
+        self.upload_stats.record_call('files.get')
+        try:
+            file = drive_service.files().get(fileId=file_id, fields='id,trashed').execute()
+        except HttpError as e:
+            if e.resp.status in (403, 404):
+                return False
+            raise
+        if file.get('trashed'):
+            return False
+        self._live_file_ids.add(file_id)
+        return True
     
-    def create_google_doc(self, title: str, blocks: List[Dict], 
-                         mermaid_images: List[str]) -> str:
+    def create_google_doc(self, title: str, blocks: Iterable[Block],
+                         mermaid_images: List[Optional[bytes]],
+                         doc_id: Optional[str] = None,
+                         source_hash: Optional[str] = None) -> str:
         """
         Create a Google Doc with the parsed content.
+
+        With stream set, blocks are taken from the iterable a chunk at a
+        time, and each chunk's requests are sent before the next chunk is
+        read, so a generator of blocks is never held in memory at once.
+        Otherwise, with a parse cache and source_hash, the requests are
+        cached and reused while the markdown and diagram images stay the same.
         
         Args:
             title: Document title
             blocks: Content blocks from parsing
-            mermaid_images: Paths to rendered mermaid images
+            mermaid_images: Rendered mermaid images as PNG or JPEG bytes
+            doc_id: Optional ID of an empty document created beforehand
+            source_hash: ParseCache.source_hash() of the markdown
             
         Returns:
             The document ID
         """
         # Build services
-        docs_service = build('docs', 'v1', credentials=self.creds)
-        drive_service = build('drive', 'v3', credentials=self.creds)
-        
-        # Create a new document
-        doc = docs_service.documents().create(
-            body={'title': title}
-        ).execute()
+        docs_service = self._build_docs_service()
+
+        # Upload all diagrams before building requests, in parallel
+        image_ids = self.upload_images(mermaid_images)
         
-        doc_id = doc.get('documentId')
-        print(f"Created document with ID: {doc_id}")
+        if doc_id is None:
+            # Create a new document
+            doc = docs_service.documents().create(
+                body={'title': title}
+            ).execute()
+            
+            doc_id = doc.get('documentId')
+            print(f"Created document with ID: {doc_id}")
         
-        # Build requests for updating the document
-        # First pass: insert all content
-        # Second pass: apply formatting with correct indices
-        insert_requests = []
-        format_requests = []
+        chunks = self._stream_chunks(blocks) if self.stream else [blocks]
         current_index = 1
-
-        for block in blocks:
-            if block['type'] == 'markdown':
-                # Parse markdown with formatting
-                text = self._parse_markdown_with_formatting(
-                    block['content'],
-                    current_index,
-                    format_requests
+        request_count = calls = 0
+        tables = []
+        for chunk in chunks:
+            if self.stream:
+                # Each chunk goes in at the end of what the previous ones added
+                requests, current_index, chunk_tables = self._build_document_requests(
+                    chunk, image_ids, current_index
+                )
+            else:
+                requests, current_index, chunk_tables = self._planned_document_requests(
+                    chunk, image_ids, source_hash
                 )
-                insert_requests.append({
+            calls += self.request_scheduler.send(docs_service, doc_id, requests)
+            request_count += len(requests)
+            if self.verify_table_indices:
+                tables.extend(chunk_tables)
+        if calls > 1:
+            print(f"Sent {request_count} requests in {calls} batchUpdate calls")
+
+        if self.verify_table_indices and tables:
+            self._verify_tables(docs_service, doc_id, tables)
+        
+        return doc_id
+    
+    def _build_document_requests(self, blocks: Iterable[Block], image_ids: List[Optional[str]],
+                                 start_index: int = 1) -> Tuple[List[Dict], int, List[Tuple[int, List[List[str]]]]]:
+        """
+        Build the requests that add content blocks to a document.
+
+        The blocks go in at start_index, which must be the end of the
+        document's content (index 1 for a new document). Consecutive text
+        from markdown blocks, code blocks and image spacing is inserted
+        with a single insertText; only images and tables split it.
+
+        Args:
+            blocks: Content blocks from parsing
+            image_ids: Drive file IDs of the rendered diagrams, by mermaid index
+            start_index: Index the content is inserted at
+
+        Returns:
+            Tuple of (requests, index after the inserted content, (insert
+            index, table data) of each table)
+        """
+        # Everything is laid out at its final index (current_index) first;
+        # the inserts are then moved to start_index and emitted back to
+        # front (see below), while the formatting keeps the final indices
+        format_requests = []
+        segments = []  # (final start index, inserts) per text run, image or table
+        pending_text = []  # Text laid out since the last image or table
+        tables = []  # (insert index, table data) for verify_table_indices
+        current_index = start_index
+
+        def flush_text():
+            if pending_text:
+                text = ''.join(pending_text)
+                start = current_index - len(text)
+                segments.append((start, [{
                     'insertText': {
-                        'location': {'index': current_index},
+                        'location': {'index': start},
                         'text': text
                     }
-                })
+                }]))
+                pending_text.clear()
+
+        for block in blocks:
+            if isinstance(block, TextBlock):
+                # Lay out headings, lists and paragraphs with their formatting
+                text = self._lay_out_text(block, current_index, format_requests)
+                pending_text.append(text)
                 current_index += len(text)
 
-            elif block['type'] == 'code':
+            elif isinstance(block, CodeBlock):
                 # Insert code block with professional formatting
-                code_text = f"\n{block['content']}\n"
+                code_text = f"\n{block.content}\n"
 
                 # Record the start position for this code block
                 code_start = current_index
                 code_end = current_index + len(code_text)
-
-                insert_requests.append({
-                    'insertText': {
-                        'location': {'index': current_index},
-                        'text': code_text
-                    }
-                })
+                pending_text.append(code_text)
 
                 # Build border style
                 border_style = {
@@ -428,273 +696,290 @@ class MarkdownToGoogleDocs:
 
                 current_index += len(code_text)
 
-            elif block['type'] == 'table':
-                # Insert table - we'll populate it after all inserts are done
-                table_data = self._parse_table(block['content'])
+            elif isinstance(block, TableBlock):
+                # Insert and fill the table in place; its cell indices are computed locally
+                table_data = [[clean_cell(cell) for cell in row] for row in block.rows]
                 if table_data:
-                    # Store table info for insertion and population later
-                    format_requests.append({
-                        'table_data': table_data,
-                        'insert_index': current_index,
-                        'is_table': True
-                    })
-
-                    # Reserve space - tables are complex, we'll handle sizing after creation
-                    # Just move index forward to account for table
-                    current_index += 1  # Placeholder, actual size calculated after insert
-
-            elif block['type'] == 'mermaid':
-                # Insert mermaid diagram image
-                image_path = mermaid_images[block['index']]
-                if os.path.exists(image_path):
-                    # Upload image to Drive
-                    image_id = self.upload_image_to_drive(image_path, drive_service)
+                    table_inserts, table_formats, table_size = self._build_table_requests(
+                        table_data, current_index
+                    )
+                    flush_text()
+                    segments.append((current_index, table_inserts))
+                    format_requests.extend(table_formats)
+                    tables.append((current_index, table_data))
+                    current_index += table_size
 
+            elif isinstance(block, MermaidBlock):
+                # Insert mermaid diagram image
+                image_id = image_ids[block.index]
+                if image_id:
                     # Insert image into document
-                    insert_requests.append({
+                    flush_text()
+                    segments.append((current_index, [{
                         'insertInlineImage': {
                             'location': {'index': current_index},
                             'uri': f"https://drive.google.com/uc?id={image_id}",
                             'objectSize': {
-                                'height': {'magnitude': 300, 'unit': 'PT'},
-                                'width': {'magnitude': 400, 'unit': 'PT'}
+                                'height': {'magnitude': IMAGE_SIZE_PT[1], 'unit': 'PT'},
+                                'width': {'magnitude': IMAGE_SIZE_PT[0], 'unit': 'PT'}
                             }
                         }
-                    })
+                    }]))
                     current_index += 1
 
                     # Add spacing after image
-                    insert_requests.append({
-                        'insertText': {
-                            'location': {'index': current_index},
-                            'text': '\n\n'
-                        }
-                    })
+                    pending_text.append('\n\n')
                     current_index += 2
 
-        # Execute requests in batches:
-        # Separate table requests from regular requests
-        table_requests = [r for r in format_requests if r.get('is_table')]
-        text_format_requests = [r for r in format_requests if not r.get('is_table')]
-
-        # Batch 1: Insert all non-table content first
-        if insert_requests:
-            docs_service.documents().batchUpdate(
-                documentId=doc_id,
-                body={'requests': insert_requests}
-            ).execute()
+        flush_text()
+
+        # Merge overlapping and repeated text styles
+        style_count = sum('updateTextStyle' in request for request in format_requests)
+        format_requests = coalesce_text_styles(format_requests)
+        merged_count = sum('updateTextStyle' in request for request in format_requests)
+        if merged_count < style_count:
+            print(f"Merged {style_count} text style requests into {merged_count}")
+
+        # Assemble back to front: the last segment is inserted first and
+        # every earlier one goes in at start_index, ahead of it. An insert
+        # then never moves an index a later insert relies on, whatever the
+        # mix of text, images and tables. Formatting comes after all inserts, so inserted
+        # text never inherits a neighbouring block's style, and uses the
+        # final indices.
+        requests = []
+        for segment_start, inserts in reversed(segments):
+            requests.extend(shift_indices(request, start_index - segment_start) for request in inserts)
+        if start_index > 1 and current_index > start_index:
+            # Text inserted after existing content takes on the style of the
+            # text before it; clear that before applying the chunk's own styles
+            requests.append({
+                'updateTextStyle': {
+                    'range': {'startIndex': start_index, 'endIndex': current_index},
+                    'textStyle': {},
+                    'fields': PLAIN_TEXT_FIELDS
+                }
+            })
+        requests.extend(format_requests)
 
-        # Batch 2: Apply text formatting
-        if text_format_requests:
-            docs_service.documents().batchUpdate(
-                documentId=doc_id,
-                body={'requests': text_format_requests}
-            ).execute()
+        return requests, current_index, tables
 
-        # Batch 3: Insert and populate tables one at a time
-        for table_info in table_requests:
-            self._insert_and_populate_table(docs_service, doc_id, table_info['table_data'], table_info['insert_index'])
-        
-        return doc_id
-    
-    def _parse_table(self, table_text: str) -> List[List[str]]:
+    def _planned_document_requests(self, blocks: Iterable[Block], image_ids: List[Optional[str]],
+                                   source_hash: Optional[str]) -> Tuple[List[Dict], int, List[Tuple[int, List[List[str]]]]]:
         """
-        Parse a markdown table into a 2D array.
+        Build the requests for a whole document, or load them from the parse cache.
 
         Args:
-            table_text: Markdown table text
+            blocks: Content blocks from parsing
+            image_ids: Drive file IDs of the rendered diagrams, by mermaid index
+            source_hash: ParseCache.source_hash() of the markdown, None to skip the cache
 
         Returns:
-            2D list of cell values
+            Same as _build_document_requests()
         """
-        lines = [line.strip() for line in table_text.strip().split('\n') if line.strip()]
+        if self.parse_cache is None or source_hash is None:
+            return self._build_document_requests(blocks, image_ids)
+
+        key = ParseCache.make_output_key('docs', code_version(sys.modules[__name__]), source_hash, image_ids)
+        plan = self.parse_cache.get_value(key)
+        if plan is None:
+            plan = self._build_document_requests(blocks, image_ids)
+            self.parse_cache.put_value(key, plan)
+        return plan
+
+    @staticmethod
+    def _stream_chunks(blocks: Iterable[Block]) -> Iterator[List[Block]]:
+        """Group blocks into chunks of about STREAM_CHUNK_LINES lines."""
+        chunk = []
+        lines = 0
+        for block in blocks:
+            chunk.append(block)
+            if isinstance(block, TextBlock):
+                lines += len(block.lines)
+            elif isinstance(block, TableBlock):
+                lines += len(block.rows)
+            elif isinstance(block, CodeBlock):
+                lines += block.content.count('\n') + 1
+            else:
+                lines += 1
+            if lines >= STREAM_CHUNK_LINES:
+                yield chunk
+                chunk = []
+                lines = 0
+        if chunk:
+            yield chunk
+
+    def _build_table_requests(self, table_data: List[List[str]],
+                              insert_index: int) -> Tuple[List[Dict], List[Dict], int]:
+        """
+        Build the requests that insert, fill and style a table.
 
-        if len(lines) < 2:
-            return []
+        Cell positions follow from the table layout, so no documents().get
+        is needed: insertTable adds a newline at insert_index and the
+        table after it, and every row and cell start takes one index, as
+        does the empty paragraph in each cell (see table_cell_index()).
 
-        # Parse header and clean markdown formatting
-        header_cells = [cell.strip() for cell in lines[0].split('|') if cell.strip()]
-        clean_header = []
-        for cell in header_cells:
-            cell = re.sub(r'\*\*(.+?)\*\*', r'\1', cell)  # Remove bold
-            cell = re.sub(r'`(.+?)`', r'\1', cell)  # Remove code
-            clean_header.append(cell)
+        Args:
+            table_data: 2D array of cell values, header row first
+            insert_index: Index where the table should be inserted
+
+        Returns:
+            Tuple of (insert requests, format requests, number of indices
+            the filled table adds to the document). Format requests use
+            the indices after all insert requests have been applied.
+        """
+        rows = len(table_data)
+        columns = len(table_data[0])
+        table_start = insert_index + 1
+        print(f"Inserting table with {rows} rows and {columns} columns at index {insert_index}")
 
-        # Skip separator line (line 1)
+        insert_requests = [{
+            'insertTable': {
+                'rows': rows,
+                'columns': columns,
+                'location': {'index': insert_index}
+            }
+        }]
+
+        cells = [
+            (row_idx, col_idx, cell_value)
+            for row_idx, row_data in enumerate(table_data)
+            for col_idx, cell_value in enumerate(row_data[:columns])
+            if cell_value
+        ]
+
+        # Fill cells from last to first so each insert leaves the
+        # computed indices of the cells before it unchanged
+        for row_idx, col_idx, cell_value in reversed(cells):
+            insert_requests.append({
+                'insertText': {
+                    'location': {'index': table_cell_index(table_start, columns, row_idx, col_idx)},
+                    'text': cell_value
+                }
+            })
+
+        # Format header row (bold + background); once filled, each cell has
+        # moved by the length of the text in the cells before it
+        format_requests = []
+        shift = 0
+        for row_idx, col_idx, cell_value in cells:
+            if row_idx == 0:
+                cell_start = table_cell_index(table_start, columns, row_idx, col_idx) + shift
+                format_requests.append({
+                    'updateTextStyle': {
+                        'range': {
+                            'startIndex': cell_start,
+                            'endIndex': cell_start + len(cell_value)
+                        },
+                        'textStyle': {
+                            'bold': True
+                        },
+                        'fields': 'bold'
+                    }
+                })
+            shift += len(cell_value)
 
-        # Parse data rows
-        data_rows = [clean_header]  # Include cleaned header as first row
-        for line in lines[2:]:
-            cells = [cell.strip() for cell in line.split('|') if cell.strip()]
-            if cells:
-                # Clean markdown formatting
-                clean_cells = []
-                for cell in cells:
-                    cell = re.sub(r'\*\*(.+?)\*\*', r'\1', cell)  # Remove bold
-                    cell = re.sub(r'`(.+?)`', r'\1', cell)  # Remove code
-                    clean_cells.append(cell)
-                data_rows.append(clean_cells)
+        for col_idx in range(columns):
+            format_requests.append({
+                'updateTableCellStyle': {
+                    'tableCellLocation': {
+                        'tableStartLocation': {'index': table_start},
+                        'rowIndex': 0,
+                        'columnIndex': col_idx
+                    },
+                    'tableCellStyle': {
+                        'backgroundColor': {
+                            'color': {
+                                'rgbColor': {
+                                    'red': 0.85,
+                                    'green': 0.89,
+                                    'blue': 0.95
+                                }
+                            }
+                        }
+                    },
+                    'fields': 'backgroundColor'
+                }
+            })
 
-        return data_rows
+        # The newline before the table, the empty table, then the cell text
+        table_size = 1 + table_length(rows, columns) + shift
+        return insert_requests, format_requests, table_size
 
-    def _insert_and_populate_table(self, docs_service, doc_id: str, table_data: List[List[str]], insert_index: int):
+    def _verify_tables(self, docs_service, doc_id: str, tables: List[Tuple[int, List[List[str]]]]) -> int:
         """
-        Insert a table and populate it with data and formatting.
+        Compare computed table positions with the created document.
+
+        Debugging aid for --verify-table-indices; costs one documents().get.
 
         Args:
             docs_service: Google Docs API service
             doc_id: Document ID
-            table_data: 2D array of cell values
-            insert_index: Index where table should be inserted
-        """
-        print(f"Inserting table with {len(table_data)} rows and {len(table_data[0])} columns at index {insert_index}")
+            tables: (insert index, table data) of every inserted table, in
+                document order, with indices as computed before insertion
 
-        # Step 1: Insert the table
-        insert_request = {
-            'insertTable': {
-                'rows': len(table_data),
-                'columns': len(table_data[0]) if table_data else 0,
-                'location': {'index': insert_index}
-            }
-        }
-
-        docs_service.documents().batchUpdate(
-            documentId=doc_id,
-            body={'requests': [insert_request]}
-        ).execute()
-
-        # Step 2: Get the document to find the newly created table
+        Returns:
+            Number of mismatches found
+        """
         doc = docs_service.documents().get(documentId=doc_id).execute()
+        found = {
+            element['startIndex']: element['table']
+            for element in doc.get('body', {}).get('content', [])
+            if 'table' in element
+        }
 
-        # Find the table we just inserted - look for ANY table since there might only be one
-        table = None
-        table_start_index = None
-        all_tables = []
-        for element in doc.get('body', {}).get('content', []):
-            if 'table' in element:
-                elem_start = element.get('startIndex')
-                all_tables.append(elem_start)
-                # Find table at or near our insert index (expanded search range)
-                if elem_start >= insert_index - 5 and elem_start <= insert_index + 50:
-                    table = element['table']
-                    table_start_index = elem_start
-                    print(f"Found table at index {elem_start}")
-                    break
-
-        if not table:
-            print(f"ERROR: Could not find table near index {insert_index}. All tables at: {all_tables}")
-            return
-
-        print(f"Table has {len(table['tableRows'])} rows")
-
-        # Step 3: Populate cells and format
-        requests = []
-        for row_idx, row_data in enumerate(table_data):
-            print(f"Processing row {row_idx} with {len(row_data)} cells")
-            if row_idx < len(table['tableRows']):
-                table_row = table['tableRows'][row_idx]
-                for col_idx, cell_value in enumerate(row_data):
-                    if col_idx < len(table_row['tableCells']):
-                        cell = table_row['tableCells'][col_idx]
-                        cell_start = cell['startIndex']
-                        cell_end = cell.get('endIndex')
-
-                        print(f"Cell [{row_idx},{col_idx}] starts at {cell_start}, ends at {cell_end}, value: {cell_value[:20]}")
-
-                        # Insert text into cell
-                        requests.append({
-                            'insertText': {
-                                'location': {'index': cell_start},
-                                'text': cell_value
-                            }
-                        })
-
-                        # Format header row (bold + background)
-                        if row_idx == 0:
-                            requests.append({
-                                'updateTextStyle': {
-                                    'range': {
-                                        'startIndex': cell_start,
-                                        'endIndex': cell_start + len(cell_value)
-                                    },
-                                    'textStyle': {
-                                        'bold': True
-                                    },
-                                    'fields': 'bold'
-                                }
-                            })
-
-                            requests.append({
-                                'updateTableCellStyle': {
-                                    'tableCellLocation': {
-                                        'tableStartLocation': {'index': table_start_index},
-                                        'rowIndex': row_idx,
-                                        'columnIndex': col_idx
-                                    },
-                                    'tableCellStyle': {
-                                        'backgroundColor': {
-                                            'color': {
-                                                'rgbColor': {
-                                                    'red': 0.85,
-                                                    'green': 0.89,
-                                                    'blue': 0.95
-                                                }
-                                            }
-                                        }
-                                    },
-                                    'fields': 'backgroundColor'
-                                }
-                            })
-
-        # Execute all table population requests
-        print(f"Executing {len(requests)} table population requests")
-        if requests:
-            try:
-                docs_service.documents().batchUpdate(
-                    documentId=doc_id,
-                    body={'requests': requests}
-                ).execute()
-                print("Table populated successfully")
-            except Exception as e:
-                print(f"ERROR populating table: {e}")
-
-    def _parse_markdown_with_formatting(self, markdown_text: str, start_index: int, format_requests: list):
+        mismatches = 0
+        for insert_index, table_data in tables:
+            table_start = insert_index + 1
+            table = found.get(table_start)
+            if table is None:
+                print(f"Table check: no table at index {table_start}; tables at {sorted(found)}")
+                mismatches += 1
+                continue
+            columns = len(table_data[0])
+            shift = 0
+            for row_idx, row_data in enumerate(table_data):
+                for col_idx, cell_value in enumerate(row_data[:columns]):
+                    expected = table_cell_index(table_start, columns, row_idx, col_idx) + shift
+                    cell = table['tableRows'][row_idx]['tableCells'][col_idx]
+                    paragraph = cell['content'][0]
+                    text = ''.join(
+                        element.get('textRun', {}).get('content', '')
+                        for element in paragraph['paragraph']['elements']
+                    ).rstrip('\n')
+                    if paragraph['startIndex'] != expected or text != cell_value:
+                        print(f"Table check: cell [{row_idx},{col_idx}] expected {cell_value[:20]!r} "
+                              f"at {expected}, document has {text[:20]!r} at {paragraph['startIndex']}")
+                        mismatches += 1
+                    shift += len(cell_value)
+
+        if not mismatches:
+            print(f"Table check: {len(tables)} table(s) match the computed indices")
+        return mismatches
+
+    def _lay_out_text(self, block: TextBlock, start_index: int, format_requests: list) -> str:
         """
-        Parse markdown and generate formatting requests for Google Docs.
+        Lay out a text block and generate its formatting requests.
 
         Args:
-            markdown_text: Markdown content to parse
+            block: Parsed text block
             start_index: Starting index in the document
             format_requests: List to append formatting requests to
 
         Returns:
-            Plain text version with formatting tracked
+            Plain text of the block, one paragraph per line
         """
-        result_text = ""
+        pieces = []
         current_pos = start_index
 
-        lines = markdown_text.split('\n')
-
-        for line in lines:
-            line_start = current_pos
-
-            # Handle headers (# through ######)
-            header_match = re.match(r'^(#{1,6})\s+(.+)$', line)
-            if header_match:
-                level = len(header_match.group(1))
-                text = header_match.group(2)
-
-                # Remove markdown symbols from text
-                clean_text = self._remove_inline_markdown(text)
-                result_text += clean_text + '\n'
-
+        for line in block.lines:
+            if line.kind == HEADING:
                 # Apply header formatting
-                font_size = max(24 - (level * 2), 12)  # H1=24pt, H2=22pt, etc.
+                font_size = max(24 - (line.level * 2), 12)  # H1=24pt, H2=22pt, etc.
                 format_requests.append({
                     'updateTextStyle': {
                         'range': {
-                            'startIndex': line_start,
-                            'endIndex': line_start + len(clean_text)
+                            'startIndex': current_pos,
+                            'endIndex': current_pos + len(line.text)
                         },
                         'textStyle': {
                             'fontSize': {
@@ -706,123 +991,57 @@ class MarkdownToGoogleDocs:
                         'fields': 'fontSize,bold'
                     }
                 })
-
-                # Add inline formatting (bold, italic) within headers
-                self._apply_inline_formatting(text, line_start, format_requests)
-
-                current_pos += len(clean_text) + 1
-                continue
-
-            # Handle list items
-            list_match = re.match(r'^(\s*)[\*\-]\s+(.+)$', line)
-            if list_match:
-                indent = list_match.group(1)
-                text = list_match.group(2)
-                clean_text = self._remove_inline_markdown(text)
-
+                prefix = ''
+            elif line.kind == BULLET:
                 # Add bullet with proper indentation
-                indent_spaces = '  ' * (len(indent) // 2)
-                formatted_line = f"{indent_spaces}• {clean_text}\n"
-                result_text += formatted_line
-
-                # Apply inline formatting
-                self._apply_inline_formatting(text, line_start + len(indent_spaces) + 2, format_requests)
-
-                current_pos += len(formatted_line)
-                continue
-
-            # Handle numbered lists
-            num_list_match = re.match(r'^(\s*)(\d+)\.\s+(.+)$', line)
-            if num_list_match:
-                indent = num_list_match.group(1)
-                num = num_list_match.group(2)
-                text = num_list_match.group(3)
-                clean_text = self._remove_inline_markdown(text)
-
-                indent_spaces = '  ' * (len(indent) // 2)
-                formatted_line = f"{indent_spaces}{num}. {clean_text}\n"
-                result_text += formatted_line
-
-                self._apply_inline_formatting(text, line_start + len(indent_spaces) + len(num) + 2, format_requests)
-
-                current_pos += len(formatted_line)
-                continue
-
-            # Regular line - apply inline formatting
-            if line.strip():
-                clean_text = self._remove_inline_markdown(line)
-                result_text += clean_text + '\n'
-                self._apply_inline_formatting(line, line_start, format_requests)
-                current_pos += len(clean_text) + 1
+                prefix = '  ' * (line.level // 2) + '• '
+            elif line.kind == NUMBERED:
+                prefix = '  ' * (line.level // 2) + f"{line.number}. "
             else:
-                result_text += '\n'
-                current_pos += 1
-
-        return result_text
+                prefix = ''
 
-    def _remove_inline_markdown(self, text: str) -> str:
-        """Remove markdown syntax from text while preserving content."""
-        # Remove bold
-        text = re.sub(r'\*\*(.+?)\*\*', r'\1', text)
-        text = re.sub(r'__(.+?)__', r'\1', text)
+            # Add inline formatting (bold, italic, code, links)
+            self._add_inline_styles(line.spans, current_pos + len(prefix), format_requests)
 
-        # Remove italic
-        text = re.sub(r'\*(.+?)\*', r'\1', text)
-        text = re.sub(r'_(.+?)_', r'\1', text)
+            formatted_line = f"{prefix}{line.text}\n"
+            pieces.append(formatted_line)
+            current_pos += len(formatted_line)
 
-        # Convert links
-        text = re.sub(r'\[(.+?)\]\((.+?)\)', r'\1', text)
+        return ''.join(pieces)
 
-        return text
-
-    def _apply_inline_formatting(self, text: str, start_pos: int, format_requests: list):
-        """Apply bold and italic formatting within a line of text."""
-        # Find bold text (**text** or __text__)
-        for match in re.finditer(r'\*\*(.+?)\*\*|__(.+?)__', text):
-            bold_text = match.group(1) or match.group(2)
-            # Calculate position in cleaned text
-            prefix = self._remove_inline_markdown(text[:match.start()])
-            pos = start_pos + len(prefix)
+    def _add_inline_styles(self, spans: List[InlineSpan], start_pos: int, format_requests: list):
+        """
+        Add text style requests for the inline spans of a line.
 
+        Args:
+            spans: Spans from parse_inline(), relative to the cleaned line
+            start_pos: Document index of the start of the cleaned line
+            format_requests: List to append formatting requests to
+        """
+        for span in spans:
+            text_style, fields = INLINE_TEXT_STYLES[span.style]
+            if span.style == LINK:
+                text_style = {'link': {'url': span.url}}
             format_requests.append({
                 'updateTextStyle': {
                     'range': {
-                        'startIndex': pos,
-                        'endIndex': pos + len(bold_text)
-                    },
-                    'textStyle': {
-                        'bold': True
+                        'startIndex': start_pos + span.start,
+                        'endIndex': start_pos + span.end
                     },
-                    'fields': 'bold'
+                    'textStyle': text_style,
+                    'fields': fields
                 }
             })
 
-        # Find italic text (*text* or _text_) - but not bold
-        for match in re.finditer(r'(?<!\*)\*([^\*]+?)\*(?!\*)|(?<!_)_([^_]+?)_(?!_)', text):
-            italic_text = match.group(1) or match.group(2)
-            prefix = self._remove_inline_markdown(text[:match.start()])
-            pos = start_pos + len(prefix)
-
-            format_requests.append({
-                'updateTextStyle': {
-                    'range': {
-                        'startIndex': pos,
-                        'endIndex': pos + len(italic_text)
-                    },
-                    'textStyle': {
-                        'italic': True
-                    },
-                    'fields': 'italic'
-                }
-            })
-    
-    def convert(self, markdown_file: str, doc_title: Optional[str] = None) -> str:
+    def convert(self, markdown_file: str, doc_title: Optional[str] = None,
+                doc_id: Optional[str] = None) -> str:
         """
         Convert a markdown file to Google Docs.
 
         Args:
             markdown_file: Path to the markdown file
             doc_title: Optional title for the Google Doc
+            doc_id: Optional ID of an empty document to fill instead of creating one
 
         Returns:
             The Google Doc ID
@@ -830,28 +1049,34 @@ class MarkdownToGoogleDocs:
         # Authenticate
         self.authenticate()
 
-        # Read markdown file
-        with open(markdown_file, 'r', encoding='utf-8') as f:
-            markdown_content = f.read()
+        if not doc_title:
+            doc_title = Path(markdown_file).stem
 
-        # Parse markdown and extract mermaid diagrams
-        blocks, mermaid_codes = self.parse_markdown(markdown_content)
+        if self.stream:
+            # Collect the diagrams in a quick first pass, then parse the file
+            # again as it is sent, never holding all of it in memory
+            mermaid_codes = read_mermaid_codes(markdown_file)
+            mermaid_images = self.mermaid_renderer.render_all(mermaid_codes, source=markdown_file)
+            with open(markdown_file, 'r', encoding='utf-8') as f:
+                doc_id = self.create_google_doc(doc_title, iter_blocks(f, []), mermaid_images, doc_id)
+        else:
+            # Read markdown file
+            with open(markdown_file, 'r', encoding='utf-8') as f:
+                markdown_content = f.read()
+
+            # Parse markdown and extract mermaid diagrams, unless the
+            # parse cache has the blocks of the same text
+            source_hash = None
+            if self.parse_cache is not None:
+                blocks, mermaid_codes, source_hash = self.parse_cache.parse(markdown_content)
+            else:
+                blocks, mermaid_codes = self.parse_markdown(markdown_content)
 
-        # Render mermaid diagrams
-        mermaid_images = []
-        with tempfile.TemporaryDirectory() as temp_dir:
-            for i, mermaid_code in enumerate(mermaid_codes):
-                image_path = os.path.join(temp_dir, f'mermaid_{i}.png')
-                if self.mermaid_renderer.render_to_image(mermaid_code, image_path):
-                    mermaid_images.append(image_path)
-                else:
-                    mermaid_images.append('')
+            # Render mermaid diagrams
+            mermaid_images = self.mermaid_renderer.render_all(mermaid_codes, source=markdown_file)
 
             # Create Google Doc
-            if not doc_title:
-                doc_title = Path(markdown_file).stem
-
-            doc_id = self.create_google_doc(doc_title, blocks, mermaid_images)
+            doc_id = self.create_google_doc(doc_title, blocks, mermaid_images, doc_id, source_hash)
 
         # Generate URL
         doc_url = f"https://docs.google.com/document/d/{doc_id}/edit"
@@ -860,6 +1085,53 @@ class MarkdownToGoogleDocs:
 
         return doc_id
 
+    def _prerender_diagrams(self, md_files: List[Path]):
+        """
+        Render the mermaid diagrams of several markdown files in one pass.
+
+        Args:
+            md_files: Markdown files whose diagrams should be rendered
+        """
+        mermaid_codes = []
+        for md_file in md_files:
+            try:
+                file_codes = read_mermaid_codes(str(md_file))
+            except (OSError, UnicodeDecodeError):
+                continue  # Reported when the file itself is converted
+            mermaid_codes.extend(file_codes)
+        self.mermaid_renderer.prerender(mermaid_codes)
+
+    def _create_documents(self, titles: List[str]) -> List[Optional[str]]:
+        """
+        Create empty documents in batch requests.
+
+        Args:
+            titles: Document titles
+
+        Returns:
+            Document IDs in the same order; None where creation failed, in
+            which case convert() creates the document itself
+        """
+        doc_ids = [None] * len(titles)
+        batch = BatchQueue(self._build_docs_service(), stats=self.upload_stats)
+
+        def created(index):
+            def callback(response, error):
+                if error is not None:
+                    print(f"Warning: could not create document '{titles[index]}': {error}")
+                else:
+                    doc_ids[index] = response.get('documentId')
+            return callback
+
+        for index, title in enumerate(titles):
+            batch.add(
+                'documents.create',
+                lambda docs, title=title: docs.documents().create(body={'title': title}),
+                created(index)
+            )
+        batch.flush()
+        return doc_ids
+
     def convert_directory(self, directory: str) -> List[str]:
         """
         Convert all markdown files in a directory to Google Docs.
@@ -887,18 +1159,36 @@ class MarkdownToGoogleDocs:
 
         print(f"Found {len(md_files)} markdown file(s) in '{directory}'")
 
+        # Render every diagram of the run up front so the CLI backend can
+        # batch across files; each convert() below then hits the cache
+        self._prerender_diagrams(md_files)
+
+        # Create all documents in batch requests, titled with the filename
+        # without .md extension; the document of a file that fails to
+        # convert is deleted again at the end
+        created_ids = self._create_documents([md_file.stem for md_file in md_files])
+        orphans = BatchQueue(self._thread_drive_service(), stats=self.upload_stats)
+
         doc_ids = []
-        for md_file in md_files:
+        for md_file, created_id in zip(md_files, created_ids):
             try:
                 print(f"\nProcessing: {md_file.name}")
-                # Use filename without .md extension as the document title
-                doc_title = md_file.stem
-                doc_id = self.convert(str(md_file), doc_title)
+                doc_id = self.convert(str(md_file), md_file.stem, created_id)
                 doc_ids.append(doc_id)
             except Exception as e:
                 print(f"Error processing {md_file.name}: {e}")
+                if created_id is not None:
+                    orphans.add(
+                        'files.delete',
+                        lambda drive, file_id=created_id: drive.files().delete(fileId=file_id)
+                    )
                 continue
 
+        if len(orphans):
+            count = len(orphans)
+            failed = orphans.flush()
+            print(f"Deleted {count - failed} document(s) of files that failed to convert")
+
         print(f"\n{'='*60}")
         print(f"Completed: {len(doc_ids)} of {len(md_files)} files converted successfully")
 
@@ -924,10 +1214,61 @@ def main():
         help='Path to Google API credentials file (default: credentials.json)'
     )
     parser.add_argument(
-        '--use-cli',
+        '--upload-manifest',
+        default=DEFAULT_MANIFEST_PATH,
+        metavar='PATH',
+        help=f'File recording uploaded diagram images so they are reused across runs (default: {DEFAULT_MANIFEST_PATH})'
+    )
+    parser.add_argument(
+        '--no-upload-manifest',
         action='store_true',
-        help='Use local mermaid CLI instead of API for rendering'
+        help='Upload every diagram image again instead of reusing earlier uploads'
     )
+    parser.add_argument(
+        '--image-folder',
+        metavar='NAME',
+        help='Upload diagram images into this Drive folder (created if needed), shared once by link instead of sharing every image'
+    )
+    parser.add_argument(
+        '--verify-table-indices',
+        action='store_true',
+        help='Debug: fetch each created document and check the locally computed table cell indices'
+    )
+    parser.add_argument(
+        '--upload-jobs',
+        type=int,
+        default=DEFAULT_UPLOAD_JOBS,
+        metavar='N',
+        help=f'Number of diagram images uploaded to Drive concurrently (default: {DEFAULT_UPLOAD_JOBS})'
+    )
+    parser.add_argument(
+        '--resumable-threshold-mb',
+        type=float,
+        default=DEFAULT_RESUMABLE_THRESHOLD_MB,
+        metavar='MB',
+        help=f'Upload images larger than this with a resumable upload, smaller ones in a single request (default: {DEFAULT_RESUMABLE_THRESHOLD_MB})'
+    )
+    parser.add_argument(
+        '--chunk-requests',
+        type=int,
+        default=DEFAULT_CHUNK_REQUESTS,
+        metavar='N',
+        help=f'Maximum Docs requests per batchUpdate call (default: {DEFAULT_CHUNK_REQUESTS})'
+    )
+    parser.add_argument(
+        '--chunk-mb',
+        type=float,
+        default=DEFAULT_CHUNK_MB,
+        metavar='MB',
+        help=f'Maximum size of one batchUpdate call (default: {DEFAULT_CHUNK_MB})'
+    )
+    parser.add_argument(
+        '--stream',
+        action='store_true',
+        help='Parse and send each file a chunk at a time, keeping memory use bounded for very large files'
+    )
+    add_renderer_arguments(parser)
+    add_parse_cache_arguments(parser)
 
     args = parser.parse_args()
 
@@ -939,9 +1280,19 @@ def main():
     # Create converter
     converter = MarkdownToGoogleDocs(credentials_file=args.credentials)
 
-    # Set rendering method
-    if args.use_cli:
-        converter.mermaid_renderer = MermaidRenderer(use_api=False)
+    # Set rendering method and diagram cache
+    converter.mermaid_renderer = renderer_from_args(args, display_size=IMAGE_SIZE_PT)
+    if not args.no_upload_manifest:
+        converter.upload_manifest = UploadManifest(args.upload_manifest)
+    converter.resumable_threshold = int(args.resumable_threshold_mb * 1024 * 1024)
+    converter.image_folder = args.image_folder
+    converter.upload_jobs = args.upload_jobs
+    converter.verify_table_indices = args.verify_table_indices
+    converter.request_scheduler = RequestScheduler(
+        max_requests=args.chunk_requests, max_bytes=int(args.chunk_mb * 1024 * 1024)
+    )
+    converter.stream = args.stream
+    converter.parse_cache = parse_cache_from_args(args)
 
     try:
         # Check if path is a directory or file
@@ -955,6 +1306,18 @@ def main():
     except Exception as e:
         print(f"Error: {e}")
         return 1
+    finally:
+        converter.close()
+        converter.mermaid_renderer.close()
+        print_renderer_stats(converter.mermaid_renderer)
+        if converter.upload_manifest is not None:
+            print(converter.upload_manifest.stats())
+        if converter.parse_cache is not None:
+            print(converter.parse_cache.stats())
+        if converter.upload_stats.calls:
+            print(converter.upload_stats.stats())
+        if converter.request_scheduler.documents:
+            print(converter.request_scheduler.stats())
 
 
 if __name__ == '__main__':
@@ -0,0 +1,128 @@
+#!/usr/bin/env node
+/*
+ * Long-lived mermaid render daemon.
+ *
+ * Keeps one headless Chromium page with mermaid loaded and renders jobs
+ * received as JSON lines over stdin/stdout, or over a unix socket with
+ * --socket PATH. See render_daemon.py for the protocol.
+ *
+ * Requires puppeteer and mermaid, both installed with
+ * `npm install -g @mermaid-js/mermaid-cli` (render_daemon.py adds the
+ * global node_modules directories to NODE_PATH).
+ *
+ * Usage:
+ *   node mermaid_daemon.js [--socket PATH] [--max-renders N] [--max-rss-mb MB]
+ */
+'use strict';
+
+const fs = require('fs');
+const net = require('net');
+const readline = require('readline');
+const puppeteer = require('puppeteer');
+
+function parseArgs(argv) {
+  const args = {socket: null, maxRenders: 500, maxRssMb: 1024};
+  for (let i = 0; i < argv.length; i++) {
+    if (argv[i] === '--socket') args.socket = argv[++i];
+    else if (argv[i] === '--max-renders') args.maxRenders = parseInt(argv[++i], 10);
+    else if (argv[i] === '--max-rss-mb') args.maxRssMb = parseInt(argv[++i], 10);
+  }
+  return args;
+}
+
+const args = parseArgs(process.argv.slice(2));
+let browser = null;
+let page = null;
+let renders = 0;
+let queue = Promise.resolve();
+
+async function startBrowser() {
+  browser = await puppeteer.launch({headless: 'new', args: ['--no-sandbox']});
+  page = await browser.newPage();
+  await page.setViewport({width: 1600, height: 1200});
+  await page.setContent('<!DOCTYPE html><html><body><div id="container"></div></body></html>');
+  await page.addScriptTag({path: require.resolve('mermaid/dist/mermaid.min.js')});
+}
+
+async function memoryUsage() {
+  // Node's own RSS plus the page's JS heap, which is where mermaid grows
+  const metrics = await page.metrics();
+  return process.memoryUsage().rss + (metrics.JSHeapTotalSize || 0);
+}
+
+async function render(request) {
+  const response = {id: request.id};
+  const background = request.background || 'white';
+  try {
+    await page.evaluate(async (code, theme, background, id) => {
+      document.body.style.background = background;
+      mermaid.initialize({startOnLoad: false, theme: theme});
+      const {svg} = await mermaid.render('diagram' + id, code);
+      document.getElementById('container').innerHTML = svg;
+    }, request.code, request.theme || 'default', background, renders);
+    const element = await page.$('#container svg');
+    const png = await element.screenshot({omitBackground: background === 'transparent'});
+    response.ok = true;
+    response.image = Buffer.from(png).toString('base64');
+  } catch (err) {
+    response.ok = false;
+    response.error = String(err && err.message ? err.message : err);
+  }
+
+  renders += 1;
+  response.renders = renders;
+  response.rss = await memoryUsage();
+  response.recycle = renders >= args.maxRenders ||
+    response.rss >= args.maxRssMb * 1024 * 1024;
+  return response;
+}
+
+async function shutdown() {
+  if (browser) await browser.close();
+  process.exit(0);
+}
+
+function handleLines(input, write, onRecycle) {
+  const lines = readline.createInterface({input: input, crlfDelay: Infinity});
+  lines.on('line', (line) => {
+    if (!line.trim()) return;
+    // Jobs from all connections share the page, so run them one at a time
+    queue = queue.then(async () => {
+      const request = JSON.parse(line);
+      const response = request.shutdown
+        ? {id: request.id, ok: true, shutdown: true}
+        : await render(request);
+      const exiting = response.recycle || response.shutdown;
+      if (exiting) onRecycle();
+      write(JSON.stringify(response) + '\n');
+      if (exiting) setImmediate(shutdown);
+    });
+  });
+  return lines;
+}
+
+async function main() {
+  await startBrowser();
+
+  if (!args.socket) {
+    const lines = handleLines(process.stdin, (text) => process.stdout.write(text), () => {});
+    lines.on('close', () => queue.then(shutdown));
+    process.stdout.write(JSON.stringify({ready: true, pid: process.pid}) + '\n');
+    return;
+  }
+
+  if (fs.existsSync(args.socket)) fs.unlinkSync(args.socket);
+  const server = net.createServer((conn) => {
+    handleLines(conn, (text) => conn.write(text), () => {
+      // Stop accepting before answering so clients start a new daemon
+      server.close();
+      if (fs.existsSync(args.socket)) fs.unlinkSync(args.socket);
+    });
+  });
+  server.listen(args.socket);
+}
+
+main().catch((err) => {
+  process.stderr.write(`mermaid daemon failed: ${err && err.stack ? err.stack : err}\n`);
+  process.exit(1);
+});
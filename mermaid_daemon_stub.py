@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Pure-Python stand-in for the mermaid render daemon.
+
+Speaks the same JSON-lines protocol as mermaid_daemon.js (see
+render_daemon.py) but returns a small placeholder PNG instead of running
+a browser, so the protocol and recycling logic can be tested without Node.
+
+Usage:
+    python mermaid_daemon_stub.py [--socket PATH] [--max-renders N] [--max-rss-mb MB]
+"""
+
+import os
+import sys
+import json
+import base64
+import socket
+import struct
+import zlib
+import argparse
+import resource
+
+
+def placeholder_png(width: int = 1, height: int = 1) -> bytes:
+    """Build a white RGB PNG of the given size."""
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return (struct.pack('>I', len(data)) + kind + data +
+                struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+    rows = b''.join(b'\x00' + b'\xff\xff\xff' * width for _ in range(height))
+    return (b'\x89PNG\r\n\x1a\n' +
+            chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) +
+            chunk(b'IDAT', zlib.compress(rows)) +
+            chunk(b'IEND', b''))
+
+
+class StubDaemon:
+    """Handle render requests and decide when to recycle."""
+
+    def __init__(self, max_renders: int, max_rss_mb: int):
+        self.max_renders = max_renders
+        self.max_rss_bytes = max_rss_mb * 1024 * 1024
+        self.renders = 0
+
+    def handle(self, line: str) -> dict:
+        """Process one request line and return the response object."""
+        request = json.loads(line)
+        response = {'id': request.get('id')}
+        if request.get('shutdown'):
+            response['ok'] = True
+            response['shutdown'] = True
+            return response
+
+        code = request.get('code', '')
+        if code.strip():
+            response['ok'] = True
+            response['image'] = base64.b64encode(placeholder_png()).decode('ascii')
+        else:
+            response['ok'] = False
+            response['error'] = 'empty diagram'
+
+        self.renders += 1
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        response['renders'] = self.renders
+        response['rss'] = rss
+        response['recycle'] = (self.renders >= self.max_renders or
+                               rss >= self.max_rss_bytes)
+        return response
+
+
+def _exits_after(response: dict) -> bool:
+    """Whether the daemon stops after sending response."""
+    return bool(response.get('recycle') or response.get('shutdown'))
+
+
+def serve_pipe(daemon: StubDaemon):
+    """Serve requests on stdin/stdout until EOF or recycle."""
+    print(json.dumps({'ready': True, 'pid': os.getpid()}), flush=True)
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        response = daemon.handle(line)
+        print(json.dumps(response), flush=True)
+        if _exits_after(response):
+            return
+
+
+def serve_socket(daemon: StubDaemon, socket_path: str):
+    """Serve requests on a unix socket, one connection at a time, until recycle."""
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen()
+    owns_socket = True
+    try:
+        while True:
+            conn, _ = server.accept()
+            with conn, conn.makefile('r', encoding='utf-8') as reader, \
+                    conn.makefile('w', encoding='utf-8') as writer:
+                for line in reader:
+                    if not line.strip():
+                        continue
+                    response = daemon.handle(line)
+                    if _exits_after(response):
+                        # Stop accepting before answering so clients start a new daemon
+                        server.close()
+                        os.unlink(socket_path)
+                        owns_socket = False
+                    writer.write(json.dumps(response) + '\n')
+                    writer.flush()
+                    if _exits_after(response):
+                        return
+    finally:
+        server.close()
+        if owns_socket and os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+def main():
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description='Stand-in mermaid render daemon')
+    parser.add_argument('--socket', help='Listen on this unix socket instead of stdin/stdout')
+    parser.add_argument('--max-renders', type=int, default=500)
+    parser.add_argument('--max-rss-mb', type=int, default=1024)
+    args = parser.parse_args()
+
+    daemon = StubDaemon(args.max_renders, args.max_rss_mb)
+    if args.socket:
+        serve_socket(daemon, args.socket)
+    else:
+        serve_pipe(daemon)
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for a mermaid.ink-compatible render server.
+
+Answers ``GET /img/<base64 diagram>`` (or the compressed
+``/img/pako:<...>`` form) with a placeholder PNG, and counts
+requests and TCP connections so tests and benchmarks can check
+connection reuse. An optional per-connection delay simulates the
+TCP+TLS handshake cost of a remote server, and error responses such as
+429 with Retry-After can be queued to exercise retry handling.
+
+Usage:
+    python mermaid_ink_stub.py [--port 8080] [--handshake-ms 30]
+"""
+
+import json
+import time
+import zlib
+import base64
+import binascii
+import argparse
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from mermaid_daemon_stub import placeholder_png
+
+
+def decode_diagram(encoded: str) -> str:
+    """Decode a plain or pako-encoded diagram from an /img/ path."""
+    compressed = encoded.startswith('pako:')
+    if compressed:
+        encoded = encoded[len('pako:'):]
+    data = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4))
+    if compressed:
+        return json.loads(zlib.decompress(data).decode('utf-8'))['code']
+    return data.decode('utf-8')
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Serve placeholder images for /img/ requests."""
+
+    protocol_version = 'HTTP/1.1'  # Allow keep-alive connections
+    disable_nagle_algorithm = True  # Headers and body are written separately
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        if not path.startswith('/img/'):
+            self._reply(404, b'not found', 'text/plain')
+            return
+
+        queued = self.server.next_error()
+        if queued:
+            status, headers = queued
+            self._reply(status, b'stub error', 'text/plain', headers)
+            return
+
+        if len(self.path) > self.server.max_url_length:
+            self._reply(414, b'uri too long', 'text/plain')
+            return
+
+        try:
+            diagram = decode_diagram(path[len('/img/'):])
+        except (binascii.Error, UnicodeDecodeError, zlib.error, ValueError, KeyError):
+            self._reply(400, b'invalid encoded code', 'text/plain')
+            return
+
+        self.server.count_request(diagram)
+        self._reply(200, placeholder_png(), 'image/png')
+
+    def _reply(self, status: int, body: bytes, content_type: str, headers: dict = None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Keep test and benchmark output quiet
+
+
+class MermaidInkStub(ThreadingHTTPServer):
+    """Threaded stub server; use as a context manager to run it in the background."""
+
+    daemon_threads = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, handshake_delay: float = 0.0,
+                 max_url_length: int = 65536):
+        """
+        Initialize the server.
+
+        Args:
+            host: Interface to listen on
+            port: Port to listen on (0 picks a free port)
+            handshake_delay: Seconds to stall each new connection
+            max_url_length: Request paths longer than this get 414 URI Too Long
+        """
+        super().__init__((host, port), StubHandler)
+        self.handshake_delay = handshake_delay
+        self.max_url_length = max_url_length
+        self.diagrams = []  # Decoded diagrams, in request order
+        self.errors = deque()  # Queued (status, headers) responses
+        self.always_fail = None  # (status, headers) returned for every request
+        self.requests = 0  # Successful renders
+        self.attempts = 0  # All /img/ requests, including errors
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def queue_error(self, status: int, retry_after: str = None, count: int = 1):
+        """Answer the next count requests with an error status."""
+        headers = {'Retry-After': retry_after} if retry_after is not None else {}
+        with self._lock:
+            self.errors.extend([(status, headers)] * count)
+
+    def next_error(self):
+        with self._lock:
+            self.attempts += 1
+            if self.errors:
+                return self.errors.popleft()
+            return self.always_fail
+
+    def count_request(self, diagram: str):
+        with self._lock:
+            self.requests += 1
+            self.diagrams.append(diagram)
+
+    def process_request_thread(self, request, client_address):
+        with self._lock:
+            self.connections += 1
+        if self.handshake_delay:
+            time.sleep(self.handshake_delay)
+        super().process_request_thread(request, client_address)
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description='Local mermaid.ink stand-in')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--handshake-ms', type=float, default=0.0,
+                        help='Simulated connection setup cost in milliseconds')
+    args = parser.parse_args()
+
+    server = MermaidInkStub(args.host, args.port, args.handshake_ms / 1000)
+    print(f"Serving mermaid.ink stub on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,1204 @@
+"""
+Mermaid diagram rendering shared by md2gdocs.py and md2docx.py.
+
+Diagrams are rendered through the mermaid.ink API, a local mermaid CLI
+(mmdc), or a long-lived local render daemon (see render_daemon.py).
+Images are returned as PNG bytes and never pass through temporary
+files. Rendered images can be kept in a persistent, content-addressed
+cache so unchanged diagrams are not re-rendered on every run.
+"""
+
+import io
+import os
+import re
+import base64
+import hashlib
+import json
+import shutil
+import tempfile
+import subprocess
+import time
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from PIL import Image, ImageDraw
+
+from image_optimizer import ImageOptimizer, DEFAULT_IMAGE_DPI
+from render_daemon import (
+    RenderDaemonClient, RenderDaemonError, RenderDaemonUnavailable,
+    DEFAULT_MAX_RENDERS, DEFAULT_MAX_RSS_MB
+)
+
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.join(Path.home(), '.cache'),
+    'md2gdocs', 'mermaid'
+)
+DEFAULT_API_URL = 'https://mermaid.ink'
+DEFAULT_CACHE_MAX_MB = 200
+DEFAULT_FAILURE_TTL_HOURS = 24
+DEFAULT_RENDER_JOBS = 4
+DEFAULT_API_RATE = 10.0  # requests per second
+DEFAULT_CLI_BATCH_SIZE = 50
+# Diagrams whose plain base64 encoding is longer than this are sent
+# deflate-compressed ("pako:" encoding) instead
+DEFAULT_PAKO_THRESHOLD = 1024
+# Longest API URL sent; many proxies reject request lines above 8 KB
+DEFAULT_MAX_URL_LENGTH = 8000
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def encode_plain(mermaid_code: str) -> str:
+    """Encode a diagram as URL-safe base64 for a mermaid.ink /img/ path."""
+    return base64.urlsafe_b64encode(mermaid_code.encode('utf-8')).decode('ascii')
+
+
+def encode_pako(mermaid_code: str, theme: str = 'default') -> str:
+    """
+    Encode a diagram in mermaid.ink's compressed "pako:" form.
+
+    This is the mermaid.live editor state as JSON, zlib-deflated (what
+    pako.deflate produces) and URL-safe base64 encoded without padding.
+    The state carries the mermaid theme.
+    """
+    state = json.dumps({
+        'code': mermaid_code,
+        'mermaid': json.dumps({'theme': theme})
+    })
+    compressed = zlib.compress(state.encode('utf-8'), 9)
+    return 'pako:' + base64.urlsafe_b64encode(compressed).decode('ascii').rstrip('=')
+
+
+# Header keywords of the diagram types mermaid understands
+DIAGRAM_TYPES = {
+    'graph', 'flowchart', 'flowchart-elk', 'sequenceDiagram', 'classDiagram',
+    'classDiagram-v2', 'stateDiagram', 'stateDiagram-v2', 'erDiagram', 'journey',
+    'gantt', 'pie', 'quadrantChart', 'requirementDiagram', 'gitGraph',
+    'C4Context', 'C4Container', 'C4Component', 'C4Dynamic', 'C4Deployment',
+    'mindmap', 'timeline', 'zenuml', 'sankey-beta', 'xychart-beta', 'block-beta',
+    'packet-beta', 'architecture-beta', 'kanban', 'radar-beta', 'treemap-beta', 'info'
+}
+
+# Error reported for a diagram shown as a placeholder image
+PLACEHOLDER_ERROR = 'mermaid API unavailable, placeholder image used'
+
+# API statuses that mean the diagram itself is invalid
+DIAGRAM_ERROR_STATUSES = {400, 422}
+
+# Lines of mermaid output that identify an error in the diagram itself
+DIAGRAM_ERROR_PATTERN = re.compile(
+    r'(Parse|Lexical|Syntax) error|No diagram type detected|UnknownDiagramError'
+)
+
+
+class DiagramError(Exception):
+    """Raised by a backend when the diagram itself cannot be rendered."""
+
+
+class APIUnavailable(Exception):
+    """Raised by the API backend once the circuit breaker has given up on the API."""
+
+
+class BackendChanged(Exception):
+    """Raised when the run gave up on a render's backend; the render starts over with the new one."""
+
+
+class URLTooLong(Exception):
+    """Raised by the API backend for a diagram too large for a URL, which the CLI can render."""
+
+
+def _diagram_error_message(output: str) -> Optional[str]:
+    """Return the line of renderer output that reports a diagram error, if any."""
+    for line in output.splitlines():
+        if DIAGRAM_ERROR_PATTERN.search(line):
+            return line.strip()
+    return None
+
+
+def _check_brackets(text: str) -> Optional[str]:
+    """Check bracket balance in flowchart source, ignoring labels."""
+    text = re.sub(r'"[^"\n]*"', '', text)     # Quoted labels
+    text = re.sub(r'\|[^|\n]*\|', '', text)   # Edge labels: -->|text|
+    text = re.sub(r'>[^\]\n]*\]', '', text)   # Asymmetric shapes: A>text]
+    closing = {')': '(', ']': '[', '}': '{'}
+    stack = []
+    for char in text:
+        if char in '([{':
+            stack.append(char)
+        elif char in closing:
+            if not stack or stack.pop() != closing[char]:
+                return f"unbalanced '{char}'"
+    if stack:
+        return f"unclosed '{stack[-1]}'"
+    return None
+
+
+def validate_diagram(mermaid_code: str) -> Optional[str]:
+    """
+    Cheap local check for obviously invalid diagrams.
+
+    Catches an unknown diagram type header and unbalanced brackets in
+    flowcharts. Diagrams that pass may still fail to render.
+
+    Args:
+        mermaid_code: The mermaid diagram code
+
+    Returns:
+        A description of the problem, or None if the diagram looks valid
+    """
+    lines = [line.strip() for line in mermaid_code.splitlines() if line.strip()]
+
+    # Skip YAML front matter
+    if lines and lines[0] == '---':
+        try:
+            lines = lines[lines.index('---', 1) + 1:]
+        except ValueError:
+            return 'unterminated front matter'
+
+    # Skip comments and %%{init: ...}%% directives
+    lines = [line for line in lines if not line.startswith('%%')]
+    if not lines:
+        return 'empty diagram'
+
+    header = re.split(r'[\s;:]', lines[0], maxsplit=1)[0]
+    if header not in DIAGRAM_TYPES:
+        return f"unknown diagram type '{header}'"
+
+    if header in ('graph', 'flowchart', 'flowchart-elk'):
+        return _check_brackets('\n'.join(lines))
+    return None
+
+
+class RenderCache:
+    """
+    Persistent on-disk cache of rendered diagram images.
+
+    Entries are keyed by a hash of the diagram source and the render
+    settings, and stored as ``<cache_dir>/<key[:2]>/<key>.png``. File
+    modification times double as the LRU clock: a hit touches the entry,
+    and the least recently used entries are evicted once the total size
+    exceeds the cap.
+
+    Diagrams that failed to render are remembered in ``failures.json``
+    with their error text, so known-bad diagrams are skipped until the
+    entry expires.
+    """
+
+    suffix = '.png'  # File name extension of the entries
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR,
+                 max_bytes: int = DEFAULT_CACHE_MAX_MB * 1024 * 1024,
+                 failure_ttl: float = DEFAULT_FAILURE_TTL_HOURS * 3600):
+        """
+        Initialize the cache.
+
+        Args:
+            cache_dir: Directory where cached images are stored
+            max_bytes: Size cap for the cache; 0 disables the cap
+            failure_ttl: Seconds a failed render is remembered; 0 disables
+        """
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.failure_ttl = failure_ttl
+        self.hits = 0
+        self.misses = 0
+        self.known_failures = 0
+        self._index = None  # key -> (size, mtime), loaded lazily
+        self._total_bytes = 0
+        self._failures = None  # key -> [error, timestamp], loaded lazily
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(mermaid_code: str, backend: str, theme: str, background: str) -> str:
+        """Build the cache key for a diagram and its render settings."""
+        payload = json.dumps(
+            [mermaid_code, backend, theme, background],
+            ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path_for(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}{self.suffix}"
+
+    def _load_index(self):
+        """Scan the cache directory once to learn entry sizes and ages."""
+        if self._index is not None:
+            return
+        self._index = {}
+        self._total_bytes = 0
+        if not self.cache_dir.is_dir():
+            return
+        for path in self.cache_dir.glob(f'*/*{self.suffix}'):
+            if path.suffix == '.tmp':
+                continue  # A put() in progress
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            # The key is the file name without the suffix, so _path_for() finds
+            # the file again even if it has another extension
+            key = path.name[:-len(self.suffix)] if self.suffix else path.name
+            self._index[key] = (stat.st_size, stat.st_mtime)
+            self._total_bytes += stat.st_size
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Look up a cached image.
+
+        Args:
+            key: Cache key from make_key()
+
+        Returns:
+            The PNG bytes on a cache hit, None otherwise
+        """
+        path = self._path_for(key)
+        try:
+            image = path.read_bytes()
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        # Touch the entry so it counts as recently used
+        now = time.time()
+        try:
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+        with self._lock:
+            if self._index is not None and key in self._index:
+                self._index[key] = (self._index[key][0], now)
+            self.hits += 1
+        return image
+
+    def put(self, key: str, image: bytes):
+        """
+        Store a rendered image in the cache.
+
+        Args:
+            key: Cache key from make_key()
+            image: PNG bytes of the freshly rendered image
+        """
+        path = self._path_for(key)
+        size = len(image)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Write to a temp file first so readers never see partial images
+            fd, temp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(image)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"Warning: could not write render cache entry: {e}")
+            return
+
+        with self._lock:
+            self._load_index()
+            if key in self._index:
+                self._total_bytes -= self._index[key][0]
+            self._index[key] = (size, time.time())
+            self._total_bytes += size
+            self._evict()
+
+    def _evict(self):
+        """Remove least recently used entries until the cache fits its cap."""
+        if not self.max_bytes or self._total_bytes <= self.max_bytes:
+            return
+        for key, (size, _) in sorted(self._index.items(), key=lambda item: item[1][1]):
+            if self._total_bytes <= self.max_bytes:
+                break
+            try:
+                self._path_for(key).unlink()
+            except OSError:
+                pass
+            del self._index[key]
+            self._total_bytes -= size
+
+    def _load_failures(self):
+        """Read the failure records once, dropping expired ones."""
+        if self._failures is not None:
+            return
+        self._failures = {}
+        try:
+            with open(self.cache_dir / 'failures.json', 'r', encoding='utf-8') as f:
+                records = json.load(f)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        self._failures = {
+            key: record for key, record in records.items()
+            if now - record[1] < self.failure_ttl
+        }
+
+    def get_failure(self, key: str) -> Optional[str]:
+        """
+        Look up a remembered render failure.
+
+        Args:
+            key: Cache key from make_key()
+
+        Returns:
+            The recorded error text, or None if the diagram is not known to fail
+        """
+        if not self.failure_ttl:
+            return None
+        with self._lock:
+            self._load_failures()
+            record = self._failures.get(key)
+            if record is None or time.time() - record[1] >= self.failure_ttl:
+                return None
+            self.known_failures += 1
+            return record[0]
+
+    def put_failure(self, key: str, error: str):
+        """
+        Remember that a diagram failed to render.
+
+        Args:
+            key: Cache key from make_key()
+            error: Error text reported by the renderer
+        """
+        if not self.failure_ttl:
+            return
+        with self._lock:
+            self._load_failures()
+            self._failures[key] = [error, time.time()]
+            try:
+                self.cache_dir.mkdir(parents=True, exist_ok=True)
+                fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(self._failures, f)
+                os.replace(temp_path, self.cache_dir / 'failures.json')
+            except OSError as e:
+                print(f"Warning: could not write render failure record: {e}")
+
+    def stats(self) -> str:
+        """Return a one-line summary of cache hits and misses."""
+        summary = f"Render cache: {self.hits} hit(s), {self.misses} miss(es)"
+        if self.known_failures:
+            summary += f", {self.known_failures} known-bad diagram(s) skipped"
+        return summary
+
+
+class OptimizedImageCache(RenderCache):
+    """
+    RenderCache for optimized images, stored as ``<key[:2]>/<key>``.
+
+    An optimized image is PNG or JPEG, so its entry has no file name
+    extension rather than one that may not match its content. Entries
+    written as ``<key>.png`` by older versions are indexed under that
+    name and evicted like the others.
+    """
+
+    suffix = ''
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a Retry-After header value.
+
+    Args:
+        value: Header value, either delay seconds or an HTTP date
+
+    Returns:
+        Seconds to wait, or None if the header is missing or malformed
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class RateLimiter:
+    """
+    Token bucket shared by all API requests of a run.
+
+    The rate adapts to the server: every throttled (429/503) response
+    halves it and pauses all requests for the Retry-After period, and each
+    success raises it again by a tenth of the configured maximum.
+    """
+
+    def __init__(self, rate: float = DEFAULT_API_RATE, burst: int = DEFAULT_RENDER_JOBS,
+                 min_rate: float = 0.5):
+        """
+        Initialize the limiter.
+
+        Args:
+            rate: Maximum requests per second
+            burst: Number of requests that may be sent back to back
+            min_rate: Floor for the adapted rate
+        """
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.burst = max(1, burst)
+        self.throttled = 0
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    wait = self._blocked_until - now
+                else:
+                    elapsed = now - self._updated
+                    self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def on_success(self):
+        """Additively raise the rate after a successful request."""
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+    def on_throttle(self, retry_after: Optional[float]):
+        """
+        Slow down after a 429 or 503 response.
+
+        Args:
+            retry_after: Seconds the server asked us to wait, if given
+        """
+        with self._lock:
+            self.throttled += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = 0.0
+            if retry_after:
+                self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+
+
+class CircuitBreaker:
+    """
+    Track API request outcomes and trip once the failure rate is too high.
+
+    A tripped breaker stays open for the rest of the run.
+    """
+
+    def __init__(self, failure_threshold: float = 0.5, window: int = 20,
+                 min_requests: int = 5):
+        """
+        Initialize the breaker.
+
+        Args:
+            failure_threshold: Failure fraction at which the breaker opens
+            window: Number of recent outcomes considered
+            min_requests: Outcomes needed before the breaker can open
+        """
+        self.failure_threshold = failure_threshold
+        self.min_requests = min_requests
+        self.is_open = False
+        self._outcomes = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, success: bool) -> bool:
+        """
+        Record a request outcome.
+
+        Returns:
+            True if this outcome tripped the breaker
+        """
+        with self._lock:
+            self._outcomes.append(success)
+            if self.is_open or len(self._outcomes) < self.min_requests:
+                return False
+            failures = self._outcomes.count(False)
+            if failures / len(self._outcomes) >= self.failure_threshold:
+                self.is_open = True
+                return True
+            return False
+
+
+def placeholder_image(message: str = 'Diagram unavailable') -> bytes:
+    """Build a plain 4:3 PNG with a border and a short message."""
+    image = Image.new('RGB', (800, 600), 'white')
+    draw = ImageDraw.Draw(image)
+    draw.rectangle([0, 0, 799, 599], outline=(160, 160, 160), width=4)
+    draw.text((400, 300), message, fill=(96, 96, 96), anchor='mm')
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class MermaidRenderer:
+    """Handle rendering of Mermaid diagrams to images."""
+
+    def __init__(self, use_api: bool = True, cache: Optional[RenderCache] = None,
+                 theme: str = 'default', background: str = 'white',
+                 jobs: int = DEFAULT_RENDER_JOBS,
+                 cli_batch_size: int = DEFAULT_CLI_BATCH_SIZE,
+                 daemon: Optional[RenderDaemonClient] = None,
+                 api_url: str = DEFAULT_API_URL,
+                 keep_alive: bool = True,
+                 pako_threshold: int = DEFAULT_PAKO_THRESHOLD,
+                 max_url_length: int = DEFAULT_MAX_URL_LENGTH,
+                 api_rate: float = DEFAULT_API_RATE,
+                 optimizer: Optional[ImageOptimizer] = None):
+        """
+        Initialize the renderer.
+
+        Args:
+            use_api: If True, use mermaid.ink API. If False, use local mermaid CLI.
+            cache: Optional render cache; diagrams found there are not re-rendered
+            theme: Mermaid theme passed to the CLI
+            background: Background color passed to the CLI
+            jobs: Maximum number of diagrams rendered concurrently
+            cli_batch_size: Maximum number of diagrams per mermaid CLI invocation
+            daemon: Optional render daemon client; takes precedence over use_api
+            api_url: Base URL of the mermaid.ink (or compatible) server
+            keep_alive: If True, reuse pooled HTTP connections for API requests
+            pako_threshold: Encoded size above which diagrams are sent compressed
+            max_url_length: Longest API URL to send; longer diagrams use the CLI
+            api_rate: Maximum API requests per second across all workers
+            optimizer: Optional post-render stage that shrinks images to their display size
+        """
+        self.use_api = use_api
+        self.cache = cache
+        self.jobs = max(1, jobs)
+        self.cli_batch_size = max(1, cli_batch_size)
+        self.daemon = daemon
+        self.theme = theme
+        self.background = background
+        self.api_url = api_url.rstrip('/')
+        self.keep_alive = keep_alive
+        self.pako_threshold = pako_threshold
+        self.max_url_length = max_url_length
+        self.optimizer = optimizer
+        self.rate_limiter = RateLimiter(api_rate, burst=self.jobs)
+        self.circuit_breaker = CircuitBreaker()
+        self.use_placeholders = False  # Set once the API is given up on
+        self.failures = []  # (source, diagram index, error) for the end-of-run report
+        self._failures_lock = threading.Lock()
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._backend_lock = threading.Lock()  # Guards switching the run to another backend
+        if not use_api:
+            # Check if mermaid CLI is installed
+            try:
+                subprocess.run(['mmdc', '--version'], check=True, capture_output=True)
+            except (subprocess.CalledProcessError, FileNotFoundError):
+                print("Warning: mermaid CLI not found. Falling back to API.")
+                self.use_api = True
+
+    @property
+    def backend(self) -> str:
+        """Name of the backend used for rendering."""
+        if self.daemon is not None:
+            return 'daemon'
+        return 'api' if self.use_api else 'cli'
+
+    def render_to_bytes(self, mermaid_code: str) -> Optional[bytes]:
+        """
+        Render mermaid code to image bytes.
+
+        Args:
+            mermaid_code: The mermaid diagram code
+
+        Returns:
+            The image bytes (PNG, or JPEG after optimization) if successful,
+            None otherwise
+        """
+        image = self._render(mermaid_code)[0]
+        if image is not None and self.optimizer is not None:
+            image = self.optimizer.optimize(image)
+        return image
+
+    def render_to_image(self, mermaid_code: str, output_path: str) -> bool:
+        """
+        Render mermaid code to an image file.
+
+        Args:
+            mermaid_code: The mermaid diagram code
+            output_path: Path where the image should be saved
+
+        Returns:
+            True if successful, False otherwise
+        """
+        image = self.render_to_bytes(mermaid_code)
+        if image is None:
+            return False
+        with open(output_path, 'wb') as f:
+            f.write(image)
+        return True
+
+    def _check_before_render(self, mermaid_code: str, backend: Optional[str] = None
+                             ) -> Tuple[bool, Optional[str], Optional[bytes], Optional[str]]:
+        """
+        Resolve a diagram without rendering it, where possible.
+
+        Runs the local validity check, the failure records and the image
+        cache, in that order. The cache is looked up under backend, by
+        default the active one.
+
+        Returns:
+            Tuple of (resolved, cache key, image, error). When resolved is
+            True the diagram needs no rendering: image holds the cached PNG,
+            or error says why the diagram fails.
+        """
+        problem = validate_diagram(mermaid_code)
+        if problem:
+            print(f"Skipping invalid mermaid diagram: {problem}")
+            return True, None, None, problem
+
+        key = self._cache_key(mermaid_code, backend)
+        if key is not None:
+            known_error = self.cache.get_failure(key)
+            if known_error:
+                print(f"Skipping mermaid diagram that failed before: {known_error}")
+                return True, key, None, f"{known_error} (cached failure)"
+            image = self.cache.get(key)
+            if image is not None:
+                return True, key, image, None
+        return False, key, None, None
+
+    def _render(self, mermaid_code: str,
+                backend: Optional[str] = None) -> Tuple[Optional[bytes], Optional[str]]:
+        """
+        Render one diagram, using the caches where possible.
+
+        Args:
+            mermaid_code: The mermaid diagram code
+            backend: Backend to render with; the active one by default
+
+        Returns:
+            Tuple of (image, error). error is None on success; on failure
+            image is None, or a placeholder once the API was given up on.
+        """
+        backend = backend or self.backend
+        resolved, key, image, error = self._check_before_render(mermaid_code, backend)
+        if resolved:
+            return image, error
+
+        # Placeholders are never cached, so later runs retry the API
+        if self.use_placeholders and backend == 'api':
+            return placeholder_image(), PLACEHOLDER_ERROR
+        try:
+            return self._render_uncached(mermaid_code, key, backend)
+        except BackendChanged:
+            # Start over with the new backend's cache key
+            return self._render(mermaid_code)
+        except URLTooLong as e:
+            # Only this diagram goes to the CLI, cached under the CLI's key
+            print(f"{e}; rendering with mermaid CLI instead")
+            return self._render(mermaid_code, 'cli')
+        except APIUnavailable:
+            if self.backend == 'cli':
+                # The run switched to the CLI; start over with its cache key
+                return self._render(mermaid_code)
+            return placeholder_image(), PLACEHOLDER_ERROR
+
+    def _render_uncached(self, mermaid_code: str, key: Optional[str],
+                         backend: str) -> Tuple[Optional[bytes], Optional[str]]:
+        """Render with backend and record the outcome in the cache under key."""
+        try:
+            if backend == 'daemon':
+                image = self._render_with_daemon(mermaid_code)
+            elif backend == 'api':
+                image = self._render_with_api(mermaid_code)
+            else:
+                image = self._render_with_cli(mermaid_code)
+        except DiagramError as e:
+            print(f"Error in mermaid diagram: {e}")
+            if key is not None:
+                self.cache.put_failure(key, str(e))
+            return None, str(e)
+
+        if image is None:
+            return None, 'rendering failed'
+        if key is not None:
+            self.cache.put(key, image)
+        return image, None
+
+    def _cache_key(self, mermaid_code: str, backend: Optional[str] = None) -> Optional[str]:
+        """Return the cache key for a diagram and backend (the active one by default), or None when caching is off."""
+        if self.cache is None:
+            return None
+        return RenderCache.make_key(mermaid_code, backend or self.backend, self.theme, self.background)
+
+    def render_all(self, mermaid_codes: List[str],
+                   source: Optional[str] = None) -> List[Optional[bytes]]:
+        """
+        Render several diagrams concurrently.
+
+        With the CLI backend, diagrams are rendered in batches so each
+        mmdc process renders many diagrams. A failed diagram does not
+        affect the others; its slot in the result is None.
+
+        Args:
+            mermaid_codes: Mermaid diagram codes, in block index order
+            source: Name of the file the diagrams come from; when given,
+                failures are added to the end-of-run report
+
+        Returns:
+            Image bytes in the same order as mermaid_codes
+        """
+        results, errors = self._render_many(mermaid_codes)
+        if self.optimizer is not None:
+            results = [
+                None if image is None else self.optimizer.optimize(image)
+                for image in results
+            ]
+
+        if source is not None:
+            with self._failures_lock:
+                self.failures.extend(
+                    (source, i, error) for i, error in enumerate(errors) if error is not None
+                )
+        return results
+
+    def _render_many(self, mermaid_codes: List[str]) -> Tuple[List[Optional[bytes]], List[Optional[str]]]:
+        """Render several diagrams with the active backend; returns (images, errors)."""
+        results = [None] * len(mermaid_codes)
+        errors = [None] * len(mermaid_codes)
+        if not mermaid_codes:
+            return results, errors
+
+        if self.backend == 'cli':
+            self._render_all_with_cli(mermaid_codes, results, errors)
+        else:
+            workers = min(self.jobs, len(mermaid_codes))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = {
+                    pool.submit(self._render, code): i
+                    for i, code in enumerate(mermaid_codes)
+                }
+                for future in as_completed(futures):
+                    i = futures[future]
+                    try:
+                        results[i], errors[i] = future.result()
+                    except Exception as e:
+                        print(f"Error rendering mermaid diagram {i}: {e}")
+                        errors[i] = str(e)
+        return results, errors
+
+    def prerender(self, mermaid_codes: List[str]):
+        """
+        Render diagrams ahead of time so later render calls hit the cache.
+
+        Used by directory conversions to render every diagram of the run
+        together, which lets the CLI backend batch across files.
+
+        Args:
+            mermaid_codes: Mermaid diagram codes, duplicates allowed
+        """
+        if self.cache is None or not mermaid_codes:
+            return
+        self._render_many(list(dict.fromkeys(mermaid_codes)))
+
+    def _render_all_with_cli(self, mermaid_codes: List[str], results: List[Optional[bytes]],
+                             errors: List[Optional[str]]):
+        """Render cache misses in chunks of cli_batch_size, one mmdc run per chunk."""
+        pending = []  # (index, cache key) of diagrams that still need rendering
+        for i, mermaid_code in enumerate(mermaid_codes):
+            resolved, key, image, error = self._check_before_render(mermaid_code)
+            if resolved:
+                results[i], errors[i] = image, error
+            else:
+                pending.append((i, key))
+
+        chunks = [
+            pending[start:start + self.cli_batch_size]
+            for start in range(0, len(pending), self.cli_batch_size)
+        ]
+        if not chunks:
+            return
+
+        def render_chunk(chunk):
+            if len(chunk) == 1:
+                # A single diagram goes through stdin/stdout, no batch files needed
+                rendered = [None]
+            else:
+                rendered = self._render_batch_with_cli([mermaid_codes[i] for i, _ in chunk])
+            for (i, key), image in zip(chunk, rendered):
+                if image is not None:
+                    results[i] = image
+                    if key is not None:
+                        self.cache.put(key, image)
+                else:
+                    # One bad diagram fails the whole batch; retry it alone
+                    results[i], errors[i] = self._render_uncached(mermaid_codes[i], key, 'cli')
+
+        with ThreadPoolExecutor(max_workers=min(self.jobs, len(chunks))) as pool:
+            for future in [pool.submit(render_chunk, chunk) for chunk in chunks]:
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"Error rendering mermaid diagrams with CLI: {e}")
+        for i, _ in pending:
+            if results[i] is None and errors[i] is None:
+                errors[i] = 'rendering failed'
+
+    def _render_batch_with_cli(self, mermaid_codes: List[str]) -> List[Optional[bytes]]:
+        """
+        Render several diagrams with a single mermaid CLI invocation.
+
+        The diagrams are written as fenced blocks into one markdown file;
+        mmdc renders each block to ``<output>-<n>.png`` (1-based), which is
+        read back into memory. mmdc can only write one image to stdout, so
+        a batch needs a scratch directory.
+
+        Returns:
+            PNG bytes per diagram, None where the diagram did not render
+        """
+        with tempfile.TemporaryDirectory() as batch_dir:
+            input_md = os.path.join(batch_dir, 'batch.md')
+            output_md = os.path.join(batch_dir, 'rendered.md')
+            with open(input_md, 'w', encoding='utf-8') as f:
+                for mermaid_code in mermaid_codes:
+                    f.write(f"```mermaid\n{mermaid_code.rstrip()}\n```\n\n")
+
+            try:
+                subprocess.run([
+                    'mmdc',
+                    '-i', input_md,
+                    '-o', output_md,
+                    '-e', 'png',
+                    '-t', self.theme,
+                    '-b', self.background
+                ], check=True, capture_output=True)
+            except Exception as e:
+                print(f"Batch render with mermaid CLI failed, rendering diagrams individually: {e}")
+                return [None] * len(mermaid_codes)
+
+            rendered = []
+            for n in range(1, len(mermaid_codes) + 1):
+                try:
+                    rendered.append(Path(batch_dir, f'rendered-{n}.png').read_bytes())
+                except OSError:
+                    rendered.append(None)
+            return rendered
+
+    @property
+    def session(self) -> requests.Session:
+        """
+        Pooled HTTP session for API requests.
+
+        Created on first use and kept for the renderer's lifetime, so
+        connections are reused across diagrams and across the files of a
+        directory run. The pool holds one connection per render worker.
+        """
+        with self._session_lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.jobs)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._session = session
+            return self._session
+
+    def api_url_for(self, mermaid_code: str) -> str:
+        """
+        Build the API image URL for a diagram.
+
+        Small diagrams use plain base64; above pako_threshold the
+        compressed encoding is used, which is much shorter for large
+        diagrams.
+        """
+        encoded = encode_plain(mermaid_code)
+        if len(encoded) > self.pako_threshold:
+            encoded = encode_pako(mermaid_code, self.theme)
+        return f"{self.api_url}/img/{encoded}"
+
+    def _render_with_api(self, mermaid_code: str) -> Optional[bytes]:
+        """Render using mermaid.ink API with retry logic."""
+        max_retries = 3
+        retry_delay = 2  # seconds
+
+        url = self.api_url_for(mermaid_code)
+        if len(url) > self.max_url_length:
+            # mermaid.ink only accepts GET, so very large diagrams need the CLI
+            if shutil.which('mmdc'):
+                raise URLTooLong(f"Diagram URL is {len(url)} characters")
+            print(f"Error rendering mermaid diagram with API: URL would be {len(url)} "
+                  f"characters (limit {self.max_url_length}) and mermaid CLI is not installed")
+            return None
+
+        for attempt in range(max_retries):
+            if self.circuit_breaker.is_open:
+                raise APIUnavailable('mermaid API circuit breaker is open')
+
+            self.rate_limiter.acquire()
+            try:
+                # Request the image from mermaid.ink
+                if self.keep_alive:
+                    response = self.session.get(url, timeout=30)
+                else:
+                    response = requests.get(url, timeout=30)
+                response.raise_for_status()
+
+                self.rate_limiter.on_success()
+                self.circuit_breaker.record(True)
+                return response.content
+            except requests.exceptions.HTTPError as e:
+                status = e.response.status_code
+                if status in DIAGRAM_ERROR_STATUSES:
+                    # The server rejected the diagram itself; retrying cannot help.
+                    # Other 4xx statuses (404, 401, 414...) point at the URL or a
+                    # proxy and are handled as API failures below, without a record
+                    detail = e.response.text.strip()[:200]
+                    raise DiagramError(f"mermaid.ink returned {status}: {detail}")
+                retry_after = None
+                if status in [429, 503]:
+                    retry_after = parse_retry_after(e.response.headers.get('Retry-After'))
+                    self.rate_limiter.on_throttle(retry_after)
+
+                if attempt < max_retries - 1 and status in [503, 429, 500]:
+                    # Retry on server errors or rate limiting
+                    delay = retry_after if retry_after is not None else retry_delay
+                    print(f"Mermaid API error (attempt {attempt + 1}/{max_retries}): {status}. Retrying in {delay:g}s...")
+                    time.sleep(delay)
+                    retry_delay *= 2  # Exponential backoff
+                else:
+                    print(f"Error rendering mermaid diagram with API: {e}")
+                    self._record_api_failure()
+                    return None
+            except Exception as e:
+                print(f"Error rendering mermaid diagram with API: {e}")
+                self._record_api_failure()
+                return None
+
+        return None
+
+    def _record_api_failure(self):
+        """Count a failed API render and switch the run away from the API if it trips the breaker."""
+        if not self.circuit_breaker.record(False):
+            return
+        with self._backend_lock:
+            if shutil.which('mmdc'):
+                print("Warning: mermaid API failure rate too high. Switching to mermaid CLI for the rest of the run.")
+                self.use_api = False
+            else:
+                print("Warning: mermaid API failure rate too high. Using placeholder images for the rest of the run.")
+                self.use_placeholders = True
+
+    def _render_with_daemon(self, mermaid_code: str) -> Optional[bytes]:
+        """Render using the long-lived render daemon."""
+        daemon = self.daemon
+        if daemon is None:
+            raise BackendChanged('the render daemon was given up on')
+        try:
+            return daemon.render(mermaid_code, self.theme, self.background)
+        except RenderDaemonUnavailable as e:
+            with self._backend_lock:
+                if self.daemon is daemon:
+                    print(f"Warning: mermaid render daemon unavailable ({e}). Falling back to API.")
+                    self.daemon = None
+                    self.use_api = True
+                    daemon.close()
+            raise BackendChanged(str(e))
+        except RenderDaemonError as e:
+            message = _diagram_error_message(str(e))
+            if message:
+                raise DiagramError(message)
+            print(f"Error rendering mermaid diagram with daemon: {e}")
+            return None
+
+    def close(self):
+        """Release backend resources such as pooled connections or a render daemon."""
+        if self.daemon is not None:
+            self.daemon.close()
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def _render_with_cli(self, mermaid_code: str) -> Optional[bytes]:
+        """Render using local mermaid CLI, piping the diagram through stdin and stdout."""
+        try:
+            result = subprocess.run([
+                'mmdc',
+                '-i', '-',
+                '-o', '-',
+                '-e', 'png',
+                '-t', self.theme,
+                '-b', self.background
+            ], input=mermaid_code.encode('utf-8'), check=True, capture_output=True)
+        except subprocess.CalledProcessError as e:
+            message = _diagram_error_message(e.stderr.decode('utf-8', errors='replace'))
+            if message:
+                raise DiagramError(message)
+            print(f"Error rendering mermaid diagram with CLI: {e}")
+            return None
+        except Exception as e:
+            print(f"Error rendering mermaid diagram with CLI: {e}")
+            return None
+
+        if not result.stdout.startswith(PNG_SIGNATURE):
+            print("Error rendering mermaid diagram with CLI: no PNG on standard output")
+            return None
+        return result.stdout
+
+
+def add_renderer_arguments(parser):
+    """
+    Add the diagram rendering options shared by both command line tools.
+
+    Args:
+        parser: argparse.ArgumentParser to extend
+    """
+    parser.add_argument(
+        '--use-cli',
+        action='store_true',
+        help='Use local mermaid CLI instead of API for rendering'
+    )
+    parser.add_argument(
+        '--mermaid-url',
+        default=DEFAULT_API_URL,
+        metavar='URL',
+        help=f'Base URL of a mermaid.ink-compatible render server (default: {DEFAULT_API_URL})'
+    )
+    parser.add_argument(
+        '--api-rate',
+        type=float,
+        default=DEFAULT_API_RATE,
+        metavar='N',
+        help=f'Maximum mermaid API requests per second; lowered automatically when throttled (default: {DEFAULT_API_RATE:g})'
+    )
+    parser.add_argument(
+        '--use-daemon',
+        action='store_true',
+        help='Render with a long-lived local mermaid daemon that keeps a warm browser'
+    )
+    parser.add_argument(
+        '--daemon-socket',
+        metavar='PATH',
+        help='Unix socket for the render daemon, so it is reused across runs (implies --use-daemon)'
+    )
+    parser.add_argument(
+        '--daemon-max-renders',
+        type=int,
+        default=DEFAULT_MAX_RENDERS,
+        metavar='N',
+        help=f'Recycle the render daemon after N renders (default: {DEFAULT_MAX_RENDERS})'
+    )
+    parser.add_argument(
+        '--daemon-max-rss-mb',
+        type=int,
+        default=DEFAULT_MAX_RSS_MB,
+        metavar='MB',
+        help=f'Recycle the render daemon above this memory use (default: {DEFAULT_MAX_RSS_MB})'
+    )
+    parser.add_argument(
+        '--cache-dir',
+        default=DEFAULT_CACHE_DIR,
+        help=f'Directory for cached diagram images (default: {DEFAULT_CACHE_DIR})'
+    )
+    parser.add_argument(
+        '--cache-max-mb',
+        type=int,
+        default=DEFAULT_CACHE_MAX_MB,
+        help=f'Size cap in MB for the diagram cache, and separately for the optimized-image cache '
+             f'with --optimize-images; 0 for no cap (default: {DEFAULT_CACHE_MAX_MB})'
+    )
+    parser.add_argument(
+        '--render-jobs',
+        type=int,
+        default=DEFAULT_RENDER_JOBS,
+        metavar='N',
+        help=f'Number of diagrams to render concurrently (default: {DEFAULT_RENDER_JOBS})'
+    )
+    parser.add_argument(
+        '--failure-ttl',
+        type=float,
+        default=DEFAULT_FAILURE_TTL_HOURS,
+        metavar='HOURS',
+        help=f'Skip diagrams that failed to render within this many hours, 0 to always retry (default: {DEFAULT_FAILURE_TTL_HOURS})'
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Always re-render diagrams instead of using the cache'
+    )
+    parser.add_argument(
+        '--optimize-images',
+        action='store_true',
+        help='Downsample rendered diagrams to their display size and recompress them'
+    )
+    parser.add_argument(
+        '--image-dpi',
+        type=int,
+        default=DEFAULT_IMAGE_DPI,
+        metavar='DPI',
+        help=f'Resolution kept at the display size with --optimize-images (default: {DEFAULT_IMAGE_DPI})'
+    )
+    parser.add_argument(
+        '--no-jpeg',
+        action='store_true',
+        help='Never convert images to JPEG with --optimize-images'
+    )
+
+
+def renderer_from_args(args, display_size: Tuple[Optional[float], Optional[float]] = (None, None)) -> MermaidRenderer:
+    """
+    Build a MermaidRenderer from parsed command line arguments.
+
+    Args:
+        args: Namespace produced by a parser set up with add_renderer_arguments()
+        display_size: (width, height) in points that diagrams are shown at,
+            used by --optimize-images; None leaves a dimension unconstrained
+
+    Returns:
+        The configured renderer
+    """
+    cache = None
+    if not args.no_cache:
+        cache = RenderCache(args.cache_dir, max_bytes=args.cache_max_mb * 1024 * 1024,
+                            failure_ttl=args.failure_ttl * 3600)
+    daemon = None
+    if args.use_daemon or args.daemon_socket:
+        daemon = RenderDaemonClient(
+            socket_path=args.daemon_socket,
+            max_renders=args.daemon_max_renders,
+            max_rss_mb=args.daemon_max_rss_mb
+        )
+    optimizer = None
+    if args.optimize_images:
+        # Optimized images live next to the rendered ones, with a cap of the same size of their own
+        optimized_cache = None
+        if cache is not None:
+            optimized_cache = OptimizedImageCache(os.path.join(args.cache_dir, 'optimized'),
+                                                  max_bytes=cache.max_bytes, failure_ttl=0)
+        optimizer = ImageOptimizer(display_size, dpi=args.image_dpi,
+                                   allow_jpeg=not args.no_jpeg, cache=optimized_cache)
+    return MermaidRenderer(use_api=not args.use_cli, cache=cache,
+                           jobs=args.render_jobs, daemon=daemon,
+                           api_url=args.mermaid_url, api_rate=args.api_rate,
+                           optimizer=optimizer)
+
+
+def print_renderer_stats(renderer: MermaidRenderer):
+    """Print end-of-run statistics for a renderer."""
+    if renderer.cache is not None:
+        print(renderer.cache.stats())
+    if renderer.optimizer is not None:
+        print(renderer.optimizer.stats())
+    if renderer.rate_limiter.throttled:
+        print(f"Mermaid API: {renderer.rate_limiter.throttled} throttled response(s), "
+              f"final rate {renderer.rate_limiter.rate:.2f} req/s")
+    if renderer.circuit_breaker.is_open:
+        print("Mermaid API: circuit breaker opened during the run")
+    if renderer.failures:
+        print(f"\n{len(renderer.failures)} diagram(s) failed to render:")
+        for source, index, error in renderer.failures:
+            print(f"  {source}: diagram {index + 1}: {error}")
@@ -0,0 +1,252 @@
+"""
+Persistent cache of parsed documents and of the output built from them.
+
+Rebuilding a set of documents where most files did not change would
+otherwise parse, tokenize and lay out every file again. ParseCache keeps
+three kinds of entries, all stored with marshal:
+
+    blocks      the blocks and mermaid codes scan_blocks() returned,
+                keyed by the text of the file
+    docs        the Docs request plan md2gdocs.py built for the blocks,
+                also keyed by the Drive IDs of the diagram images
+    docx        the XML body md2docx.py built for the blocks, also keyed
+                by the title and the diagram images
+
+Every key includes a hash of the source of the code that produced the
+entry, so changing the parser or a converter makes old entries unused
+(they are evicted like any other once the cache is over its size cap).
+marshal's format may change between Python versions, so the Python
+version is part of the key too.
+"""
+
+import os
+import sys
+import json
+import marshal
+import hashlib
+from pathlib import Path
+from types import ModuleType
+from typing import Any, List, Optional, Tuple
+
+import inline_markdown
+import markdown_blocks
+from inline_markdown import InlineSpan
+from markdown_blocks import (
+    scan_blocks, Block, TextLine, TextBlock, TableBlock, CodeBlock, MermaidBlock
+)
+from mermaid_renderer import RenderCache
+
+
+DEFAULT_PARSE_CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.join(Path.home(), '.cache'),
+    'md2gdocs', 'documents'
+)
+DEFAULT_PARSE_CACHE_MAX_MB = 200
+
+# Tags of the encoded blocks
+_TEXT, _TABLE, _CODE, _MERMAID = range(4)
+
+_versions = {}  # Module names -> hash of their source, computed once
+
+
+def code_version(*modules: ModuleType) -> str:
+    """
+    Hash the source files of modules, together with the Python version.
+
+    Args:
+        modules: Modules whose code determines a cached result
+
+    Returns:
+        A short hex digest that changes whenever any of the files does
+    """
+    names = tuple(module.__name__ for module in modules)
+    if names not in _versions:
+        digest = hashlib.sha256(repr(sys.version_info[:2]).encode())
+        for module in modules:
+            digest.update(Path(module.__file__).read_bytes())
+        _versions[names] = digest.hexdigest()[:16]
+    return _versions[names]
+
+
+def parser_version() -> str:
+    """Version of the markdown parser, for cache keys."""
+    return code_version(markdown_blocks, inline_markdown)
+
+
+def encode_blocks(blocks: List[Block]) -> list:
+    """Turn blocks into plain tuples and lists that marshal can store."""
+    encoded = []
+    for block in blocks:
+        if isinstance(block, TextBlock):
+            encoded.append((_TEXT, [
+                (line.kind, line.level, line.number, line.text, [tuple(span) for span in line.spans])
+                for line in block.lines
+            ]))
+        elif isinstance(block, TableBlock):
+            encoded.append((_TABLE, block.rows))
+        elif isinstance(block, CodeBlock):
+            encoded.append((_CODE, block.language, block.content))
+        else:
+            encoded.append((_MERMAID, block.index))
+    return encoded
+
+
+def decode_blocks(encoded: list) -> List[Block]:
+    """Rebuild the blocks encode_blocks() encoded."""
+    blocks = []
+    for item in encoded:
+        tag = item[0]
+        if tag == _TEXT:
+            blocks.append(TextBlock([
+                TextLine(kind, level, number, text, [InlineSpan(*span) for span in spans])
+                for kind, level, number, text, spans in item[1]
+            ]))
+        elif tag == _TABLE:
+            blocks.append(TableBlock(item[1]))
+        elif tag == _CODE:
+            blocks.append(CodeBlock(item[1], item[2]))
+        else:
+            blocks.append(MermaidBlock(item[1]))
+    return blocks
+
+
+class ParseCache(RenderCache):
+    """
+    On-disk cache of parsed blocks and converter output.
+
+    Entries are marshal files in the RenderCache layout, with the same
+    least-recently-used eviction under a size cap. A missing, corrupt
+    or unreadable entry counts as a miss.
+    """
+
+    suffix = '.marshal'
+
+    def __init__(self, cache_dir: str = DEFAULT_PARSE_CACHE_DIR,
+                 max_bytes: int = DEFAULT_PARSE_CACHE_MAX_MB * 1024 * 1024):
+        """
+        Initialize the cache.
+
+        Args:
+            cache_dir: Directory where entries are stored
+            max_bytes: Size cap for the cache; 0 disables the cap
+        """
+        super().__init__(cache_dir, max_bytes=max_bytes, failure_ttl=0)
+
+    @staticmethod
+    def source_hash(markdown_text: str) -> str:
+        """Hash of a markdown file's text."""
+        return hashlib.sha256(markdown_text.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def make_output_key(kind: str, version: str, source_hash: str, *inputs: Any) -> str:
+        """
+        Build the key of a converter's output.
+
+        Args:
+            kind: 'docs' or 'docx'
+            version: code_version() of the modules that build the output
+            source_hash: source_hash() of the markdown
+            inputs: Anything else the output depends on, JSON-serializable
+
+        Returns:
+            The cache key
+        """
+        payload = json.dumps([kind, version, parser_version(), source_hash, inputs])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get_value(self, key: str) -> Optional[Any]:
+        """
+        Look up a cached value.
+
+        Args:
+            key: Cache key
+
+        Returns:
+            The stored value, or None on a miss
+        """
+        data = self.get(key)
+        if data is None:
+            return None
+        try:
+            return marshal.loads(data)
+        except (EOFError, ValueError, TypeError):
+            # A truncated or foreign entry; it is overwritten on the next put
+            with self._lock:
+                self.hits -= 1
+                self.misses += 1
+            return None
+
+    def put_value(self, key: str, value: Any):
+        """
+        Store a value made of str, bytes, numbers, None, tuples, lists and dicts.
+
+        Args:
+            key: Cache key
+            value: Value to store
+        """
+        self.put(key, marshal.dumps(value))
+
+    def parse(self, markdown_text: str) -> Tuple[List[Block], List[str], str]:
+        """
+        Parse markdown, or load the blocks parsed from the same text before.
+
+        Args:
+            markdown_text: The markdown content
+
+        Returns:
+            Tuple of (content blocks, mermaid codes, source_hash() of the text)
+        """
+        source_hash = self.source_hash(markdown_text)
+        key = hashlib.sha256(f"blocks:{parser_version()}:{source_hash}".encode()).hexdigest()
+        cached = self.get_value(key)
+        if cached is not None:
+            encoded, mermaid_codes = cached
+            return decode_blocks(encoded), mermaid_codes, source_hash
+        blocks, mermaid_codes = scan_blocks(markdown_text)
+        self.put_value(key, (encode_blocks(blocks), mermaid_codes))
+        return blocks, mermaid_codes, source_hash
+
+    def stats(self) -> str:
+        """Return a one-line summary of cache hits and misses."""
+        return f"Parse cache: {self.hits} hit(s), {self.misses} miss(es)"
+
+
+def add_parse_cache_arguments(parser):
+    """
+    Add the parse cache options shared by both command line tools.
+
+    Args:
+        parser: argparse.ArgumentParser to extend
+    """
+    parser.add_argument(
+        '--parse-cache-dir',
+        default=DEFAULT_PARSE_CACHE_DIR,
+        metavar='PATH',
+        help=f'Directory for parsed documents and converter output reused across runs (default: {DEFAULT_PARSE_CACHE_DIR})'
+    )
+    parser.add_argument(
+        '--parse-cache-max-mb',
+        type=int,
+        default=DEFAULT_PARSE_CACHE_MAX_MB,
+        help=f'Size cap for the parse cache in MB, 0 for no cap (default: {DEFAULT_PARSE_CACHE_MAX_MB})'
+    )
+    parser.add_argument(
+        '--no-parse-cache',
+        action='store_true',
+        help='Parse and lay out every file again instead of reusing the results for unchanged files'
+    )
+
+
+def parse_cache_from_args(args) -> Optional[ParseCache]:
+    """
+    Build the ParseCache selected on the command line.
+
+    Args:
+        args: Namespace produced by a parser set up with add_parse_cache_arguments()
+
+    Returns:
+        The cache, or None with --no-parse-cache
+    """
+    if args.no_parse_cache:
+        return None
+    return ParseCache(args.parse_cache_dir, max_bytes=args.parse_cache_max_mb * 1024 * 1024)
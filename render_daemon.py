@@ -0,0 +1,278 @@
+"""
+Client for a long-lived mermaid render daemon.
+
+The daemon keeps a warm headless browser page and renders diagrams sent
+to it as JSON lines, either over its stdin/stdout pipe or over a unix
+socket (which lets the daemon outlive a single conversion run).
+
+Protocol - one JSON object per line, UTF-8:
+
+    startup:  {"ready": true, "pid": 1234}            (pipe mode only)
+    request:  {"id": 1, "code": "graph TD; A-->B", "theme": "default",
+               "background": "white"}
+    response: {"id": 1, "ok": true, "image": "<base64 PNG>",
+               "renders": 1, "rss": 123456789, "recycle": false}
+              {"id": 1, "ok": false, "error": "Parse error ...", ...}
+    shutdown: {"id": 2, "shutdown": true}
+    response: {"id": 2, "ok": true, "shutdown": true}
+
+A response with "recycle": true means the daemon exits after sending it
+(it hit its render count or memory limit); the client starts a fresh one
+on the next request. After answering a shutdown request the daemon exits
+as well, and a socket daemon stops listening first.
+
+mermaid_daemon.js is the real daemon (Node + puppeteer);
+mermaid_daemon_stub.py is a pure-Python stand-in for tests.
+"""
+
+import os
+import json
+import base64
+import socket
+import subprocess
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+DEFAULT_MAX_RENDERS = 500
+DEFAULT_MAX_RSS_MB = 1024
+
+
+class RenderDaemonError(Exception):
+    """Raised when the render daemon fails to render a diagram."""
+
+
+class RenderDaemonUnavailable(RenderDaemonError):
+    """Raised when the render daemon cannot be started or reached."""
+
+
+def default_daemon_command() -> List[str]:
+    """Command line that starts the Node render daemon."""
+    return ['node', str(Path(__file__).with_name('mermaid_daemon.js'))]
+
+
+def _node_env() -> Dict[str, str]:
+    """
+    Environment for the Node daemon.
+
+    puppeteer and mermaid normally come with a global mermaid-cli install,
+    so the global node_modules directories are added to NODE_PATH.
+    """
+    env = os.environ.copy()
+    try:
+        npm_root = subprocess.run(
+            ['npm', 'root', '-g'], check=True, capture_output=True, text=True
+        ).stdout.strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return env
+
+    paths = [npm_root, os.path.join(npm_root, '@mermaid-js', 'mermaid-cli', 'node_modules')]
+    if env.get('NODE_PATH'):
+        paths.append(env['NODE_PATH'])
+    env['NODE_PATH'] = os.pathsep.join(paths)
+    return env
+
+
+class RenderDaemonClient:
+    """Send render jobs to a render daemon, starting it when needed."""
+
+    def __init__(self, command: Optional[List[str]] = None,
+                 socket_path: Optional[str] = None,
+                 max_renders: int = DEFAULT_MAX_RENDERS,
+                 max_rss_mb: int = DEFAULT_MAX_RSS_MB,
+                 start_timeout: float = 60):
+        """
+        Initialize the client. The daemon is started lazily on first use.
+
+        Args:
+            command: Command that starts the daemon (default: the Node daemon)
+            socket_path: Unix socket to use instead of a private pipe; a daemon
+                already listening there is reused across runs
+            max_renders: Renders after which the daemon recycles itself
+            max_rss_mb: Memory use in MB after which the daemon recycles itself
+            start_timeout: Seconds to wait for a daemon to start listening
+        """
+        self.command = command or default_daemon_command()
+        self.socket_path = socket_path
+        self.max_renders = max_renders
+        self.max_rss_mb = max_rss_mb
+        self.start_timeout = start_timeout
+        self.restarts = 0
+        self._lock = threading.Lock()
+        self._process = None
+        self._sock = None
+        self._reader = None
+        self._writer = None
+        self._next_id = 0
+
+    def _daemon_args(self) -> List[str]:
+        return [
+            '--max-renders', str(self.max_renders),
+            '--max-rss-mb', str(self.max_rss_mb)
+        ]
+
+    def _spawn(self, extra_args: List[str], **popen_kwargs) -> subprocess.Popen:
+        env = _node_env() if Path(self.command[0]).name == 'node' else None
+        try:
+            return subprocess.Popen(
+                self.command + self._daemon_args() + extra_args,
+                env=env,
+                **popen_kwargs
+            )
+        except OSError as e:
+            raise RenderDaemonUnavailable(f"could not start render daemon: {e}")
+
+    def _connect(self):
+        """Start or connect to a daemon."""
+        if self.socket_path:
+            self._connect_socket()
+        else:
+            self._start_pipe()
+
+    def _start_pipe(self):
+        self._process = self._spawn(
+            [],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            encoding='utf-8'
+        )
+        self._reader = self._process.stdout
+        self._writer = self._process.stdin
+
+        # Wait until the daemon reports that its browser page is ready
+        line = self._reader.readline()
+        if not line or not json.loads(line).get('ready'):
+            self._disconnect()
+            raise RenderDaemonUnavailable("render daemon exited during startup")
+
+    def _open_socket(self) -> bool:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            return False
+        self._sock = sock
+        self._reader = sock.makefile('r', encoding='utf-8')
+        self._writer = sock.makefile('w', encoding='utf-8')
+        return True
+
+    def _connect_socket(self):
+        if self._open_socket():
+            return
+
+        # No daemon listening yet: start a detached one that outlives this run
+        self._spawn(
+            ['--socket', self.socket_path],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True
+        )
+        deadline = time.monotonic() + self.start_timeout
+        while time.monotonic() < deadline:
+            if self._open_socket():
+                return
+            time.sleep(0.1)
+        raise RenderDaemonUnavailable(
+            f"render daemon did not start listening on {self.socket_path}"
+        )
+
+    def _disconnect(self):
+        """Drop the connection; a pipe daemon is shut down as well."""
+        for stream in (self._writer, self._reader):
+            if stream is not None:
+                try:
+                    stream.close()
+                except OSError:
+                    pass
+        if self._sock is not None:
+            self._sock.close()
+        if self._process is not None:
+            try:
+                self._process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+                self._process.wait()
+        self._process = None
+        self._sock = None
+        self._reader = None
+        self._writer = None
+
+    def render(self, mermaid_code: str, theme: str = 'default',
+               background: str = 'white') -> bytes:
+        """
+        Render a diagram with the daemon.
+
+        Args:
+            mermaid_code: The mermaid diagram code
+            theme: Mermaid theme
+            background: Background color
+
+        Returns:
+            PNG image bytes
+
+        Raises:
+            RenderDaemonUnavailable: If no daemon could be started or reached
+            RenderDaemonError: If the daemon could not render the diagram
+        """
+        with self._lock:
+            if self._reader is None:
+                self._connect()
+
+            self._next_id += 1
+            request = {
+                'id': self._next_id,
+                'code': mermaid_code,
+                'theme': theme,
+                'background': background
+            }
+            try:
+                self._writer.write(json.dumps(request) + '\n')
+                self._writer.flush()
+                line = self._reader.readline()
+            except OSError as e:
+                self._disconnect()
+                raise RenderDaemonError(f"lost connection to render daemon: {e}")
+
+            if not line:
+                self._disconnect()
+                raise RenderDaemonError("render daemon exited unexpectedly")
+
+            response = json.loads(line)
+            if response.get('recycle'):
+                # The daemon exits after this response; start afresh next time
+                self._disconnect()
+                self.restarts += 1
+
+        if not response.get('ok'):
+            raise RenderDaemonError(response.get('error', 'unknown render daemon error'))
+        return base64.b64decode(response['image'])
+
+    def close(self):
+        """Close the connection. A socket daemon keeps running for later runs."""
+        with self._lock:
+            self._disconnect()
+
+    def shutdown(self):
+        """
+        Stop the daemon, including a socket daemon shared with other runs.
+
+        Does nothing if no daemon is running.
+        """
+        with self._lock:
+            if self._reader is None and not (self.socket_path and self._open_socket()):
+                return
+            self._next_id += 1
+            try:
+                self._writer.write(json.dumps({'id': self._next_id, 'shutdown': True}) + '\n')
+                self._writer.flush()
+                self._reader.readline()
+            except OSError:
+                pass  # The daemon is gone already
+            self._disconnect()
+
@@ -0,0 +1,197 @@
+"""
+Chunked sending of Docs batchUpdate requests.
+
+A long document turns into tens of thousands of Docs requests, more than
+one documents().batchUpdate call accepts. RequestScheduler splits the
+request list into chunks bounded by request count and payload size and
+sends them in order. Requests in a chunk apply in order and chunks are
+sent one after another, so the document ends up exactly as if the whole
+list had been sent at once.
+
+batchUpdate is atomic: a chunk that fails changed nothing, so it can be
+sent again. Chunks that fail with a size, rate-limit or server error are
+split and resent, and the chunk size follows the observed latency.
+"""
+
+import json
+import time
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from googleapiclient.errors import HttpError
+
+from api_batch import RETRYABLE_STATUSES
+
+
+DEFAULT_CHUNK_REQUESTS = 500
+DEFAULT_CHUNK_MB = 2
+# Chunks slower than this shrink, chunks much faster grow back
+DEFAULT_TARGET_SECONDS = 10.0
+# 413: payload too large; the chunk is split without waiting first
+SIZE_STATUSES = {413}
+# A 403 from the Docs API means no access rather than a rate limit
+TRANSIENT_STATUSES = RETRYABLE_STATUSES - {403}
+# JSON overhead of the {"requests": [...]} body around the requests
+BODY_OVERHEAD = len(json.dumps({'requests': []}))
+
+
+def request_size(request: Dict) -> int:
+    """Serialized size of one request in bytes, as googleapiclient sends it."""
+    # json.dumps escapes non-ASCII characters, so characters are bytes
+    return len(json.dumps(request)) + 2  # plus the ', ' separating it from the next
+
+
+class RequestScheduler:
+    """
+    Send Docs requests as a series of bounded batchUpdate calls.
+
+    The next chunk is measured while the previous one is in flight. The
+    request limit per chunk starts at max_requests, shrinks when a chunk
+    takes longer than target_seconds or fails, and grows back when chunks
+    come back quickly, though never past a size the API rejected.
+    """
+
+    def __init__(self, max_requests: int = DEFAULT_CHUNK_REQUESTS,
+                 max_bytes: int = DEFAULT_CHUNK_MB * 1024 * 1024,
+                 target_seconds: float = DEFAULT_TARGET_SECONDS,
+                 retries: int = 5):
+        """
+        Initialize the scheduler.
+
+        Args:
+            max_requests: Maximum requests per batchUpdate call
+            max_bytes: Maximum serialized body size per batchUpdate call
+            target_seconds: Latency a chunk should stay under
+            retries: Failures of a single-request chunk before giving up
+        """
+        self.max_requests = max(1, max_requests)
+        self.max_bytes = max_bytes
+        self.target_seconds = target_seconds
+        self.retries = retries
+        self.chunk_requests = self.max_requests  # Current limit, adapted as chunks are sent
+        self.size_limit = self.max_requests  # Lowered when a chunk is rejected as too large
+        self.chunk_bytes = []  # Body size of every chunk sent
+        self.chunk_seconds = []  # Latency of every chunk sent
+        self.resent = 0  # Chunks that failed and were sent again, split
+        self.documents = 0
+        self._last_doc_id = None
+
+    def send(self, docs_service, doc_id: str, requests: List[Dict]) -> int:
+        """
+        Apply requests to a document in order.
+
+        Args:
+            docs_service: Google Docs service
+            doc_id: ID of the document to update
+            requests: Docs requests, in the order they must be applied
+
+        Returns:
+            Number of batchUpdate calls made
+        """
+        if not requests:
+            return 0
+        if doc_id != self._last_doc_id:
+            # Several sends in a row to one document (streaming) count once
+            self.documents += 1
+            self._last_doc_id = doc_id
+        sizes = []  # Serialized size per request, measured as chunks are formed
+        calls = 0
+        failures = 0
+        start = 0
+        in_flight = None  # (future, start, end, body bytes)
+
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            while start < len(requests) or in_flight is not None:
+                # Form the next chunk while the previous one is being sent
+                chunk = self._next_chunk(requests, sizes, start) if start < len(requests) else None
+
+                if in_flight is not None:
+                    future, sent_start, sent_end, sent_bytes = in_flight
+                    in_flight = None
+                    calls += 1
+                    try:
+                        seconds = future.result()
+                    except HttpError as e:
+                        failures = self._handle_failure(e, sent_end - sent_start, failures)
+                        start = sent_start  # Form the chunk again under the new limit
+                        continue
+                    failures = 0
+                    self._record_success(sent_end - sent_start, sent_bytes, seconds)
+
+                if chunk is None:
+                    break
+                end, body_bytes = chunk
+                in_flight = (
+                    pool.submit(self._execute, docs_service, doc_id, requests[start:end]),
+                    start, end, body_bytes
+                )
+                start = end
+
+        return calls
+
+    def _next_chunk(self, requests: List[Dict], sizes: List[int], start: int):
+        """Return (end, body bytes) of the chunk starting at start."""
+        end = start
+        body_bytes = BODY_OVERHEAD
+        limit = min(len(requests), start + self.chunk_requests)
+        while end < limit:
+            if end == len(sizes):
+                sizes.append(request_size(requests[end]))
+            # A chunk always takes at least one request, however large
+            if end > start and body_bytes + sizes[end] > self.max_bytes:
+                break
+            body_bytes += sizes[end]
+            end += 1
+        return end, body_bytes
+
+    @staticmethod
+    def _execute(docs_service, doc_id: str, chunk: List[Dict]) -> float:
+        """Send one chunk; returns its latency in seconds."""
+        begin = time.perf_counter()
+        docs_service.documents().batchUpdate(
+            documentId=doc_id,
+            body={'requests': chunk}
+        ).execute()
+        return time.perf_counter() - begin
+
+    def _record_success(self, count: int, body_bytes: int, seconds: float):
+        self.chunk_bytes.append(body_bytes)
+        self.chunk_seconds.append(seconds)
+        if seconds > self.target_seconds:
+            self.chunk_requests = max(1, int(count * self.target_seconds / seconds))
+        elif seconds < self.target_seconds / 2:
+            self.chunk_requests = min(self.size_limit, self.chunk_requests * 2)
+
+    def _handle_failure(self, error: HttpError, count: int, failures: int) -> int:
+        """Shrink the chunk limit after a failed chunk, or re-raise; returns the failure count."""
+        status = error.resp.status
+        if status not in TRANSIENT_STATUSES | SIZE_STATUSES:
+            raise error
+        if count == 1:
+            # Nothing left to split: retry the request on its own a few times
+            failures += 1
+            if failures > self.retries:
+                raise error
+        self.resent += 1
+        self.chunk_requests = max(1, count // 2)
+        if status in SIZE_STATUSES:
+            # Do not grow back into a size the API has rejected
+            self.size_limit = min(self.size_limit, self.chunk_requests)
+        print(f"batchUpdate of {count} request(s) failed ({status}), resending in chunks of {self.chunk_requests}")
+        if status not in SIZE_STATUSES:
+            time.sleep(min(2 ** failures, 30) * 0.5)
+        return failures
+
+    def stats(self) -> str:
+        """Return a one-line summary of the chunks sent."""
+        chunks = len(self.chunk_bytes)
+        if not chunks:
+            return "Docs batchUpdate: nothing sent"
+        summary = (f"Docs batchUpdate: {chunks} chunk(s) for {self.documents} document(s), "
+                   f"{statistics.mean(self.chunk_bytes) / 1024:.1f} KB mean / "
+                   f"{max(self.chunk_bytes) / 1024:.1f} KB max per chunk, "
+                   f"{statistics.mean(self.chunk_seconds) * 1000:.0f} ms mean latency")
+        if self.resent:
+            summary += f", {self.resent} resent after errors"
+        return summary
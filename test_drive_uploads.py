@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""Tests for Drive image uploads, run against the in-memory Drive stub."""
+
+import os
+import time
+import tempfile
+import threading
+
+import pytest
+from googleapiclient.errors import HttpError
+
+from api_batch import BatchQueue
+from drive_uploads import UploadManifest
+from google_api_stub import DriveStub, DocsStub, http_error
+from md2gdocs import MarkdownToGoogleDocs, PUBLIC_READER
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'diagram'
+
+
+def _converter(manifest_path=None) -> MarkdownToGoogleDocs:
+    converter = MarkdownToGoogleDocs()
+    if manifest_path is not None:
+        converter.upload_manifest = UploadManifest(manifest_path)
+    return converter
+
+
+def test_upload_without_manifest_always_uploads():
+    drive = DriveStub()
+    converter = _converter()
+    first = converter.upload_image_to_drive(PNG, drive)
+    second = converter.upload_image_to_drive(PNG, drive)
+    assert first != second
+    assert drive.files_by_id[first]['content'] == PNG
+    assert drive.count('files.create') == 2
+    assert drive.count('permissions.create') == 2
+
+
+def test_manifest_reuses_uploads_across_runs():
+    drive = DriveStub()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'uploads.json')
+        file_id = _converter(path).upload_image_to_drive(PNG, drive)
+
+        # A later run finds the image in the manifest and only checks it exists
+        converter = _converter(path)
+        assert converter.upload_image_to_drive(PNG, drive) == file_id
+        assert converter.upload_image_to_drive(PNG, drive) == file_id
+        assert drive.count('files.create') == 1
+        assert drive.count('files.get') == 1
+        assert converter.upload_manifest.hits == 2
+
+        # Different bytes are a different image
+        assert converter.upload_image_to_drive(PNG + b'2', drive) != file_id
+
+
+def test_stale_manifest_entries_are_replaced():
+    drive = DriveStub()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'uploads.json')
+        file_id = _converter(path).upload_image_to_drive(PNG, drive)
+        del drive.files_by_id[file_id]
+
+        converter = _converter(path)
+        new_id = converter.upload_image_to_drive(PNG, drive)
+        assert new_id != file_id
+        assert converter.upload_manifest.invalidated == 1
+        assert UploadManifest(path).get(UploadManifest.make_key(PNG)) == new_id
+
+        # Trashed files are not reused either
+        drive.files_by_id[new_id]['trashed'] = True
+        assert _converter(path).upload_image_to_drive(PNG, drive) not in (file_id, new_id)
+
+
+def test_small_images_use_multipart_upload():
+    drive = DriveStub()
+    converter = _converter()
+    converter.resumable_threshold = 64
+    converter.upload_image_to_drive(PNG, drive)
+    converter.upload_image_to_drive(PNG * 20, drive)
+    uploads = [kwargs['media_body'] for method, kwargs in drive.calls if method == 'files.create']
+    assert [media.resumable() for media in uploads] == [False, True]
+
+    stats = converter.upload_stats
+    assert len(stats.latencies['multipart']) == 1
+    assert len(stats.latencies['resumable']) == 1
+    # multipart: 1 request; resumable: session start + 1 chunk; plus 2 permissions
+    assert stats.calls == {'files.create': 3, 'permissions.create': 2}
+    assert 'multipart upload(s)' in stats.stats()
+
+
+def test_shared_folder_replaces_per_image_permissions():
+    drive = DriveStub()
+    converter = _converter()
+    converter.image_folder = "Team's diagrams"
+    ids = [converter.upload_image_to_drive(PNG + bytes([i]), drive) for i in range(3)]
+
+    folder_id = converter._image_folder_id
+    assert all(drive.files_by_id[file_id]['parents'] == [folder_id] for file_id in ids)
+    # One permission on the folder, none on the images
+    assert list(drive.permissions_by_file) == [folder_id]
+    assert drive.count('files.list') == 1
+    assert drive.count('files.create') == 4
+
+    # A new process finds the existing folder instead of creating another
+    other = _converter()
+    other.image_folder = "Team's diagrams"
+    other.upload_image_to_drive(PNG, drive)
+    assert other._image_folder_id == folder_id
+    assert len(drive.permissions_by_file[folder_id]) == 1
+
+
+def test_parallel_uploads_keep_block_order():
+    drive = DriveStub(latency=0.05)
+    services = []
+
+    def build_service():
+        services.append(threading.get_ident())
+        return drive
+
+    converter = _converter()
+    converter.upload_jobs = 4
+    converter._build_drive_service = build_service
+    images = [PNG + bytes([i]) for i in range(8)]
+    images[5] = None  # Failed render
+    images[6] = images[0]  # Same diagram twice
+    start = time.monotonic()
+    try:
+        file_ids = converter.upload_images(images)
+    finally:
+        converter.close()
+
+    # 6 distinct images x 2 calls x 50 ms would take 0.6 s one at a time
+    assert time.monotonic() - start < 0.4
+    assert [drive.files_by_id[file_id]['content'] for file_id in file_ids if file_id] == \
+        [image for image in images if image]
+    assert file_ids[5] is None and file_ids[6] == file_ids[0]
+    # One service per worker thread, plus the caller's for the batched permissions
+    assert len(services) == len(set(services)) <= 5
+    assert drive.count('permissions.create') == 6
+    assert drive.round_trips == 6 + 1
+
+
+def test_images_are_shared_directly_when_the_batch_fails_them():
+    drive = DriveStub()
+    drive.batch_failures.extend([None, 400])
+    converter = _converter()
+    converter._build_drive_service = lambda: drive
+    try:
+        file_ids = converter.upload_images([PNG + bytes([i]) for i in range(3)])
+    finally:
+        converter.close()
+    assert all(drive.permissions_by_file[file_id] == [PUBLIC_READER] for file_id in file_ids)
+    assert drive.count('permissions.create') == 3
+
+
+def test_upload_error_is_not_hidden_by_a_sharing_error():
+    class FailingDrive(DriveStub):
+        def _files_create(self, body, media_body=None, fields=None):
+            if media_body.getbytes(0, media_body.size()).endswith(b'\x02'):
+                raise http_error(500, 'upload failed')
+            return super()._files_create(body, media_body, fields)
+
+        def _permissions_create(self, fileId, body, fields=None):
+            raise http_error(400, 'sharing failed')
+
+    drive = FailingDrive()
+    converter = _converter()
+    converter._build_drive_service = lambda: drive
+    try:
+        with pytest.raises(HttpError, match='upload failed'):
+            converter.upload_images([PNG + bytes([i]) for i in range(3)])
+    finally:
+        converter.close()
+
+
+def test_batch_queue_routes_results_and_retries_failures():
+    drive = DriveStub()
+    for i in range(5):
+        drive.files_by_id[f"f{i}"] = {'id': f"f{i}", 'trashed': False}
+    drive.batch_failures.extend([None, 503, None, 404])  # 2nd and 4th sub-request fail
+    results = {}
+    queue = BatchQueue(drive, max_batch_size=3)
+    for i in range(5):
+        queue.add(
+            'permissions.create',
+            lambda service, i=i: service.permissions().create(fileId=f"f{i}", body=PUBLIC_READER),
+            lambda response, error, i=i: results.__setitem__(i, (response, error))
+        )
+    assert len(queue) == 5
+
+    # The 404 is not worth retrying; the 503 succeeds when sent on its own
+    assert queue.flush() == 1
+    assert sorted(results) == list(range(5))
+    assert results[1] == ({'id': 'perm-f1'}, None)
+    assert results[3][1].resp.status == 404
+    assert all(results[i][1] is None for i in (0, 1, 2, 4))
+    assert queue.batches == 2 and queue.retried == 1
+    assert drive.round_trips == 3
+
+
+def test_batch_queue_sends_calls_alone_when_the_batch_fails():
+    drive = DriveStub()
+    for i in range(3):
+        drive.files_by_id[f"f{i}"] = {'id': f"f{i}", 'trashed': False}
+    drive.broken_batches = 1
+    results = {}
+    queue = BatchQueue(drive)
+    for i in range(4):
+        queue.add(
+            'permissions.create',
+            lambda service, i=i: service.permissions().create(fileId=f"f{i}", body=PUBLIC_READER),
+            lambda response, error, i=i: results.__setitem__(i, (response, error))
+        )
+
+    # Every callback runs; f3 does not exist
+    assert queue.flush() == 1
+    assert [results[i] for i in range(3)] == [({'id': f"perm-f{i}"}, None) for i in range(3)]
+    assert results[3][1].resp.status == 404
+    assert queue.retried == 4
+    assert drive.round_trips == 1 + 4
+
+
+def test_directory_documents_are_created_in_one_batch():
+    docs = DocsStub()
+    converter = _converter()
+    converter._build_docs_service = lambda: docs
+    assert converter._create_documents(['a', 'b', 'c']) == ['doc1', 'doc2', 'doc3']
+    assert docs.round_trips == 1
+    assert [doc.title for doc in docs.documents_by_id.values()] == ['a', 'b', 'c']
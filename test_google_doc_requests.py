@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""Tests for the Docs requests built by md2gdocs, run against the in-memory Docs stub."""
+
+from google_api_stub import DocsStub, INLINE_IMAGE, TABLE_START
+from google_doc_fixtures import MARKDOWN, STYLED_MARKDOWN, build_google_doc
+import md2gdocs
+from md2gdocs import coalesce_text_styles, table_cell_index
+
+
+def _tables(document):
+    """Cell texts of every table in the document."""
+    return [
+        [
+            [''.join(run['textRun']['content'] for run in cell['content'][0]['paragraph']['elements']).rstrip('\n')
+             for cell in row['tableCells']]
+            for row in element['table']['tableRows']
+        ]
+        for element in document.body()['content'] if 'table' in element
+    ]
+
+
+def test_table_cell_index_matches_document_layout():
+    docs = DocsStub()
+    doc_id = docs.documents().create(body={'title': 't'}).execute()['documentId']
+    docs.documents().batchUpdate(documentId=doc_id, body={'requests': [
+        {'insertText': {'location': {'index': 1}, 'text': 'abc\n'}},
+        {'insertTable': {'rows': 3, 'columns': 2, 'location': {'index': 5}}},
+    ]}).execute()
+    table = next(e for e in docs._documents_get(doc_id)['body']['content'] if 'table' in e)
+    assert table['startIndex'] == 6
+    for row in range(3):
+        for column in range(2):
+            cell = table['table']['tableRows'][row]['tableCells'][column]
+            assert cell['content'][0]['startIndex'] == table_cell_index(6, 2, row, column)
+
+
+def test_tables_are_filled_without_fetching_the_document():
+    docs, document = build_google_doc(MARKDOWN)
+    assert docs.count('documents.get') == 0
+    assert docs.count('documents.batchUpdate') == 1
+    assert _tables(document) == [
+        [['Name', 'Value'], ['alpha', '1'], ['beta', '2']],
+        [['Key', 'Description', 'Note'], ['x', 'first', ''], ['y', 'second', 'last']],
+    ]
+    text = document.text()
+    # Content after each table lands after it, in order
+    assert text.index('Between the tables.') > text.index(TABLE_START)
+    assert text.rindex('Closing paragraph.') > text.rindex(TABLE_START)
+    # Header cells are bold, body cells are not
+    bold = {run.strip() for run, style in document.runs() if style.get('bold')}
+    assert {'Name', 'Value', 'Key', 'Description', 'Note', 'bold'} <= bold
+    assert 'alpha' not in bold
+    assert len(document.cell_styles) == 5
+
+
+def test_verify_mode_checks_computed_indices(capsys):
+    docs, _ = build_google_doc(MARKDOWN, verify_table_indices=True)
+    assert docs.count('documents.get') == 1
+    assert '2 table(s) match the computed indices' in capsys.readouterr().out
+
+
+def test_blocks_are_inserted_back_to_front():
+    markdown_text = "| A | B |\n|---|---|\n| 1 | 2 |\n\n```mermaid\ngraph TD\n```\n\nText after.\n\n| C |\n|---|\n| 3 |\n"
+    docs, document = build_google_doc(markdown_text)
+    request_lists = [call[1]['body']['requests'] for call in docs.calls if call[0] == 'documents.batchUpdate']
+    assert len(request_lists) == 1
+    # Every block goes in at index 1, the last block first
+    locations = [request[kind]['location']['index'] for request in request_lists[0]
+                 for kind in ('insertTable', 'insertInlineImage') if kind in request]
+    assert locations == [1, 1, 1]
+    assert 'insertTable' in request_lists[0][0] and request_lists[0][0]['insertTable']['columns'] == 1
+    assert _tables(document) == [[['A', 'B'], ['1', '2']], [['C'], ['3']]]
+    text = document.text()
+    assert text.index(TABLE_START) < text.index(INLINE_IMAGE) < text.index('Text after.') < text.rindex(TABLE_START)
+
+
+def test_text_styles_are_merged_without_changing_the_document(monkeypatch, capsys):
+    docs, merged = build_google_doc(STYLED_MARKDOWN)
+    merged_count = sum('updateTextStyle' in request
+                       for request in docs.calls[-1][1]['body']['requests'])
+    assert 'Merged 12 text style requests into 8' in capsys.readouterr().out
+
+    monkeypatch.setattr(md2gdocs, 'coalesce_text_styles', lambda requests: requests)
+    docs, unmerged = build_google_doc(STYLED_MARKDOWN)
+    unmerged_count = sum('updateTextStyle' in request
+                         for request in docs.calls[-1][1]['body']['requests'])
+    assert (merged_count, unmerged_count) == (8, 12)
+    assert merged.text() == unmerged.text()
+    assert merged.runs() == unmerged.runs()
+
+
+def test_coalesce_text_styles_keeps_the_last_value_of_each_field():
+    def style(start, end, **text_style):
+        return {'updateTextStyle': {'range': {'startIndex': start, 'endIndex': end},
+                                    'textStyle': text_style, 'fields': ','.join(text_style)}}
+
+    paragraph = {'updateParagraphStyle': {'range': {'startIndex': 1, 'endIndex': 2}}}
+    requests = [style(1, 5, bold=True), paragraph, style(5, 9, bold=True), style(3, 7, bold=False),
+                style(2, 4, bold=True, italic=True)]
+    assert coalesce_text_styles(requests) == [
+        paragraph,
+        style(1, 4, bold=True),
+        style(2, 4, italic=True),
+        {'updateTextStyle': {'range': {'startIndex': 4, 'endIndex': 7},
+                             'textStyle': {'bold': False}, 'fields': 'bold'}},
+        style(7, 9, bold=True),
+    ]
+
+
+def _inserts(docs):
+    requests = docs.calls[-1][1]['body']['requests']
+    return [next(iter(request)) for request in requests if next(iter(request)).startswith('insert')]
+
+
+def test_consecutive_text_blocks_share_one_insert():
+    docs, document = build_google_doc(STYLED_MARKDOWN)
+    assert _inserts(docs) == ['insertText']
+    assert document.text().count('print(') == 2
+
+    # Only images and tables split the text. Back to front: closing text, second
+    # table and its 8 filled cells, image spacing, image, text, first table and its
+    # 6 cells, intro
+    docs, _ = build_google_doc(MARKDOWN)
+    assert _inserts(docs) == (['insertText', 'insertTable'] + ['insertText'] * 8
+                              + ['insertText', 'insertInlineImage', 'insertText', 'insertTable']
+                              + ['insertText'] * 6 + ['insertText'])
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""Tests for the post-render image optimization stage."""
+
+import io
+import os
+import random
+import tempfile
+
+from PIL import Image, ImageDraw
+
+from image_optimizer import ImageOptimizer, image_mimetype
+from mermaid_renderer import OptimizedImageCache
+
+
+def _png(image: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def _diagram(width: int = 2400, height: int = 1800) -> bytes:
+    """Flat artwork with a few boxes and lines, like a rendered flowchart."""
+    image = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(image)
+    for i in range(6):
+        x = 100 + i * 350
+        draw.rectangle([x, 200, x + 250, 400], outline=(51, 51, 51), fill=(236, 236, 255), width=6)
+        draw.line([x + 250, 300, x + 350, 300], fill=(51, 51, 51), width=6)
+    return _png(image)
+
+
+def _photo(width: int = 600, height: int = 450) -> bytes:
+    """Noisy gradient that has far too many colors for a palette."""
+    rng = random.Random(1)
+    image = Image.new('RGB', (width, height))
+    image.putdata([
+        ((x * 255) // width, (y * 255) // height, rng.randrange(256))
+        for y in range(height) for x in range(width)
+    ])
+    return _png(image)
+
+
+def test_downsamples_to_display_size():
+    optimizer = ImageOptimizer((400, 300), dpi=144)
+    original = _diagram()
+    optimized = optimizer.optimize(original)
+    with Image.open(io.BytesIO(optimized)) as image:
+        assert image.size == (800, 600)
+        assert image.format == 'PNG'
+    assert len(optimized) < len(original)
+    assert optimizer.bytes_in - optimizer.bytes_out == len(original) - len(optimized)
+    assert '% saved' in optimizer.stats()
+
+
+def test_unconstrained_height_keeps_aspect_ratio():
+    optimizer = ImageOptimizer((432, None), dpi=100)
+    with Image.open(io.BytesIO(optimizer.optimize(_diagram(1800, 3600)))) as image:
+        assert image.size == (600, 1200)
+
+
+def test_photographic_images_become_jpeg_unless_disabled():
+    photo = _photo()
+    assert image_mimetype(ImageOptimizer((400, 300)).optimize(photo)) == 'image/jpeg'
+    assert image_mimetype(ImageOptimizer((400, 300), allow_jpeg=False).optimize(photo)) == 'image/png'
+    assert image_mimetype(ImageOptimizer((400, 300)).optimize(_diagram())) == 'image/png'
+
+
+def test_small_images_are_never_made_larger():
+    tiny = _png(Image.new('RGB', (10, 10), 'white'))
+    assert len(ImageOptimizer((400, 300)).optimize(tiny)) <= len(tiny)
+
+
+def test_optimized_images_are_cached():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache = OptimizedImageCache(temp_dir)
+        original = _diagram()
+        first = ImageOptimizer((400, 300), cache=cache).optimize(original)
+        second = ImageOptimizer((400, 300), cache=cache).optimize(original)
+        assert first == second
+        assert cache.hits == 1
+        # Different settings are a different entry
+        ImageOptimizer((400, 300), dpi=72, cache=cache).optimize(original)
+        assert cache.misses == 2
+
+
+def test_cached_jpeg_is_not_named_png(tmp_path):
+    cache = OptimizedImageCache(str(tmp_path))
+    ImageOptimizer((400, 300), cache=cache).optimize(_photo())
+    entries = [path for path in tmp_path.glob('*/*') if path.is_file()]
+    assert len(entries) == 1 and entries[0].suffix == ''
+    assert OptimizedImageCache(str(tmp_path)).get(entries[0].name)
+
+
+def test_legacy_png_entries_are_evicted(tmp_path):
+    legacy = tmp_path / 'ab' / f"{'ab' * 32}.png"
+    legacy.parent.mkdir()
+    legacy.write_bytes(b'x' * 1000)
+    os.utime(legacy, (1, 1))
+    cache = OptimizedImageCache(str(tmp_path), max_bytes=1500)
+    cache.put('cd' * 32, b'y' * 1000)
+    assert not legacy.exists()
+    assert cache.get('cd' * 32) == b'y' * 1000
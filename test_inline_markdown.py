@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""Tests for the inline markdown tokenizer."""
+
+from inline_markdown import parse_inline, InlineSpan, BOLD, ITALIC, CODE, LINK
+
+
+def _styled(text):
+    """Cleaned text and (styled substring, style) pairs."""
+    clean, spans = parse_inline(text)
+    return clean, [(clean[span.start:span.end], span.style) for span in spans]
+
+
+def test_emphasis_is_removed_and_spanned():
+    assert _styled('Some **bold**, __strong__, *it* and _em_.') == (
+        'Some bold, strong, it and em.',
+        [('bold', BOLD), ('strong', BOLD), ('it', ITALIC), ('em', ITALIC)],
+    )
+
+
+def test_nested_emphasis():
+    assert _styled('**bold *both* bold**') == (
+        'bold both bold', [('bold both bold', BOLD), ('both', ITALIC)]
+    )
+    clean, spans = _styled('***both***')
+    assert clean == 'both' and sorted(spans) == [('both', BOLD), ('both', ITALIC)]
+
+
+def test_unmatched_and_spaced_markers_stay_in_the_text():
+    assert _styled('2 * 3 * 4') == ('2 * 3 * 4', [])
+    assert _styled('unclosed **bold') == ('unclosed **bold', [])
+    assert _styled('snake_case_name and _em_') == ('snake_case_name and em', [('em', ITALIC)])
+
+
+def test_inline_code_keeps_its_contents():
+    assert _styled('run `a * b_c *` now') == ('run a * b_c * now', [('a * b_c *', CODE)])
+    assert _styled('a `single tick') == ('a `single tick', [])
+
+
+def test_links_keep_their_text_and_url():
+    clean, spans = parse_inline('See [the **docs**](https://example.com/x) now')
+    assert clean == 'See the docs now'
+    assert spans == [InlineSpan(4, 12, LINK, 'https://example.com/x'), InlineSpan(8, 12, BOLD)]
+    assert parse_inline('[a] (b) and [c](d') == ('[a] (b) and [c](d', [])
+
+
+def test_many_spans_in_a_long_line():
+    line = ' '.join(f'**b{i}** *i{i}* `c{i}` plain' for i in range(500))
+    clean, spans = parse_inline(line)
+    assert len(spans) == 1500
+    assert '*' not in clean and '`' not in clean
+    assert [clean[span.start:span.end] for span in spans[-3:]] == ['b499', 'i499', 'c499']
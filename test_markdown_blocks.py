@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""Tests for the block scanner, including a comparison with the regex parser it replaced."""
+
+import re
+from pathlib import Path
+
+from markdown_blocks import (
+    scan_blocks, parse_text, parse_table, TextBlock, TextLine, TableBlock, CodeBlock, MermaidBlock,
+    PARAGRAPH, BLANK
+)
+from google_doc_fixtures import MARKDOWN, STYLED_MARKDOWN
+
+HERE = Path(__file__).parent
+
+
+def _regex_parse(markdown_text):
+    """
+    The parser both converters used before scan_blocks(), kept as a reference.
+
+    It split the text only; the pieces are built into blocks the same way
+    scan_blocks() builds them.
+    """
+    blocks = []
+    mermaid_diagrams = []
+    table_matches = []
+
+    def replace_table(match):
+        table_matches.append(match.group(0))
+        return f'<<<TABLE_{len(table_matches) - 1}>>>'
+
+    text = re.sub(r'(\|.+\|(?:\n\|.+\|)+)', replace_table, markdown_text)
+    parts = re.split(r'```(\w+)?\n(.*?)```', text, flags=re.DOTALL)
+    for i, part in enumerate(parts):
+        if i % 3 == 0:
+            sub_parts = re.split(r'<<<TABLE_(\d+)>>>', part)
+            for j, sub_part in enumerate(sub_parts):
+                if j % 2 == 1:
+                    blocks.append(parse_table(table_matches[int(sub_part)].split('\n')))
+                elif sub_part.strip():
+                    blocks.append(parse_text(sub_part))
+        elif i % 3 == 1:
+            lang = part
+        elif lang and lang.lower() == 'mermaid':
+            mermaid_diagrams.append(part)
+            blocks.append(MermaidBlock(len(mermaid_diagrams) - 1))
+        else:
+            blocks.append(CodeBlock(lang or '', part))
+    return blocks, mermaid_diagrams
+
+
+def test_same_blocks_as_the_regex_parser():
+    for markdown_text in (MARKDOWN, STYLED_MARKDOWN, (HERE / 'example.md').read_text(encoding='utf-8')):
+        assert scan_blocks(markdown_text) == _regex_parse(markdown_text)
+
+
+def test_indented_fence_matches_the_regex_parser_up_to_whitespace():
+    # The regex parser kept the indentation before the closing fence in the code
+    def strip(result):
+        blocks, codes = result
+        return [CodeBlock(block.language, block.content.strip()) if isinstance(block, CodeBlock) else block
+                for block in blocks], codes
+
+    markdown_text = (HERE / 'Google-Credentials-Guide.md').read_text(encoding='utf-8')
+    assert strip(scan_blocks(markdown_text)) == strip(_regex_parse(markdown_text))
+
+
+def test_pipes_in_fenced_code_are_not_a_table():
+    markdown_text = "Intro\n\n```bash\ncat a | grep x |\n| sort | uniq |\n```\n\n| A | B |\n|---|---|\n"
+    blocks, _ = scan_blocks(markdown_text)
+    assert blocks == [
+        parse_text('Intro\n\n'),
+        CodeBlock('bash', 'cat a | grep x |\n| sort | uniq |\n'),
+        TableBlock([['A', 'B']]),
+    ]
+
+
+def test_longer_fences_contain_shorter_ones():
+    markdown_text = "````markdown\n```mermaid\ngraph TD\n```\n````\nAfter\n"
+    blocks, codes = scan_blocks(markdown_text)
+    assert codes == []
+    assert blocks[0] == CodeBlock('markdown', '```mermaid\ngraph TD\n```\n')
+
+
+def test_unclosed_fence_runs_to_the_end():
+    blocks, codes = scan_blocks("Text\n```mermaid\ngraph TD\n    A --> B\n")
+    assert blocks == [parse_text('Text\n'), MermaidBlock(0)]
+    assert codes == ['graph TD\n    A --> B\n']
+
+
+def test_single_pipe_line_is_text():
+    assert scan_blocks("a\n| not a table |\nb\n") == (
+        [TextBlock([
+            TextLine(PARAGRAPH, 0, '', 'a', []),
+            TextLine(PARAGRAPH, 0, '', '| not a table |', []),
+            TextLine(PARAGRAPH, 0, '', 'b', []),
+            TextLine(BLANK, 0, '', '', []),
+        ])], []
+    )
+
+
+def test_blocks_keep_no_instance_dict():
+    blocks, _ = scan_blocks("# Title\n\n| A | B |\n|---|---|\n| 1 | 2 |\n\n```py\nx\n```\n")
+    assert [type(block) for block in blocks] == [TextBlock, TableBlock, CodeBlock]
+    assert blocks[1].rows == [['A', 'B'], ['1', '2']]
+    for obj in blocks + blocks[0].lines:
+        assert not hasattr(obj, '__dict__')
+
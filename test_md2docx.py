@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+"""Tests for the DOCX converter's formatting of parsed blocks."""
+
+from markdown_blocks import scan_blocks
+from md2docx import MarkdownToDocx
+
+
+def test_docx_runs_follow_the_inline_spans():
+    blocks, _ = scan_blocks("Plain **bold *both*** and [`code`](https://example.com)\n")
+    doc = MarkdownToDocx().create_docx('t', blocks, [])
+    runs = [(run.text, bool(run.bold), bool(run.italic), run.font.name, bool(run.underline))
+            for run in doc.paragraphs[-2].runs]
+    assert runs == [
+        ('Plain ', False, False, None, False),
+        ('bold ', True, False, None, False),
+        ('both', True, True, None, False),
+        (' and ', False, False, None, False),
+        ('code', False, False, 'Courier New', True),
+    ]
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""Tests for MermaidRenderer's API backend, run against the local mermaid.ink stub."""
+
+import os
+import json
+import zlib
+import base64
+import time
+import tempfile
+from pathlib import Path
+
+from mermaid_renderer import (
+    MermaidRenderer, RateLimiter, RenderCache, encode_plain, parse_retry_after, validate_diagram
+)
+from mermaid_ink_stub import MermaidInkStub
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+DIAGRAMS = [f"graph TD\n    A{i} --> B{i}\n" for i in range(8)]
+
+
+def test_render_against_configured_base_url():
+    with MermaidInkStub() as server:
+        renderer = MermaidRenderer(api_url=server.url + '/')
+        try:
+            image = renderer.render_to_bytes(DIAGRAMS[0])
+        finally:
+            renderer.close()
+        assert image.startswith(PNG_SIGNATURE)
+        assert server.requests == 1
+
+
+def test_pooled_session_reuses_connections():
+    with MermaidInkStub() as server:
+        renderer = MermaidRenderer(api_url=server.url, jobs=2)
+        try:
+            images = renderer.render_all(DIAGRAMS)
+            images += renderer.render_all(DIAGRAMS)
+        finally:
+            renderer.close()
+        assert all(images)
+        assert server.requests == 2 * len(DIAGRAMS)
+        assert server.connections <= 2
+
+
+def test_without_keep_alive_each_diagram_connects():
+    with MermaidInkStub() as server:
+        renderer = MermaidRenderer(api_url=server.url, jobs=1, keep_alive=False)
+        assert all(renderer.render_all(DIAGRAMS))
+        assert server.connections == len(DIAGRAMS)
+
+
+def _large_sequence_diagram(messages: int) -> str:
+    lines = ['sequenceDiagram']
+    for i in range(messages):
+        lines.append(f"    Client->>Server: request number {i} with a longish label")
+        lines.append(f"    Server-->>Client: response number {i}")
+    return '\n'.join(lines) + '\n'
+
+
+def test_large_diagrams_use_compressed_encoding():
+    renderer = MermaidRenderer()
+    small, large = DIAGRAMS[0], _large_sequence_diagram(40)
+    assert '/img/pako:' not in renderer.api_url_for(small)
+    assert '/img/pako:' in renderer.api_url_for(large)
+    assert len(renderer.api_url_for(large)) < len(encode_plain(large)) / 2
+
+    with MermaidInkStub() as server:
+        renderer = MermaidRenderer(api_url=server.url)
+        try:
+            assert renderer.render_to_bytes(large)
+        finally:
+            renderer.close()
+        assert server.diagrams == [large]
+
+
+def test_overlong_url_is_not_sent(monkeypatch):
+    monkeypatch.setattr('shutil.which', lambda name: None)
+    with MermaidInkStub() as server:
+        renderer = MermaidRenderer(api_url=server.url, max_url_length=200)
+        assert renderer.render_to_bytes(_large_sequence_diagram(40)) is None
+        assert server.requests == 0
+
+
+def test_overlong_url_is_rendered_and_cached_as_cli(monkeypatch):
+    monkeypatch.setattr('shutil.which', lambda name: '/usr/bin/' + name)
+    large = _large_sequence_diagram(40)
+    with MermaidInkStub() as server, tempfile.TemporaryDirectory() as temp_dir:
+        cache = RenderCache(temp_dir)
+        renderer = MermaidRenderer(api_url=server.url, cache=cache, max_url_length=200)
+        monkeypatch.setattr(renderer, '_render_with_cli', lambda code: PNG_SIGNATURE + b'cli')
+        assert renderer.render_to_bytes(large) == PNG_SIGNATURE + b'cli'
+        # Small diagrams still use the API
+        assert renderer.render_to_bytes(DIAGRAMS[0]).startswith(PNG_SIGNATURE)
+        renderer.close()
+        assert server.requests == 1
+        assert cache.get(RenderCache.make_key(large, 'cli', 'default', 'white')) == PNG_SIGNATURE + b'cli'
+        assert cache.get(RenderCache.make_key(large, 'api', 'default', 'white')) is None
+
+
+def test_compressed_encoding_carries_the_theme():
+    url = MermaidRenderer(theme='dark').api_url_for(_large_sequence_diagram(40))
+    state = url.split('/img/pako:')[1]
+    state = json.loads(zlib.decompress(base64.urlsafe_b64decode(state + '=' * (-len(state) % 4))))
+    assert json.loads(state['mermaid']) == {'theme': 'dark'}
+
+
+def test_retry_after_pauses_all_requests():
+    with MermaidInkStub() as server:
+        server.queue_error(429, retry_after='1')
+        renderer = MermaidRenderer(api_url=server.url, jobs=1)
+        start = time.monotonic()
+        try:
+            assert all(renderer.render_all(DIAGRAMS[:3]))
+        finally:
+            renderer.close()
+        assert time.monotonic() - start >= 1
+        assert server.attempts == 4
+        assert renderer.rate_limiter.throttled == 1
+        assert renderer.rate_limiter.rate < renderer.rate_limiter.max_rate
+
+
+def test_retry_after_parsing():
+    assert parse_retry_after('3') == 3
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('soon') is None
+    assert 0 <= parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') < 1
+
+
+def test_circuit_breaker_switches_run_to_placeholders(monkeypatch):
+    monkeypatch.setattr('shutil.which', lambda name: None)
+    with MermaidInkStub() as server:
+        server.always_fail = (503, {'Retry-After': '0'})
+        renderer = MermaidRenderer(api_url=server.url, jobs=1)
+        renderer.rate_limiter = RateLimiter(rate=1000, min_rate=1000)  # Keep the test fast
+        try:
+            images = renderer.render_all(DIAGRAMS)
+        finally:
+            renderer.close()
+        assert renderer.circuit_breaker.is_open
+        # Diagrams after the breaker opened get placeholders without API calls
+        assert images[-1].startswith(PNG_SIGNATURE)
+        assert server.attempts == 3 * renderer.circuit_breaker.min_requests
+
+
+def test_placeholders_are_reported_and_not_cached(monkeypatch):
+    monkeypatch.setattr('shutil.which', lambda name: None)
+    with MermaidInkStub() as server, tempfile.TemporaryDirectory() as temp_dir:
+        cache = RenderCache(temp_dir)
+        renderer = MermaidRenderer(api_url=server.url, cache=cache, jobs=1)
+        # The breaker opened while these diagrams were waiting to be retried
+        renderer.circuit_breaker.is_open = True
+        images = renderer.render_all(DIAGRAMS[:2], source='doc.md')
+        renderer.use_placeholders = True
+        images += renderer.render_all(DIAGRAMS[2:3], source='doc.md')
+        renderer.close()
+        assert all(image.startswith(PNG_SIGNATURE) for image in images)
+        assert [failure[:2] for failure in renderer.failures] == [('doc.md', 0), ('doc.md', 1), ('doc.md', 0)]
+        assert server.attempts == 0
+        assert not list(Path(temp_dir).glob('*/*.png'))
+        assert cache.known_failures == 0
+
+
+def test_invalid_diagrams_are_rejected_locally():
+    assert validate_diagram(DIAGRAMS[0]) is None
+    assert 'unknown diagram type' in validate_diagram('grpah TD\n    A --> B\n')
+    assert 'unclosed' in validate_diagram('graph TD\n    A[Start --> B\n')
+    assert validate_diagram('erDiagram\n    USER ||--o{ ORDER : places\n') is None
+
+    with MermaidInkStub() as server:
+        renderer = MermaidRenderer(api_url=server.url)
+        images = renderer.render_all(['grpah TD\n    A --> B\n', DIAGRAMS[0]], source='doc.md')
+        renderer.close()
+        assert images[0] is None and images[1]
+        assert server.attempts == 1
+        assert renderer.failures == [('doc.md', 0, "unknown diagram type 'grpah'")]
+
+
+def test_failed_diagrams_are_remembered():
+    with MermaidInkStub() as server, tempfile.TemporaryDirectory() as temp_dir:
+        cache = RenderCache(os.path.join(temp_dir, 'cache'))
+        server.queue_error(400, count=1)
+        for _ in range(2):
+            renderer = MermaidRenderer(api_url=server.url, cache=cache)
+            images = renderer.render_all(DIAGRAMS[:1], source='doc.md')
+            renderer.close()
+            assert images == [None]
+            assert renderer.failures[0][:2] == ('doc.md', 0)
+        # The second run skipped the known-bad diagram without a request
+        assert server.attempts == 1
+        assert cache.known_failures == 1
+
+        # Failure records expire
+        expired = RenderCache(os.path.join(temp_dir, 'cache'), failure_ttl=0.01)
+        time.sleep(0.02)
+        renderer = MermaidRenderer(api_url=server.url, cache=expired)
+        assert renderer.render_all(DIAGRAMS[:1])[0]
+        renderer.close()
+
+
+def test_configuration_errors_are_not_remembered(monkeypatch):
+    monkeypatch.setattr('shutil.which', lambda name: None)
+    with MermaidInkStub() as server, tempfile.TemporaryDirectory() as temp_dir:
+        cache = RenderCache(temp_dir)
+        for status in (404, 401, 414):
+            server.queue_error(status)
+            renderer = MermaidRenderer(api_url=server.url, cache=cache)
+            assert renderer.render_all(DIAGRAMS[:1], source='doc.md') == [None]
+            renderer.close()
+        assert not os.path.exists(os.path.join(temp_dir, 'failures.json'))
+        # Once the server is reachable the diagram renders
+        renderer = MermaidRenderer(api_url=server.url, cache=cache)
+        assert renderer.render_all(DIAGRAMS[:1])[0]
+        renderer.close()
+        assert server.attempts == 4
+
+
+def test_cache_round_trips_image_bytes():
+    with MermaidInkStub() as server, tempfile.TemporaryDirectory() as temp_dir:
+        cache = RenderCache(temp_dir)
+        for _ in range(2):
+            renderer = MermaidRenderer(api_url=server.url, cache=cache)
+            image = renderer.render_to_bytes(DIAGRAMS[0])
+            renderer.close()
+            assert image.startswith(PNG_SIGNATURE)
+        assert server.requests == 1
+        assert cache.hits == 1
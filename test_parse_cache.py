@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""Tests for the parse cache and the converter output cached with it."""
+
+import io
+import argparse
+import zipfile
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+import parse_cache
+from google_doc_fixtures import MARKDOWN, STYLED_MARKDOWN, build_google_doc
+from markdown_blocks import scan_blocks
+from md2docx import MarkdownToDocx
+from md2gdocs import MarkdownToGoogleDocs
+from parse_cache import (
+    ParseCache, encode_blocks, decode_blocks, add_parse_cache_arguments, parse_cache_from_args
+)
+
+HERE = Path(__file__).parent
+EXAMPLE = (HERE / 'example.md').read_text(encoding='utf-8')
+
+
+def _no_parsing(*args):
+    raise AssertionError('parsed although the blocks were cached')
+
+
+def test_blocks_survive_encoding():
+    for markdown_text in (MARKDOWN, STYLED_MARKDOWN, EXAMPLE):
+        blocks, _ = scan_blocks(markdown_text)
+        assert decode_blocks(encode_blocks(blocks)) == blocks
+
+
+def test_unchanged_text_is_not_parsed_again(tmp_path, monkeypatch):
+    first = ParseCache(str(tmp_path)).parse(EXAMPLE)
+    monkeypatch.setattr(parse_cache, 'scan_blocks', _no_parsing)
+    cache = ParseCache(str(tmp_path))
+    assert cache.parse(EXAMPLE) == first
+    assert (cache.hits, cache.misses) == (1, 0)
+
+
+def test_changed_text_or_parser_is_parsed_again(tmp_path, monkeypatch):
+    cache = ParseCache(str(tmp_path))
+    cache.parse(EXAMPLE)
+    cache.parse(EXAMPLE + '\nOne more line\n')
+    monkeypatch.setattr(parse_cache, 'parser_version', lambda: 'next')
+    cache.parse(EXAMPLE)
+    assert (cache.hits, cache.misses) == (0, 3)
+
+
+def test_corrupt_entry_is_a_miss(tmp_path):
+    cache = ParseCache(str(tmp_path))
+    expected = cache.parse(MARKDOWN)
+    for path in tmp_path.glob('*/*.marshal'):
+        path.write_bytes(b'\x00truncated')
+    assert cache.parse(MARKDOWN) == expected
+    assert (cache.hits, cache.misses) == (0, 2)
+
+
+def test_cache_options(tmp_path):
+    parser = argparse.ArgumentParser()
+    add_parse_cache_arguments(parser)
+    cache = parse_cache_from_args(parser.parse_args(
+        ['--parse-cache-dir', str(tmp_path), '--parse-cache-max-mb', '5']
+    ))
+    assert cache.cache_dir == tmp_path
+    assert cache.max_bytes == 5 * 1024 * 1024
+    assert parse_cache_from_args(parser.parse_args(['--no-parse-cache'])) is None
+
+
+def _cached_google_doc(markdown_text, cache):
+    blocks, _, source_hash = cache.parse(markdown_text)
+    return build_google_doc(markdown_text, blocks, source_hash, parse_cache=cache)[1]
+
+
+def test_docs_request_plan_is_reused(tmp_path, monkeypatch):
+    first = _cached_google_doc(EXAMPLE, ParseCache(str(tmp_path)))
+    monkeypatch.setattr(MarkdownToGoogleDocs, '_build_document_requests', _no_parsing)
+    second = _cached_google_doc(EXAMPLE, ParseCache(str(tmp_path)))
+    assert second.text() == first.text()
+    assert second.runs() == first.runs()
+    assert second.body() == first.body()
+
+
+@pytest.fixture
+def diagram_png():
+    image = io.BytesIO()
+    Image.new('RGB', (20, 10), 'red').save(image, format='PNG')
+    return image.getvalue()
+
+
+def test_docx_body_is_reused(tmp_path, monkeypatch, diagram_png):
+    converter = MarkdownToDocx()
+    blocks, mermaid_codes = scan_blocks(EXAMPLE)
+    images = [diagram_png] * len(mermaid_codes)
+    converter.create_docx('example', blocks, images).save(str(tmp_path / 'plain.docx'))
+
+    converter.parse_cache = ParseCache(str(tmp_path / 'cache'))
+    converter._save_cached('example', blocks, images, ParseCache.source_hash(EXAMPLE),
+                           str(tmp_path / 'built.docx'))
+    monkeypatch.setattr(MarkdownToDocx, 'create_docx', _no_parsing)
+    converter._save_cached('example', [], images, ParseCache.source_hash(EXAMPLE),
+                           str(tmp_path / 'cached.docx'))
+
+    with zipfile.ZipFile(tmp_path / 'plain.docx') as plain:
+        for name in ('built.docx', 'cached.docx'):
+            with zipfile.ZipFile(tmp_path / name) as output:
+                assert sorted(output.namelist()) == sorted(plain.namelist())
+                for part in plain.namelist():
+                    assert output.read(part) == plain.read(part), (name, part)
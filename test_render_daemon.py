@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""Protocol tests for the render daemon client, run against the pure-Python stub."""
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from mermaid_ink_stub import MermaidInkStub
+from mermaid_renderer import MermaidRenderer, RenderCache
+from render_daemon import RenderDaemonClient, RenderDaemonError
+
+STUB = [sys.executable, str(Path(__file__).with_name('mermaid_daemon_stub.py'))]
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def test_pipe_render_returns_png():
+    client = RenderDaemonClient(command=STUB)
+    try:
+        assert client.render('graph TD; A-->B').startswith(PNG_SIGNATURE)
+        assert client.render('graph TD; B-->C').startswith(PNG_SIGNATURE)
+        assert client.restarts == 0
+    finally:
+        client.close()
+
+
+def test_render_error_is_reported_and_daemon_survives():
+    client = RenderDaemonClient(command=STUB)
+    try:
+        with pytest.raises(RenderDaemonError, match='empty diagram'):
+            client.render('   ')
+        assert client.render('graph TD; A-->B').startswith(PNG_SIGNATURE)
+    finally:
+        client.close()
+
+
+def test_recycles_after_max_renders():
+    client = RenderDaemonClient(command=STUB, max_renders=2)
+    try:
+        for _ in range(5):
+            assert client.render('graph TD; A-->B').startswith(PNG_SIGNATURE)
+        assert client.restarts == 2
+    finally:
+        client.close()
+
+
+def test_recycles_above_memory_threshold():
+    client = RenderDaemonClient(command=STUB, max_rss_mb=1)
+    try:
+        client.render('graph TD; A-->B')
+        client.render('graph TD; A-->B')
+        assert client.restarts == 2
+    finally:
+        client.close()
+
+
+def test_socket_daemon_is_shared_across_clients():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        socket_path = os.path.join(temp_dir, 'render.sock')
+        first = RenderDaemonClient(command=STUB, socket_path=socket_path, max_renders=3)
+        second = RenderDaemonClient(command=STUB, socket_path=socket_path, max_renders=3)
+        try:
+            first.render('graph TD; A-->B')
+            first.close()
+            # The daemon outlives the first client and keeps counting renders
+            second.render('graph TD; A-->B')
+            second.render('graph TD; A-->B')
+            assert second.restarts == 1
+            assert not os.path.exists(socket_path)
+            # The next render starts a fresh daemon on the same socket
+            assert second.render('graph TD; A-->B').startswith(PNG_SIGNATURE)
+        finally:
+            first.close()
+            second.shutdown()
+        assert not os.path.exists(socket_path)
+
+
+def test_unavailable_daemon_falls_back_to_api(tmp_path):
+    client = RenderDaemonClient(command=[str(tmp_path / 'missing-daemon')])
+    closed = []
+    client.close = lambda: closed.append(True)
+    diagrams = [f"graph TD\n    A{i} --> B{i}\n" for i in range(6)]
+    cache = RenderCache(str(tmp_path / 'cache'))
+    with MermaidInkStub() as server:
+        renderer = MermaidRenderer(api_url=server.url, cache=cache, daemon=client, jobs=3)
+        try:
+            images = renderer.render_all(diagrams)
+        finally:
+            renderer.close()
+    assert all(image.startswith(PNG_SIGNATURE) for image in images)
+    assert renderer.daemon is None and closed == [True]
+    # The images are cached as what rendered them
+    for diagram in diagrams:
+        assert cache.get(RenderCache.make_key(diagram, 'api', 'default', 'white'))
+        assert cache.get(RenderCache.make_key(diagram, 'daemon', 'default', 'white')) is None
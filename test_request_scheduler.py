@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""Tests for request_scheduler.py, run against the in-memory Docs stub."""
+
+import json
+
+import pytest
+from googleapiclient.errors import HttpError
+
+from google_api_stub import DocsStub
+from request_scheduler import RequestScheduler
+
+LINES = [f"line {i}\n" for i in range(60)]
+
+
+def _requests():
+    """Requests that only produce the right text when applied in order."""
+    requests = [{'insertText': {'location': {'index': 1}, 'text': line}} for line in reversed(LINES)]
+    # Bold every line after it has been inserted
+    index = 1
+    for line in LINES:
+        requests.append({'updateTextStyle': {
+            'range': {'startIndex': index, 'endIndex': index + len(line) - 1},
+            'textStyle': {'bold': True}, 'fields': 'bold'
+        }})
+        index += len(line)
+    return requests
+
+
+def _send(scheduler, docs=None):
+    docs = docs or DocsStub()
+    doc_id = docs.documents().create(body={'title': 't'}).execute()['documentId']
+    calls = scheduler.send(docs, doc_id, _requests())
+    document = docs.documents_by_id[doc_id]
+    assert document.text() == ''.join(LINES) + '\n'
+    assert {run for run, style in document.runs() if style.get('bold')} == {line[:-1] for line in LINES}
+    return docs, calls
+
+
+def _sent_chunks(docs):
+    return [kwargs['body']['requests'] for method, kwargs in docs.calls if method == 'documents.batchUpdate']
+
+
+def test_chunks_are_bounded_by_request_count_and_keep_order():
+    scheduler = RequestScheduler(max_requests=7)
+    docs, calls = _send(scheduler)
+    chunks = _sent_chunks(docs)
+    assert calls == len(chunks) == 18  # 120 requests, 7 at a time
+    assert all(len(chunk) <= 7 for chunk in chunks)
+    assert len(scheduler.chunk_bytes) == 18
+    assert '18 chunk(s) for 1 document(s)' in scheduler.stats()
+
+
+def test_chunks_are_bounded_by_size():
+    scheduler = RequestScheduler(max_bytes=1024)
+    docs, _ = _send(scheduler)
+    for chunk in _sent_chunks(docs):
+        assert len(json.dumps({'requests': chunk})) <= 1024
+    assert max(scheduler.chunk_bytes) <= 1024
+
+
+def test_rejected_chunks_are_split_and_resent():
+    docs = DocsStub()
+    docs.max_update_requests = 10
+    scheduler = RequestScheduler(max_requests=40)
+    _send(scheduler, docs)
+    assert scheduler.resent == 2  # 40 -> 20 -> 10
+    assert scheduler.size_limit == 10
+    # Two rejected calls, then 120 requests in chunks of 10
+    assert [len(chunk) for chunk in _sent_chunks(docs)] == [40, 20] + [10] * 12
+
+
+def test_transient_errors_are_retried():
+    docs = DocsStub()
+    docs.update_failures.extend([503])
+    scheduler = RequestScheduler(max_requests=50)
+    _send(scheduler, docs)
+    assert scheduler.resent == 1
+
+
+def test_other_errors_are_raised():
+    docs = DocsStub()
+    docs.update_failures.extend([400])
+    with pytest.raises(HttpError):
+        _send(RequestScheduler(), docs)
+
+
+def test_slow_chunks_shrink_the_chunk_size():
+    scheduler = RequestScheduler(max_requests=40, target_seconds=0.01)
+    _send(scheduler, DocsStub(latency=0.02))
+    assert scheduler.chunk_requests < 40
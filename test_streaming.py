@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""Tests for streaming conversion: the line-by-line parser and both writers."""
+
+import io
+import zipfile
+from pathlib import Path
+
+from PIL import Image
+
+import md2docx
+import md2gdocs
+from google_doc_fixtures import MARKDOWN, STYLED_MARKDOWN, build_google_doc
+from markdown_blocks import scan_blocks, iter_blocks, read_mermaid_codes, TextBlock
+from md2docx import MarkdownToDocx
+
+HERE = Path(__file__).parent
+SAMPLES = [
+    MARKDOWN,
+    STYLED_MARKDOWN,
+    (HERE / 'example.md').read_text(encoding='utf-8'),
+    (HERE / 'Google-Credentials-Guide.md').read_text(encoding='utf-8'),
+    "",
+    "| only | one |",
+    "a\n| A | B |\n|---|---|\n| 1 | 2 |",
+    "text\n```mermaid\ngraph TD\n",
+]
+
+
+def _streamed(markdown_text, text_lines):
+    """Blocks from iter_blocks() over a file, with split text blocks joined again."""
+    codes = []
+    blocks = []
+    for block in iter_blocks(io.StringIO(markdown_text), codes, text_lines=text_lines):
+        if isinstance(block, TextBlock) and blocks and isinstance(blocks[-1], TextBlock):
+            blocks[-1] = TextBlock(blocks[-1].lines + block.lines)
+        else:
+            blocks.append(block)
+    return blocks, codes
+
+
+def test_streamed_blocks_match_scan_blocks():
+    for markdown_text in SAMPLES:
+        for text_lines in (1, 3, 1000):
+            assert _streamed(markdown_text, text_lines) == scan_blocks(markdown_text)
+
+
+def test_long_text_is_yielded_in_bounded_blocks():
+    markdown_text = ''.join(f"Line {i} with **bold**\n" for i in range(2500))
+    blocks = list(iter_blocks(io.StringIO(markdown_text), [], text_lines=1000))
+    assert [len(block.lines) for block in blocks] == [1000, 1000, 501]
+
+
+def test_read_mermaid_codes_matches_scan_blocks(tmp_path):
+    path = tmp_path / 'example.md'
+    path.write_text(SAMPLES[2], encoding='utf-8')
+    assert read_mermaid_codes(str(path)) == scan_blocks(SAMPLES[2])[1]
+
+
+def test_streamed_google_doc_matches_the_whole_one(monkeypatch):
+    monkeypatch.setattr(md2gdocs, 'STREAM_CHUNK_LINES', 5)
+    for markdown_text in (MARKDOWN, STYLED_MARKDOWN, SAMPLES[2]):
+        _, whole = build_google_doc(markdown_text)
+        docs, streamed = build_google_doc(
+            markdown_text, iter_blocks(io.StringIO(markdown_text), [], text_lines=3), stream=True
+        )
+        assert docs.count('documents.batchUpdate') > 1
+        assert streamed.text() == whole.text()
+        assert streamed.runs() == whole.runs()
+        assert streamed.body() == whole.body()
+
+
+def test_streamed_docx_matches_the_whole_one(monkeypatch, tmp_path):
+    monkeypatch.setattr(md2docx, 'STREAM_FLUSH_ELEMENTS', 3)
+    image = io.BytesIO()
+    Image.new('RGB', (20, 10), 'red').save(image, format='PNG')
+    converter = MarkdownToDocx()
+    markdown_text = SAMPLES[2]
+    blocks, mermaid_codes = converter.parse_markdown(markdown_text)
+    images = [image.getvalue()] * len(mermaid_codes)
+
+    converter.create_docx('t', blocks, images).save(str(tmp_path / 'whole.docx'))
+    converter.write_docx_streaming('t', iter_blocks(io.StringIO(markdown_text), [], text_lines=3),
+                                   images, str(tmp_path / 'streamed.docx'))
+
+    with zipfile.ZipFile(tmp_path / 'whole.docx') as whole, \
+            zipfile.ZipFile(tmp_path / 'streamed.docx') as streamed:
+        assert sorted(whole.namelist()) == sorted(streamed.namelist())
+        for name in whole.namelist():
+            assert whole.read(name) == streamed.read(name), name